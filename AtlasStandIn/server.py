@@ -0,0 +1,188 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+
+# This is a local stand-in for the Atlas / Purview bulk entity endpoint.
+# It does NOT store anything. It only accepts the same requests as the real
+# service and answers with a response of the same shape so that the upload
+# stage (see `ingestor_upload.py`) can be exercised and benchmarked offline.
+#
+# You can point an AtlasClient at it:
+#   AtlasClient("http://localhost:21000/api/atlas/v2", BasicAuthentication("admin", "admin"))
+#
+# With --rate-limit it throttles like Purview does: requests beyond the
+# limit (per second, shared by every client) are answered with a 429, so the
+# rate governor (see `ingestor_governor.py`) can be tried out offline.
+
+BULK_PATH = "/api/atlas/v2/entity/bulk"
+
+
+class StandInState():
+    """
+    Settings and counters shared by every request handler thread.
+    """
+
+    def __init__(self, latency=0.0, entity_latency=0.0, max_entities=None, failure_rate=0.0,
+                 rate_limit=None):
+        self.latency = latency
+        self.entity_latency = entity_latency
+        self.max_entities = max_entities
+        self.failure_rate = failure_rate
+        self.rate_limit = rate_limit
+        self.lock = threading.Lock()
+        self.guids = itertools.count(1)
+        self.requests = 0
+        self.entities = 0
+        self.failures = 0
+        self.throttled = 0
+        # The server's own token bucket, a second's worth of requests
+        self.allowance = rate_limit or 0.0
+        self.last_check = time.monotonic()
+
+    def admit(self):
+        """
+        Whether a request is within the rate limit (with the lock held).
+        """
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        self.allowance = min(self.rate_limit,
+                             self.allowance + (now - self.last_check) * self.rate_limit)
+        self.last_check = now
+        if self.allowance < 1:
+            self.throttled += 1
+            return False
+        self.allowance -= 1
+        return True
+
+
+class AtlasStandIn(BaseHTTPRequestHandler):
+    state = StandInState()
+    # Keep connections alive between requests like the real service does.
+    # Every response has a Content-Length, which HTTP/1.1 needs. The headers
+    # and the body are written separately, so Nagle's algorithm would hold
+    # the body back on a kept alive connection.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep the benchmark output clean
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        content = bytes(json.dumps(body), "utf-8")
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path != BULK_PATH:
+            self._send_json(404, {"errorCode": "ATLAS-404-00-001",
+                                  "errorMessage": "Unknown path " + self.path})
+            return
+
+        with self.state.lock:
+            admitted = self.state.admit()
+        if not admitted:
+            # The same kind of answer Azure gives when a client is throttled
+            self._send_json(429, {"error": {
+                "code": "TooManyRequests",
+                "message": "Rate limit is exceeded. Try again in 1 seconds."}},
+                {"Retry-After": "1"})
+            return
+
+        entities = payload.get("entities", [])
+        # Big payloads take longer for the real service to process
+        delay = self.state.latency + self.state.entity_latency * len(entities)
+        if delay:
+            time.sleep(delay)
+
+        with self.state.lock:
+            self.state.requests += 1
+            failed = random.random() < self.state.failure_rate
+            if failed:
+                self.state.failures += 1
+
+        if failed:
+            # A transient failure, the uploader should retry this batch
+            self._send_json(503, {"message": "Service Unavailable"})
+            return
+        if self.state.max_entities and len(entities) > self.state.max_entities:
+            self._send_json(413, {"errorCode": "ATLAS-413-00-001",
+                                  "errorMessage": "Request payload too large"})
+            return
+
+        guid_assignments = {}
+        with self.state.lock:
+            self.state.entities += len(entities)
+            for entity in entities:
+                guid_assignments[str(entity.get("guid"))] = "standin-{}".format(
+                    next(self.state.guids))
+
+        created = [
+            {"typeName": e.get("typeName"), "guid": guid_assignments[str(e.get("guid"))],
+             "attributes": {"qualifiedName": e.get("attributes", {}).get("qualifiedName")}}
+            for e in entities
+        ]
+        self._send_json(200, {
+            "mutatedEntities": {"CREATE": created},
+            "guidAssignments": guid_assignments
+        })
+
+    def do_GET(self):
+        # A tiny status page with the counters
+        with self.state.lock:
+            body = {"requests": self.state.requests,
+                    "entities": self.state.entities,
+                    "failures": self.state.failures,
+                    "throttled": self.state.throttled}
+        self._send_json(200, body)
+
+
+def make_server(port=21000, latency=0.0, entity_latency=0.0, max_entities=None,
+                failure_rate=0.0, rate_limit=None):
+    """
+    Build (but don't start) the stand-in server. Each server gets its own
+    handler class so that settings and counters are not shared between them.
+    """
+    handler = type("AtlasStandInHandler", (AtlasStandIn,), {
+        "state": StandInState(latency, entity_latency, max_entities, failure_rate, rate_limit)
+    })
+    return ThreadingHTTPServer(('', port), handler)
+
+
+def run(port=21000, **kwargs):
+    httpd = make_server(port, **kwargs)
+    print('Atlas stand-in running at localhost:{}...'.format(port))
+    httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Atlas bulk entity api")
+    parser.add_argument("--port", type=int, default=21000)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds to sleep before answering each upload")
+    parser.add_argument("--entity-latency", type=float, default=0.0,
+                        help="Additional seconds to sleep per uploaded entity")
+    parser.add_argument("--max-entities", type=int, default=None,
+                        help="Reject uploads with more entities than this (413)")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Fraction of uploads that fail with a 503")
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="Answer uploads beyond this many per second with a 429")
+    args = parser.parse_args()
+    run(args.port, latency=args.latency, entity_latency=args.entity_latency,
+        max_entities=args.max_entities,
+        failure_rate=args.failure_rate, rate_limit=args.rate_limit)
@@ -1,40 +1,290 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
 
+import argparse
+import hashlib
 import json
 import os
+import threading
+import time
+
+# This is a fake ETL tool api. Run it from the ETLTool folder so that
+# GET /api/job/001 serves the file ./api/job/001.
+# GET /api/jobs lists the ids of every job.
+# GET /api/stats returns the request and latency counters.
+# POST /api/job/<jobId> creates or replaces a job (held in memory only).
+#
+# It's meant to stand in for a real ETL tool when load testing the
+# harvester in `etl_api_harvester.py`:
+# * Each request is handled on its own thread.
+# * Job payloads are read from disk once and then served from memory (a
+#   file that changes on disk is picked up again).
+# * Every job has an ETag. A GET with a matching If-None-Match header gets
+#   an empty 304 instead of the payload.
+# * --synthetic-jobs serves N generated jobs of --job-size inputs each
+#   without any files on disk.
+# * --latency makes every request slower.
+
+JOB_DIRECTORY = os.path.join("api", "job")
+JOB_PATH = "/api/job/"
+
+
+def generate_job(job_number, size):
+    """
+    A synthetic job with `size` input tables and one output blob. The inputs
+    overlap with the neighbouring jobs' the way real jobs share tables.
+    """
+    return {
+        "name": "synthetic-job-{:06d}".format(job_number),
+        "lastRun": "yesterday",
+        "inputs": [
+            {"name": "tblSynthetic{:06d}".format(job_number + i), "type": "customDB"}
+            for i in range(size)
+        ],
+        "outputs": [{
+            "name": "synthetic{:06d}".format(job_number),
+            "path": "https://demosa.blob.core.windows.net/synthetic/{:06d}".format(job_number),
+            "type": "blob"
+        }]
+    }
+
+
+def _etag(content):
+    return '"{}"'.format(hashlib.sha1(content).hexdigest())
+
+
+class JobStore():
+    """
+    The job payloads, held in memory as (content, etag) and keyed by job id.
+    Jobs on disk are loaded the first time they are asked for and reloaded
+    only when the file's modification time changes.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # job id -> (content, etag, mtime). The mtime is None for jobs that
+        # only exist in memory (synthetic or POSTed).
+        self.jobs = {}
+
+    def _job_file(self, job_id):
+        if not self.directory or os.path.basename(job_id) != job_id or job_id in ("", ".", ".."):
+            return None
+        return os.path.join(self.directory, JOB_DIRECTORY, job_id)
+
+    def put(self, job_id, payload):
+        """
+        Store a job in memory.
+
+        :param str job_id: The id of the job.
+        :param dict payload: The job's json.
+        :return: The job's ETag.
+        :rtype: str
+        """
+        content = bytes(json.dumps(payload, indent=2), "utf-8")
+        etag = _etag(content)
+        with self.lock:
+            self.jobs[job_id] = (content, etag, None)
+        return etag
+
+    def get(self, job_id):
+        """
+        :return: The (content, etag) of the job or None if it doesn't exist.
+        :rtype: tuple(bytes, str)
+        """
+        with self.lock:
+            cached = self.jobs.get(job_id)
+        if cached and cached[2] is None:
+            return cached[0], cached[1]
+
+        path = self._job_file(job_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns if path else None
+        except OSError:
+            mtime = None
+        if mtime is None:
+            return None
+        if cached and cached[2] == mtime:
+            return cached[0], cached[1]
+
+        with open(path, "rb") as fp:
+            content = fp.read()
+        etag = _etag(content)
+        with self.lock:
+            self.jobs[job_id] = (content, etag, mtime)
+        return content, etag
+
+    def job_ids(self):
+        """The ids of every job, on disk or in memory."""
+        job_ids = set()
+        if self.directory and os.path.isdir(os.path.join(self.directory, JOB_DIRECTORY)):
+            job_ids.update(os.listdir(os.path.join(self.directory, JOB_DIRECTORY)))
+        with self.lock:
+            job_ids.update(self.jobs)
+        return sorted(job_ids)
+
+
+class ServerState():
+    """
+    Settings, job payloads and counters shared by every request handler thread.
+    """
+
+    def __init__(self, store, latency=0.0, verbose=False):
+        self.store = store
+        self.latency = latency
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+        self.statuses = {}
+        self.bytes_sent = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, status, bytes_sent, seconds):
+        with self.lock:
+            self.requests += 1
+            if status == 304:
+                self.not_modified += 1
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            self.bytes_sent += bytes_sent
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def to_json(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "notModified": self.not_modified,
+                "statuses": dict(self.statuses),
+                "bytesSent": self.bytes_sent,
+                "meanLatencySeconds": self.total_seconds / self.requests if self.requests else 0.0,
+                "maxLatencySeconds": self.max_seconds
+            }
+
+
+class ETLServer(ThreadingHTTPServer):
+    # Lots of harvester connections can arrive at once
+    request_queue_size = 128
+
 
 class GP(BaseHTTPRequestHandler):
-    def _set_headers(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
+    # Every response has a Content-Length, so connections can be kept alive
+    protocol_version = "HTTP/1.1"
+    # The headers and body go out in separate writes. Without this, a kept
+    # alive connection waits on the client's delayed ACK for every response.
+    disable_nagle_algorithm = True
+    state = ServerState(JobStore(os.getcwd()))
+
+    def log_message(self, format, *args):
+        if self.state.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, content=b"", etag=None):
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        if etag:
+            self.send_header('ETag', etag)
         self.end_headers()
+        self.wfile.write(content)
+        self.state.record(status, len(content), time.perf_counter() - self._started)
+
+    def _send_json(self, status, body):
+        self._send(status, bytes(json.dumps(body), "utf-8"))
+
+    def _send_cached(self, content, etag):
+        # The client already has this version of the payload
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, etag=etag)
+        else:
+            self._send(200, content, etag)
+
     def do_HEAD(self):
-        self._set_headers()
+        self._started = time.perf_counter()
+        self._send(200)
+
     def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        print(self.path)
-        
-        content = r"{}"
-        with open(os.path.join(os.getcwd(), self.path[1:])) as fp:
-            content = fp.read()
+        self._started = time.perf_counter()
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/api/stats":
+            self._send_json(200, self.state.to_json())
+            return
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if path == "/api/jobs":
+            content = bytes(json.dumps({"jobs": self.state.store.job_ids()}), "utf-8")
+            self._send_cached(content, _etag(content))
+        elif path.startswith(JOB_PATH):
+            job = self.state.store.get(path[len(JOB_PATH):])
+            if job is None:
+                self._send_json(404, {"message": "No job at " + path})
+            else:
+                self._send_cached(*job)
+        else:
+            self._send_json(404, {"message": "Unknown path " + path})
 
-        self.wfile.write(bytes(content, 'utf-8'))
-        
     def do_POST(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        print(self.rfile)
-        output = {"a":1,"b":"abc"}
-        self.wfile.write(bytes(json.dumps(output,indent=2), "utf-8"))
-
-def run(server_class=HTTPServer, handler_class=GP, port=8088):
-    server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
-    print('Server running at localhost:8088...')
+        self._started = time.perf_counter()
+        path = urlparse(self.path).path.rstrip("/")
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"message": "The body must be json"})
+            return
+
+        if not path.startswith(JOB_PATH) or "/" in path[len(JOB_PATH):]:
+            self._send_json(404, {"message": "Unknown path " + path})
+            return
+        job_id = path[len(JOB_PATH):]
+        etag = self.state.store.put(job_id, payload)
+        self._send_json(200, {"jobId": job_id, "etag": etag})
+
+
+def make_server(port=8088, directory=None, latency=0.0, synthetic_jobs=0, job_size=2,
+                verbose=False, handler_class=GP):
+    """
+    Build (but don't start) the fake ETL tool api. Each server gets its own
+    handler class so that jobs and counters are not shared between them.
+
+    :param int port: The port to listen on.
+    :param str directory: The folder holding ./api/job/. Without one, only
+        the synthetic and POSTed jobs are served.
+    :param float latency: Seconds to sleep before answering each GET.
+    :param int synthetic_jobs: How many generated jobs to serve.
+    :param int job_size: How many inputs each generated job has.
+    :param bool verbose: Log every request.
+    """
+    store = JobStore(directory)
+    for job_number in range(synthetic_jobs):
+        store.put("synthetic{:06d}".format(job_number), generate_job(job_number, job_size))
+    handler = type("GPHandler", (handler_class,), {
+        "state": ServerState(store, latency, verbose)
+    })
+    return ETLServer(('', port), handler)
+
+
+def run(port=8088, **kwargs):
+    httpd = make_server(port, **kwargs)
+    print('Server running at localhost:{}...'.format(port))
     httpd.serve_forever()
 
-run()
\ No newline at end of file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A fake ETL tool api")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--directory", default=os.getcwd(),
+                        help="The folder holding ./api/job/ (defaults to the current directory)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds to sleep before answering each GET")
+    parser.add_argument("--synthetic-jobs", type=int, default=0,
+                        help="Also serve this many generated jobs")
+    parser.add_argument("--job-size", type=int, default=2,
+                        help="How many inputs each generated job has")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+    run(args.port, directory=args.directory, latency=args.latency,
+        synthetic_jobs=args.synthetic_jobs, job_size=args.job_size, verbose=args.verbose)
@@ -0,0 +1,62 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ETLTool.server import make_server
+from etl_api_harvester import harvest_all_jobs
+
+# Benchmarks harvesting many jobs from the fake ETL tool api, one blocking
+# request at a time vs the concurrent harvester. `ETLTool/server.py` serves
+# synthetic jobs from memory with some latency, so the numbers are
+# reproducible without a real ETL tool. For example:
+#   python benchmarks/benchmark_api_harvester.py --jobs 500 --job-size 20 --latency 0.05
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ETL api harvester")
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--job-size", type=int, default=5,
+                        help="How many inputs each synthetic job has")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Artificial latency of the ETL api per request")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--port", type=int, default=8098)
+    args = parser.parse_args()
+
+    httpd = make_server(args.port, latency=args.latency, synthetic_jobs=args.jobs,
+                        job_size=args.job_size)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = "http://localhost:{}".format(args.port)
+
+    job_ids = requests.get(base_url + "/api/jobs").json()["jobs"]
+    print("{} jobs of {} inputs, {}s latency per request".format(
+        len(job_ids), args.job_size, args.latency))
+
+    start = time.perf_counter()
+    for job_id in job_ids:
+        requests.get("{}/api/job/{}".format(base_url, job_id)).json()
+    elapsed = time.perf_counter() - start
+    print("one requests.get at a time:  {:8.2f}s {:8.0f} jobs/s".format(
+        elapsed, len(job_ids) / elapsed))
+
+    for connections in args.connections:
+        start = time.perf_counter()
+        jobs = harvest_all_jobs(base_url, job_ids, max_connections=connections)
+        elapsed = time.perf_counter() - start
+        failed = sum(1 for _, _, error in jobs if error)
+        print("harvester, {:3d} connections: {:8.2f}s {:8.0f} jobs/s ({} failed)".format(
+            connections, elapsed, len(jobs) / elapsed, failed))
+
+    print("server counters:", json.dumps(requests.get(base_url + "/api/stats").json()))
+    httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from custom_sp_parser import parse_script, resolve_datasets
+from workloads import generate_script
+
+# Measures how many stored procedure scripts per second the parser in
+# `custom_sp_parser.py` gets through on a generated corpus. For example:
+#   python benchmarks/benchmark_custom_sp_parser.py --scripts 5000 --depth 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stored procedure parser")
+    parser.add_argument("--scripts", type=int, default=2000)
+    parser.add_argument("--depth", type=int, default=10,
+                        help="How many ALIAS / PROJECT / GROUPED_SUM steps per script")
+    parser.add_argument("--width", type=int, default=20,
+                        help="How many columns the script reads")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    corpus = [generate_script(rng, args.depth, args.width) for _ in range(args.scripts)]
+    total_bytes = sum(len(s) for s in corpus)
+    print("{} scripts, {} steps each, {:.1f} KB total".format(
+        len(corpus), args.depth, total_bytes / 1024))
+
+    start = time.perf_counter()
+    for number, text in enumerate(corpus):
+        resolve_datasets(parse_script(text, "sp{}.custom".format(number)))
+    elapsed = time.perf_counter() - start
+    print("parse + resolve: {:8.3f}s {:10.0f} scripts/s {:8.2f} MB/s".format(
+        elapsed, len(corpus) / elapsed, total_bytes / elapsed / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyapacheatlas.core.util import GuidTracker
+
+from benchmark_upload import build_entities
+from ingestor_records import ColumnRecord, TableRecord
+from ingestor_upload import entity_to_json
+
+# Compares the memory the tables and columns of a large catalog take as
+# AtlasEntity objects and as the compact records of `ingestor_records.py`,
+# and how long turning each into Atlas json takes. For example:
+#   python benchmarks/benchmark_entity_records.py --tables 20000 --columns 50
+
+
+def build_records(num_tables, num_columns):
+    # The same entities as benchmark_upload.build_entities
+    gt = GuidTracker()
+    entities = []
+    for t in range(num_tables):
+        _tbl = TableRecord("tbl{:06d}".format(t), gt.get_guid(),
+                           {"description": "Synthetic table"})
+        entities.append(_tbl)
+        for c in range(num_columns):
+            entities.append(ColumnRecord(_tbl, "col{}".format(c), gt.get_guid(), "int",
+                                         "Synthetic column"))
+    return entities
+
+
+def measure(label, build, num_tables, num_columns):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    entities = build(num_tables, num_columns)
+    build_seconds = time.perf_counter() - started
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    payload = [entity_to_json(e) for e in entities]
+    serialize_seconds = time.perf_counter() - started
+    print("{:<14} {:>8} entities  {:>8.1f}MB held ({:6.0f} bytes each)  peak {:>8.1f}MB"
+          "  build {:6.2f}s  to_json {:6.2f}s".format(
+              label, len(entities), held / 1024 / 1024, held / len(entities),
+              peak / 1024 / 1024, build_seconds, serialize_seconds))
+    return payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compact entity records")
+    parser.add_argument("--tables", type=int, default=5000)
+    parser.add_argument("--columns", type=int, default=40, help="Columns per table")
+    args = parser.parse_args()
+
+    expected = measure("AtlasEntity", build_entities, args.tables, args.columns)
+    actual = measure("records", build_records, args.tables, args.columns)
+    # Both must upload exactly the same thing
+    print("Same Atlas json: {}".format(expected == actual))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.dom.minidom
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from etl_jobfile_parser import iter_job_events
+from workloads import write_job_file
+
+# Compares the streaming job file parser (`etl_jobfile_parser.py`) against
+# the xml.dom.minidom approach the job file ingestor used to take, on a
+# synthetic job file with a very wide projection. For example:
+#   python benchmarks/benchmark_jobfile_parser.py --columns 200000
+
+
+def parse_with_minidom(path):
+    # This is the approach parse_etlserver_jobfile.py used before it
+    # switched to streaming.
+    script = xml.dom.minidom.parse(path)
+    inputs, mappings, outputs = [], [], []
+    for node in script.getElementsByTagName("node"):
+        if node.getAttribute("id") == "start":
+            inputNodes = [x for x in node.childNodes if isinstance(x, xml.dom.minidom.Element)][0]
+            for child in inputNodes.childNodes:
+                if isinstance(child, xml.dom.minidom.Element):
+                    inputs.append({"name": child.firstChild.data, "type": child.getAttribute("typeName")})
+        elif node.getAttribute("type") == "projection":
+            setOfColumns = [x for x in node.childNodes if isinstance(x, xml.dom.minidom.Element) and x.tagName == "columns"][0]
+            for columnNode in setOfColumns.childNodes:
+                if not isinstance(columnNode, xml.dom.minidom.Element):
+                    continue
+                m = [c for c in columnNode.childNodes if c.nodeType != xml.dom.minidom.Node.TEXT_NODE]
+                mappings.append({'Source': m[0].firstChild.data, 'Sink': m[1].firstChild.data})
+        elif node.getAttribute("type") == "sink":
+            out = [x for x in node.childNodes if isinstance(x, xml.dom.minidom.Element) and x.tagName == "output"][0]
+            outputs.append({"name": out.firstChild.data, "type": out.getAttribute("typeName")})
+    return inputs, mappings, outputs
+
+
+def parse_with_iterparse(path):
+    inputs, mappings, outputs = [], [], []
+    for event, item in iter_job_events(path):
+        if event == "input":
+            inputs.append(item)
+        elif event == "mapping":
+            mappings.append(item)
+        elif event == "output":
+            outputs.append(item)
+    return inputs, mappings, outputs
+
+
+def count_with_iterparse(path):
+    # The streaming parser doesn't have to keep the mappings at all if the
+    # consumer processes them as they arrive.
+    return sum(1 for _ in iter_job_events(path))
+
+
+def measure(label, func, path):
+    # Time it without tracemalloc first, since tracing slows everything down
+    start = time.perf_counter()
+    func(path)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("{:28s} {:8.3f}s  peak {:10.1f} MB".format(label, elapsed, peak / 1024 / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the job file parsers")
+    parser.add_argument("--inputs", type=int, default=10)
+    parser.add_argument("--columns", type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "job.xml")
+        write_job_file(path, args.inputs, args.columns)
+        print("{} projection columns, {:.1f} MB job file".format(
+            args.columns, os.path.getsize(path) / 1024 / 1024))
+        measure("minidom", parse_with_minidom, path)
+        measure("iterparse (collected)", parse_with_iterparse, path)
+        measure("iterparse (streamed)", count_with_iterparse, path)
+
+
+if __name__ == "__main__":
+    main()
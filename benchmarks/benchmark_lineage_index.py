@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingestor_lineage import LineageIndex
+
+# Builds a synthetic lineage graph with the local lineage index (see
+# `ingestor_lineage.py`) and measures how long impact analysis takes on it.
+# The graph is made of layers of tables: every process reads a few tables
+# of one layer and writes a table of the next, with a column mapping for
+# every column. For example:
+#   python benchmarks/benchmark_lineage_index.py --layers 10 --tables 2000
+
+
+def build_processes(num_layers, num_tables, num_inputs, num_columns, seed=42):
+    rng = random.Random(seed)
+    for layer in range(1, num_layers):
+        for t in range(num_tables):
+            sink = "custom://l{}_tbl{:06d}".format(layer, t)
+            sources = ["custom://l{}_tbl{:06d}".format(layer - 1, rng.randrange(num_tables))
+                       for _ in range(num_inputs)]
+            column_mapping = [
+                {"DatasetMapping": {"Source": source, "Sink": sink},
+                 "ColumnMapping": [{"Source": "col{}".format(c), "Sink": "col{}".format(c)}
+                                   for c in range(num_columns)]}
+                for source in sources
+            ]
+            yield {
+                "typeName": "my_custom_db_sp",
+                "guid": -1,
+                "attributes": {
+                    "qualifiedName": "custom://sp_l{}_{:06d}".format(layer, t),
+                    "inputs": [{"typeName": "my_custom_db", "qualifiedName": s} for s in sources],
+                    "outputs": [{"typeName": "my_custom_db", "qualifiedName": sink}],
+                    "columnMapping": json.dumps(column_mapping)
+                }
+            }
+
+
+def measure(label, func, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        nodes = func()
+        timings.append(time.perf_counter() - started)
+    print("{:<40} {:>8} nodes  median {:>8.2f}ms  max {:>8.2f}ms".format(
+        label, len(nodes), statistics.median(timings) * 1000, max(timings) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local lineage index")
+    parser.add_argument("--layers", type=int, default=10)
+    parser.add_argument("--tables", type=int, default=2000, help="Tables per layer")
+    parser.add_argument("--inputs", type=int, default=3, help="Tables each process reads")
+    parser.add_argument("--columns", type=int, default=5, help="Mapped columns per table")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        index = LineageIndex(os.path.join(workdir, "lineage.sqlite"))
+        started = time.perf_counter()
+        processes = index.add_processes(
+            build_processes(args.layers, args.tables, args.inputs, args.columns))
+        stats = index.stats()
+        print("Indexed {} processes ({} edges, {} nodes) in {:.2f}s, {:.1f}MB".format(
+            processes, stats["edges"], sum(v for k, v in stats.items() if k != "edges"),
+            time.perf_counter() - started,
+            os.path.getsize(index.path) / 1024 / 1024))
+
+        first = "custom://l0_tbl000000"
+        last = "custom://l{}_tbl000000".format(args.layers - 1)
+        for depth in [1, 3, None]:
+            measure("downstream {} depth {}".format(first, depth),
+                    lambda: index.downstream(first, depth), args.runs)
+        measure("upstream {}".format(last), lambda: index.upstream(last), args.runs)
+        measure("downstream {}#col0".format(first),
+                lambda: index.downstream(first + "#col0"), args.runs)
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
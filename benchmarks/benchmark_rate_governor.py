@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyapacheatlas.auth import BasicAuthentication
+from pyapacheatlas.core.client import AtlasClient
+
+from AtlasStandIn.server import make_server
+from benchmark_upload import build_entities
+from ingestor_governor import GovernedClient, RateGovernor
+from ingestor_upload import upload_entities_in_batches
+
+# Runs several "ingestors" at once (one process each) against the local Atlas
+# stand-in with a rate limit, like several ingestors sharing one Purview
+# account, with and without the shared rate governor (see
+# `ingestor_governor.py`). No Purview account is needed. For example:
+#   python benchmarks/benchmark_rate_governor.py --processes 4 --rate-limit 20
+# Without the governor, every process retries its throttled batches on its
+# own backoff. With it, the processes share one adaptive rate through a file
+# and keep just under the limit.
+
+
+def ingest(port, governor_path, args):
+    # One ingestor: upload its entities in batches, like the real ones do
+    client = AtlasClient("http://localhost:{}/api/atlas/v2".format(port),
+                         BasicAuthentication("admin", "admin"))
+    governor = None
+    if governor_path:
+        governor = RateGovernor(governor_path, max_rate=args.max_rate)
+        client = GovernedClient(client, governor)
+    entities = build_entities(args.batches, args.batch_size - 1)
+    started = time.perf_counter()
+    results = upload_entities_in_batches(
+        client, entities, max_entities=args.batch_size, max_workers=args.workers,
+        max_retries=args.max_retries, backoff_seconds=args.backoff)
+    return time.perf_counter() - started, len(results["failedBatches"])
+
+
+def run(args, governed):
+    httpd = make_server(args.port, latency=args.latency, rate_limit=args.rate_limit)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as workdir:
+        governor_path = os.path.join(workdir, "governor.json") if governed else None
+        started = time.perf_counter()
+        with ProcessPoolExecutor(args.processes) as executor:
+            runs = list(executor.map(ingest, [args.port] * args.processes,
+                                     [governor_path] * args.processes,
+                                     [args] * args.processes))
+        elapsed = time.perf_counter() - started
+        final = RateGovernor(governor_path).snapshot() if governed else None
+    state = httpd.RequestHandlerClass.state
+    httpd.shutdown()
+    httpd.server_close()
+    print("{:<16} {:7.2f}s  {:5d} requests  {:5d} throttled  {:3d} failed batches"
+          "  slowest ingestor {:6.2f}s{}".format(
+              "governed" if governed else "ungoverned", elapsed, state.requests + state.throttled,
+              state.throttled, sum(failed for _, failed in runs), max(s for s, _ in runs),
+              "  final rate {:.1f}/s".format(final["rate"]) if final else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shared rate governor")
+    parser.add_argument("--processes", type=int, default=4,
+                        help="How many ingestors run at once")
+    parser.add_argument("--batches", type=int, default=60, help="Batches per ingestor")
+    parser.add_argument("--batch-size", type=int, default=10, help="Entities per batch")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Concurrent uploads per ingestor")
+    parser.add_argument("--rate-limit", type=float, default=20.0,
+                        help="Requests per second the stand-in accepts")
+    parser.add_argument("--max-rate", type=float, default=50.0,
+                        help="The most requests per second the governor allows")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Artificial latency of the stand-in per request")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--backoff", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=21098)
+    args = parser.parse_args()
+
+    print("{} ingestors x {} batches against a limit of {:g} requests/s".format(
+        args.processes, args.batches, args.rate_limit))
+    run(args, governed=False)
+    run(args, governed=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmarks the cold start of the ingestors: how long `python -X importtime`
+# says the imports take and how long the whole (dry) run takes. No Purview
+# account is needed. For example:
+#   python benchmarks/benchmark_startup.py --runs 10
+
+COMMANDS = [
+    ("eager client imports", ["-c", "import pyapacheatlas.auth, pyapacheatlas.core.client"]),
+    ("ingestor_client", ["-c", "import ingestor_client"]),
+    ("parse_custom_sp --dry-run", ["parse_custom_sp.py", "--dry-run"]),
+    ("parse_etlserver_jobfile --dry-run", ["parse_etlserver_jobfile.py", "--dry-run"]),
+]
+
+
+def import_times(stderr):
+    """
+    Read the -X importtime report into the total import time (in seconds)
+    and the cumulative time of each top level import.
+    """
+    top_level = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented under the module that imported them
+        if not name[1:].startswith(" "):
+            top_level[name.strip()] = int(cumulative) / 1e6
+    return sum(top_level.values()), top_level
+
+
+def run(arguments):
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime"] + arguments, cwd=REPO_ROOT,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - start
+    total, top_level = import_times(completed.stderr)
+    return elapsed, total, top_level, completed.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestors' cold start")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=3,
+                        help="How many of the slowest imports to list")
+    args = parser.parse_args()
+
+    print("{:38s} {:>9s} {:>9s}  slowest imports".format("", "wall", "imports"))
+    for label, arguments in COMMANDS:
+        runs = [run(arguments) for _ in range(args.runs)]
+        failed = [r for r in runs if r[3] != 0]
+        if failed:
+            print("{:38s} failed with exit code {}".format(label, failed[0][3]))
+            continue
+        wall = statistics.median(r[0] for r in runs)
+        imports = statistics.median(r[1] for r in runs)
+        slowest = sorted(runs[-1][2].items(), key=lambda kv: -kv[1])[:args.top]
+        print("{:38s} {:8.0f}ms {:8.0f}ms  {}".format(
+            label, wall * 1000, imports * 1000,
+            ", ".join("{} {:.0f}ms".format(name, t * 1000) for name, t in slowest)))
+
+
+if __name__ == "__main__":
+    main()
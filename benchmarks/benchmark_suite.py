@@ -0,0 +1,260 @@
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from ETLTool.server import make_server
+from workloads import write_job_file, write_sp_scripts, write_sys_table
+
+# Runs every ingestor end to end against synthetic workloads of growing size
+# (see `workloads.py`) and reports how it scales. Each ingestor runs in its
+# own process with --dry-run, so the Purview client is the stub
+# `DryRunClient` and nothing is sent anywhere, and with --metrics-report so
+# the time of each stage is known (see `ingestor_metrics.py`). For example:
+#   python benchmarks/benchmark_suite.py --scales 1 2 4 8
+#   python benchmarks/benchmark_suite.py --baseline benchmarks/results/abc1234.json
+# The results are saved as json (by default under benchmarks/results/, named
+# after the git revision) so that a later run can be compared against them
+# and flag the cases that got slower.
+
+RESULTS_DIRECTORY = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+
+def _sys_table_case(stream):
+    def prepare(workdir, scale, args):
+        path = os.path.join(workdir, "sys.json")
+        tables = args.tables * scale
+        write_sys_table(path, tables, args.columns)
+        command = ["parse_datasource_sys_table.py", "--system-table", path,
+                   "--state", os.path.join(workdir, "state.sqlite")]
+        return command + (["--stream"] if stream else []), tables
+    return prepare
+
+
+def _custom_sp_case(workdir, scale, args):
+    scripts = args.scripts * scale
+    directory = write_sp_scripts(os.path.join(workdir, "procedures"), scripts,
+                                 args.depth, args.width)
+    return ["parse_custom_sp.py", "--directory", directory], scripts
+
+
+def _jobfile_case(workdir, scale, args):
+    columns = args.job_columns * scale
+    path = write_job_file(os.path.join(workdir, "job.xml"), args.job_inputs, columns,
+                          args.job_projections)
+    return ["parse_etlserver_jobfile.py", "--job-file", path], columns
+
+
+def _api_case(workdir, scale, args):
+    jobs = args.api_jobs * scale
+    httpd = make_server(args.port, synthetic_jobs=jobs, job_size=args.api_job_size)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    command = ["parse_etlserver_api.py", "--all-jobs", "--full-refresh",
+               "--base-url", "http://localhost:{}".format(args.port),
+               "--state", os.path.join(workdir, "state.sqlite")]
+    return command, jobs, httpd
+
+
+# Each case writes its workload at a given scale and returns the command to
+# run and how many source items (tables, scripts, columns, jobs) it holds.
+CASES = {
+    "sys_table": ("tables", _sys_table_case(stream=False)),
+    "sys_table_stream": ("tables", _sys_table_case(stream=True)),
+    "custom_sp": ("scripts", _custom_sp_case),
+    "jobfile": ("columns", _jobfile_case),
+    "api": ("jobs", _api_case),
+}
+
+
+def run_ingestor(command, report_path):
+    """
+    Run an ingestor with --dry-run and its metrics report.
+
+    :return: The wall clock seconds, the peak resident memory in bytes
+        (None where the platform can't tell) and the metrics report.
+    :rtype: tuple(float, int, dict)
+    """
+    arguments = [sys.executable] + command + ["--dry-run", "--metrics-report", report_path]
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(arguments, cwd=REPO_ROOT, stdout=subprocess.DEVNULL,
+                                   stderr=stderr)
+        if hasattr(os, "wait4"):
+            # wait4 gives the resource usage of just this child
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            peak = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        else:
+            process.wait()
+            peak = None
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError("{} failed:\n{}".format(
+                " ".join(command), stderr.read().decode("utf-8", "replace")))
+    with open(report_path) as fp:
+        return elapsed, peak, json.load(fp)
+
+
+def run_case(name, scale, args):
+    unit, prepare = CASES[name]
+    with tempfile.TemporaryDirectory() as workdir:
+        prepared = prepare(workdir, scale, args)
+        command, items = prepared[0], prepared[1]
+        try:
+            runs = [run_ingestor(command, os.path.join(workdir, "report.json"))
+                    for _ in range(args.repeat)]
+        finally:
+            if len(prepared) > 2:
+                prepared[2].shutdown()
+                prepared[2].server_close()
+
+    wall = statistics.median(r[0] for r in runs)
+    # The time from the start of the ingestor's work to its end, without
+    # starting the interpreter and importing everything.
+    run_seconds = statistics.median(r[2]["elapsedSeconds"] for r in runs)
+    peaks = [r[1] for r in runs if r[1] is not None]
+    report = runs[-1][2]
+    entities = sum(report["entities"].values())
+    return {
+        "case": name,
+        "scale": scale,
+        "unit": unit,
+        "items": items,
+        "entities": entities,
+        "seconds": round(wall, 4),
+        "runSeconds": round(run_seconds, 4),
+        "itemsPerSecond": round(items / wall, 1),
+        "entitiesPerSecond": round(entities / wall, 1),
+        "peakBytes": max(peaks) if peaks else None,
+        "stages": {n: s["seconds"] for n, s in report["stages"].items()},
+        "bytesSent": report["bytesSent"]
+    }
+
+
+def scaling_exponent(results):
+    """
+    The slope of log(time) against log(size) between the smallest and the
+    largest run: about 1 for linear scaling, 2 for quadratic. The start up
+    time doesn't grow with the workload, so it's left out.
+    """
+    if len(results) < 2 or results[0]["items"] == results[-1]["items"]:
+        return None
+    return math.log(results[-1]["runSeconds"] / results[0]["runSeconds"]) / math.log(
+        results[-1]["items"] / results[0]["items"])
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print how each case compares to the baseline run.
+
+    :return: The cases that are slower than the baseline by more than the
+        tolerance.
+    :rtype: list(str)
+    """
+    previous = {(r["case"], r["items"]): r for r in baseline["results"]}
+    regressions = []
+    print("\nCompared to {} ({}):".format(baseline["revision"], baseline["date"]))
+    for result in results:
+        before = previous.get((result["case"], result["items"]))
+        if not before:
+            continue
+        ratio = result["seconds"] / before["seconds"]
+        label = "{} {} {}".format(result["case"], result["items"], result["unit"])
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressions.append(label)
+        print("  {:36s} {:8.3f}s -> {:8.3f}s  x{:.2f}{}".format(
+            label, before["seconds"], result["seconds"], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every ingestor on synthetic workloads")
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="The multiples of the base workload sizes to run")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per size (the median time is reported)")
+    parser.add_argument("--tables", type=int, default=500)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--scripts", type=int, default=200)
+    parser.add_argument("--depth", type=int, default=10)
+    parser.add_argument("--width", type=int, default=20)
+    parser.add_argument("--job-inputs", type=int, default=10)
+    parser.add_argument("--job-columns", type=int, default=5000)
+    parser.add_argument("--job-projections", type=int, default=3)
+    parser.add_argument("--api-jobs", type=int, default=200)
+    parser.add_argument("--api-job-size", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8097)
+    parser.add_argument("--output", default=None,
+                        help="Where to save the results (default: results/<git revision>.json)")
+    parser.add_argument("--baseline", default=None,
+                        help="Results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="How much slower than the baseline counts as a regression")
+    args = parser.parse_args()
+
+    revision = git_revision()
+    results = []
+    print("{:18s} {:>9s} {:>9s} {:>9s} {:>9s} {:>10s} {:>12s} {:>8s}  stages".format(
+        "case", "size", "entities", "seconds", "run", "items/s", "entities/s", "peak MB"))
+    for name in args.cases:
+        case_results = []
+        for scale in args.scales:
+            result = run_case(name, scale, args)
+            case_results.append(result)
+            peak = result["peakBytes"] / 1024 / 1024 if result["peakBytes"] else float("nan")
+            print("{:18s} {:>9d} {:>9d} {:9.3f} {:9.3f} {:10.0f} {:12.0f} {:8.1f}  {}".format(
+                name, result["items"], result["entities"], result["seconds"],
+                result["runSeconds"], result["itemsPerSecond"], result["entitiesPerSecond"], peak,
+                ", ".join("{} {:.2f}s".format(n, s) for n, s in result["stages"].items())))
+        exponent = scaling_exponent(case_results)
+        if exponent is not None:
+            print("{:18s} time grows as {}^{:.2f}".format("", CASES[name][0], exponent))
+        results.extend(case_results)
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, "{}.json".format(revision))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump({
+            "revision": revision,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "arguments": vars(args),
+            "results": results
+        }, fp, indent=2)
+    print("\nSaved the results to {}".format(output))
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("{} case(s) regressed".format(len(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
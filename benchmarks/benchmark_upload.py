@@ -0,0 +1,94 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyapacheatlas.auth import BasicAuthentication
+from pyapacheatlas.core import AtlasEntity
+from pyapacheatlas.core.client import AtlasClient
+from pyapacheatlas.core.util import GuidTracker
+
+from AtlasStandIn.server import make_server
+from ingestor_upload import upload_entities_in_batches
+
+# Benchmarks the batched, concurrent upload stage against the local Atlas
+# stand-in. No Purview account is needed. For example:
+#   python benchmarks/benchmark_upload.py --tables 2000 --columns 20
+
+
+def build_entities(num_tables, num_columns):
+    gt = GuidTracker()
+    entities = []
+    for t in range(num_tables):
+        table_name = "tbl{:06d}".format(t)
+        _tbl = AtlasEntity(
+            name=table_name,
+            guid=gt.get_guid(),
+            qualified_name="custom://{}".format(table_name),
+            typeName="my_custom_db",
+            attributes={"description": "Synthetic table"}
+        )
+        entities.append(_tbl)
+        for c in range(num_columns):
+            _c = AtlasEntity(
+                name="col{}".format(c),
+                guid=gt.get_guid(),
+                qualified_name="custom://{}#col{}".format(table_name, c),
+                typeName="my_custom_db_column",
+                attributes={"type": "int", "description": "Synthetic column"}
+            )
+            _c.addRelationship(table=_tbl)
+            entities.append(_c)
+    return entities
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the batched upload stage")
+    parser.add_argument("--tables", type=int, default=1000)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Artificial latency of the stand-in per request")
+    parser.add_argument("--entity-latency", type=float, default=0.0002,
+                        help="Artificial latency of the stand-in per entity")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--max-entities", type=int, default=500)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--port", type=int, default=21099)
+    args = parser.parse_args()
+
+    httpd = make_server(args.port, latency=args.latency,
+                        entity_latency=args.entity_latency, failure_rate=args.failure_rate)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    client = AtlasClient("http://localhost:{}/api/atlas/v2".format(args.port),
+                         BasicAuthentication("admin", "admin"))
+
+    entities = build_entities(args.tables, args.columns)
+    print("{} entities ({} tables x {} columns)".format(
+        len(entities), args.tables, args.columns))
+
+    start = time.perf_counter()
+    try:
+        client.upload_entities(entities)
+        elapsed = time.perf_counter() - start
+        print("single upload_entities call: {:8.2f}s {:10.0f} entities/s".format(
+            elapsed, len(entities) / elapsed))
+    except Exception as e:
+        print("single upload_entities call failed: {}".format(e))
+
+    for workers in args.workers:
+        start = time.perf_counter()
+        results = upload_entities_in_batches(
+            client, entities, max_entities=args.max_entities,
+            max_workers=workers, backoff_seconds=0.05)
+        elapsed = time.perf_counter() - start
+        print("batched, {:2d} workers:         {:8.2f}s {:10.0f} entities/s ({} failed batches)".format(
+            workers, elapsed, len(entities) / elapsed, len(results["failedBatches"])))
+
+    httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
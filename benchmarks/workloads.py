@@ -0,0 +1,180 @@
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ETLTool.server import JOB_DIRECTORY, generate_job
+
+# Generators for synthetic versions of every source the ingestors read, at
+# whatever size you like. The fixtures that ship with the sample are tiny
+# (three tables, a six line stored procedure, a job with three columns), so
+# these are what the benchmarks run against. Everything is generated from a
+# seed, so the same arguments always produce the same files.
+# To write a whole workload to a directory, for example:
+#   python benchmarks/workloads.py ./workload --tables 5000 --columns 40
+
+
+def generate_sys_table(num_tables, num_columns, seed=42):
+    """
+    A system table export like DataSource/myCustomDatabase/sys.json.
+
+    :param int num_tables: How many tables.
+    :param int num_columns: How many columns each table has.
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    containers = ["container{}".format(i) for i in range(max(1, num_tables // 100))]
+    system_table = {
+        "containers": {c: {"description": "Synthetic container " + c} for c in containers},
+        "tables": {},
+        "columns": {}
+    }
+    for t in range(num_tables):
+        table_name = "tbl{:06d}".format(t)
+        system_table["tables"][table_name] = {
+            "description": "Synthetic table {}".format(t),
+            "container": rng.choice(containers)
+        }
+        system_table["columns"][table_name] = [
+            {"name": "col{}".format(c), "type": rng.choice(["int", "string", "decimal"]),
+             "description": "Synthetic column {} of {}".format(c, table_name)}
+            for c in range(num_columns)
+        ]
+    return system_table
+
+
+def write_sys_table(path, num_tables, num_columns, seed=42):
+    with open(path, "w") as fp:
+        json.dump(generate_sys_table(num_tables, num_columns, seed), fp, indent=4)
+    return path
+
+
+def generate_script(rng, depth, width):
+    """
+    Generate a stored procedure that reads a table with `width` columns and
+    then builds a chain of `depth` aliases, projections and grouped sums
+    before writing the result.
+    """
+    table = "tbl{}".format(rng.randint(0, 999))
+    columns = ["col{}".format(i) for i in range(width)]
+    lines = ["{}=(READ,{},{})".format(table, table, ",".join(columns)), ""]
+    current = table
+    for step in range(depth):
+        variable = "step{}".format(step)
+        operation = rng.choice(["ALIAS", "PROJECT", "GROUPED_SUM"])
+        if operation == "ALIAS":
+            lines.append("{}=(ALIAS,{})".format(variable, current))
+        elif operation == "PROJECT":
+            columns = columns[:max(2, len(columns) - 1)]
+            lines.append("{}=(PROJECT,{},{})".format(variable, current, ",".join(columns)))
+        else:
+            lines.append("{}=(GROUPED_SUM,{},{},{})".format(
+                variable, current, columns[-1], ",".join(columns[:-1])))
+        current = variable
+    lines.append("")
+    lines.append("@@OUTPUT=(WRITE,tblOut{},{})".format(rng.randint(0, 999), current))
+    return "\n".join(lines) + "\n"
+
+
+def write_sp_scripts(directory, num_scripts, depth, width, seed=42):
+    """
+    Write `num_scripts` generated stored procedures (*.custom) to a directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    for number in range(num_scripts):
+        path = os.path.join(directory, "sp{:06d}.custom".format(number))
+        with open(path, "w") as fp:
+            fp.write(generate_script(rng, depth, width))
+    return directory
+
+
+def write_job_file(path, num_inputs, num_columns, num_projections=1):
+    """
+    Write a job file with `num_inputs` tables joined, then a chain of
+    `num_projections` projections of `num_columns` columns each, then a sink.
+    """
+    with open(path, "w") as fp:
+        fp.write('<?xml version="1.0"?>\n<job name="Synthetic Job" jobId="job999">\n')
+        fp.write('    <node type="join" id="start">\n        <inputs>\n')
+        for i in range(num_inputs):
+            fp.write('            <input typeName="customDB">tbl{}</input>\n'.format(i))
+        fp.write('        </inputs>\n    </node>\n')
+        previous = "start"
+        for step in range(num_projections):
+            node_id = "step{:02d}".format(step + 1)
+            fp.write('    <node type="projection" id="{}">\n        <columns>\n'.format(node_id))
+            for c in range(num_columns):
+                # The first projection reads the tables, the rest read the
+                # columns of the projection before them.
+                if step == 0:
+                    source = "tbl{}.col{}".format(c % num_inputs, c)
+                else:
+                    source = "out{}_{}".format(step - 1, c)
+                fp.write(
+                    '            <column>\n'
+                    '                <sourceName>{}</sourceName>\n'
+                    '                <targetName>out{}_{}</targetName>\n'
+                    '            </column>\n'.format(source, step, c))
+            fp.write('        </columns>\n        <dependsOn>\n            <step>{}</step>\n'
+                     '        </dependsOn>\n    </node>\n'.format(previous))
+            previous = node_id
+        fp.write('    <node type="sink" id="sink">\n'
+                 '        <output typeName="blob">https://example/blob/path</output>\n'
+                 '        <dependsOn>\n            <step>{}</step>\n        </dependsOn>\n'
+                 '    </node>\n</job>\n'.format(previous))
+    return path
+
+
+def write_api_jobs(directory, num_jobs, job_size):
+    """
+    Write ETL api job payloads where `ETLTool/server.py --directory` serves
+    them from (./api/job/<id>).
+    """
+    job_directory = os.path.join(directory, JOB_DIRECTORY)
+    os.makedirs(job_directory, exist_ok=True)
+    for number in range(num_jobs):
+        with open(os.path.join(job_directory, "synthetic{:06d}".format(number)), "w") as fp:
+            json.dump(generate_job(number, job_size), fp, indent=2)
+    return directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic workload for the ingestors")
+    parser.add_argument("directory", help="Where to write the workload")
+    parser.add_argument("--tables", type=int, default=1000,
+                        help="How many tables the system table export has")
+    parser.add_argument("--columns", type=int, default=20,
+                        help="How many columns each table has")
+    parser.add_argument("--scripts", type=int, default=1000,
+                        help="How many stored procedures to write")
+    parser.add_argument("--depth", type=int, default=10,
+                        help="How many ALIAS / PROJECT / GROUPED_SUM steps per stored procedure")
+    parser.add_argument("--width", type=int, default=20,
+                        help="How many columns each stored procedure reads")
+    parser.add_argument("--job-inputs", type=int, default=10)
+    parser.add_argument("--job-columns", type=int, default=1000,
+                        help="How wide each projection of the job file is")
+    parser.add_argument("--job-projections", type=int, default=1)
+    parser.add_argument("--api-jobs", type=int, default=1000)
+    parser.add_argument("--api-job-size", type=int, default=5,
+                        help="How many inputs each api job has")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    write_sys_table(os.path.join(args.directory, "sys.json"), args.tables, args.columns, args.seed)
+    write_sp_scripts(os.path.join(args.directory, "procedures"), args.scripts, args.depth,
+                     args.width, args.seed)
+    write_job_file(os.path.join(args.directory, "job.xml"), args.job_inputs, args.job_columns,
+                   args.job_projections)
+    write_api_jobs(args.directory, args.api_jobs, args.api_job_size)
+    print("Wrote sys.json, procedures/, job.xml and {} to {}".format(
+        JOB_DIRECTORY, args.directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import NamedTuple, Tuple, Union
+
+# This module is the parser for my fictional database's stored procedure
+# language. It is kept separate from `parse_custom_sp.py` so that it can be
+# imported and reused: it holds no global state, doesn't talk to Purview and
+# can parse any number of scripts in the same process.
+
+# A script is a list of statements, one per line:
+#   variable=(FUNCTION,argument,argument,...)
+# For example:
+#   tblDailySales=(READ,tblDailySales,id,month,day,year,sales)
+#   A=(ALIAS,tblDailySales)
+#   intermediate=(PROJECT,A,month,year,sales)
+#   aggregate=(GROUPED_SUM,intermediate,sales,month,year)
+#   @@OUTPUT=(WRITE,tblMonthlySales,aggregate)
+
+# The parsing happens in two steps. First the whole text is tokenized in a
+# single pass with one compiled regular expression. Then the tokens are
+# turned into a typed syntax tree (the statement classes below).
+
+OUTPUT_VARIABLE = "@@OUTPUT"
+
+# A token is a newline, one of the punctuation characters or a run of
+# anything else (a name). Whitespace in between is dropped.
+_TOKEN_PATTERN = re.compile(r"\r?\n|[(),=]|[^\s(),=]+")
+_PUNCTUATION = {"(": "LPAREN", ")": "RPAREN", ",": "COMMA", "=": "EQUALS"}
+
+
+class CustomSpSyntaxError(ValueError):
+    """
+    Raised when a stored procedure script is malformed.
+    """
+
+    def __init__(self, message, line):
+        super().__init__("Line {}: {}".format(line, message))
+        self.line = line
+
+
+class Token(NamedTuple):
+    kind: str
+    value: str
+    line: int
+
+
+@dataclass(frozen=True)
+class Read:
+    """X=(READ,table,column,...) reads a table from the database."""
+    target: str
+    table: str
+    columns: Tuple[str, ...]
+    line: int = field(default=0, compare=False)
+
+
+@dataclass(frozen=True)
+class Alias:
+    """X=(ALIAS,dataset) gives a dataset another name."""
+    target: str
+    source: str
+    line: int = field(default=0, compare=False)
+
+
+@dataclass(frozen=True)
+class Project:
+    """X=(PROJECT,dataset,column,...) keeps only some columns of a dataset."""
+    target: str
+    source: str
+    columns: Tuple[str, ...]
+    line: int = field(default=0, compare=False)
+
+
+@dataclass(frozen=True)
+class GroupedSum:
+    """X=(GROUPED_SUM,dataset,aggregate,group_by,...) sums a column by groups."""
+    target: str
+    source: str
+    aggregate_column: str
+    group_by: Tuple[str, ...]
+    line: int = field(default=0, compare=False)
+
+
+@dataclass(frozen=True)
+class Write:
+    """X=(WRITE,table,dataset) writes a dataset to a table in the database."""
+    target: str
+    table: str
+    source: str
+    line: int = field(default=0, compare=False)
+
+
+Statement = Union[Read, Alias, Project, GroupedSum, Write]
+
+
+@dataclass(frozen=True)
+class Script:
+    """A parsed stored procedure."""
+    name: str
+    statements: Tuple[Statement, ...]
+
+
+def tokenize(text):
+    """
+    Split the text of a script into tokens in a single pass.
+
+    :param str text: The stored procedure script.
+    :return: The tokens, without whitespace.
+    :rtype: list(:class:`Token`)
+    """
+    tokens = []
+    line = 1
+    for value in _TOKEN_PATTERN.findall(text):
+        if value[-1] == "\n":
+            tokens.append(Token("NEWLINE", value, line))
+            line += 1
+        else:
+            tokens.append(Token(_PUNCTUATION.get(value, "NAME"), value, line))
+    return tokens
+
+
+def _build_statement(target, function, arguments, line):
+    # How many arguments each function needs at a minimum
+    # and how to turn them into a statement.
+    if function == "READ" and len(arguments) >= 1:
+        return Read(target, arguments[0], tuple(arguments[1:]), line)
+    if function == "ALIAS" and len(arguments) == 1:
+        return Alias(target, arguments[0], line)
+    if function == "PROJECT" and len(arguments) >= 1:
+        return Project(target, arguments[0], tuple(arguments[1:]), line)
+    if function == "GROUPED_SUM" and len(arguments) >= 2:
+        return GroupedSum(target, arguments[0], arguments[1], tuple(arguments[2:]), line)
+    if function == "WRITE" and len(arguments) == 2:
+        return Write(target, arguments[0], arguments[1], line)
+    if function in ("READ", "ALIAS", "PROJECT", "GROUPED_SUM", "WRITE"):
+        raise CustomSpSyntaxError(
+            "Wrong number of arguments for {}: {}".format(function, arguments), line)
+    raise NotImplementedError(
+        "Line {}: Function {} is not supported".format(line, function))
+
+
+def _parse_tokens(tokens):
+    statements = []
+    position = 0
+    count = len(tokens)
+
+    def expect(kind):
+        nonlocal position
+        if position >= count:
+            last_line = tokens[-1].line if tokens else 1
+            raise CustomSpSyntaxError(
+                "Expected {} but the script ended".format(kind), last_line)
+        token = tokens[position]
+        if token.kind != kind:
+            raise CustomSpSyntaxError(
+                "Expected {} but found {!r}".format(kind, token.value), token.line)
+        position += 1
+        return token
+
+    while position < count:
+        if tokens[position].kind == "NEWLINE":
+            position += 1
+            continue
+        target = expect("NAME")
+        expect("EQUALS")
+        expect("LPAREN")
+        function = expect("NAME").value
+        arguments = []
+        while position < count and tokens[position].kind == "COMMA":
+            position += 1
+            arguments.append(expect("NAME").value)
+        expect("RPAREN")
+        if position < count:
+            expect("NEWLINE")
+        statements.append(_build_statement(
+            target.value, function, arguments, target.line))
+    return statements
+
+
+def parse_script(text, name=""):
+    """
+    Parse the text of a stored procedure into a :class:`Script`.
+
+    :param str text: The stored procedure script.
+    :param str name: The name of the stored procedure (e.g. its file name).
+    :return: The parsed script.
+    :rtype: :class:`Script`
+    """
+    return Script(name, tuple(_parse_tokens(tokenize(text))))
+
+
+def parse_file(path, name=None):
+    """
+    Read and parse a stored procedure file. The name defaults to the
+    file's base name.
+    """
+    with open(path) as fp:
+        text = fp.read()
+    if name is None:
+        name = os.path.basename(path)
+    return parse_script(text, name)
+
+
+def resolve_datasets(script):
+    """
+    Interpret the statements of a script into the datasets it reads, builds
+    and writes. Aliases are resolved to the dataset they stand for.
+
+    Each dataset is a dict with the keys:
+    * columns: The columns of the dataset (empty for a WRITE).
+    * source: The dataset it was built from, or "*" for a table READ.
+    * destination: The table written to (only for a WRITE).
+
+    :param script: The parsed script.
+    :type script: :class:`Script`
+    :return: The datasets keyed by variable name, in the order they appear.
+    :rtype: dict(str, dict)
+    :raises CustomSpSyntaxError: When a statement uses a dataset that the
+        script never defines.
+    """
+    aliases = {}
+    datasets = {}
+    # The line of every source, checked once every dataset is known
+    sources = []
+
+    def resolve(name):
+        return aliases.get(name, name)
+
+    for statement in script.statements:
+        if not isinstance(statement, Read):
+            sources.append((resolve(statement.source), statement.line))
+        if isinstance(statement, Alias):
+            aliases[statement.target] = resolve(statement.source)
+        elif isinstance(statement, Read):
+            datasets[statement.target] = {
+                "columns": list(statement.columns), "source": "*"}
+        elif isinstance(statement, Project):
+            datasets[statement.target] = {
+                "columns": list(statement.columns), "source": resolve(statement.source)}
+        elif isinstance(statement, GroupedSum):
+            datasets[statement.target] = {
+                "columns": list(statement.group_by) + [statement.aggregate_column],
+                "source": resolve(statement.source)}
+        elif isinstance(statement, Write):
+            datasets[statement.target] = {
+                "columns": [], "source": resolve(statement.source),
+                "destination": statement.table}
+    for source, line in sources:
+        if source not in datasets:
+            raise CustomSpSyntaxError("Dataset {} is never defined".format(source), line)
+    return datasets
+
+
+def resolve_column_lineage(datasets):
+    """
+    Trace every column of every dataset back to the table columns it comes
+    from, through any number of ALIAS / PROJECT / GROUPED_SUM steps.
+
+    Each dataset is resolved exactly once and its answer is reused by every
+    dataset built on top of it, so the cost grows linearly with the size of
+    the procedure no matter how deep or wide it is. The walk uses an explicit
+    stack, so very deep procedures don't hit python's recursion limit.
+
+    A READ dataset's columns come from the table it is named after. A WRITE
+    dataset has the columns of the dataset it writes. A column that can't be
+    found in its source (or a source that doesn't exist) resolves to nothing.
+
+    :param dict(str, dict) datasets: The output of :func:`resolve_datasets`.
+    :return: For each dataset, each column mapped to the list of
+        (table, column) pairs it is derived from.
+    :rtype: dict(str, dict(str, list(tuple(str, str))))
+    """
+    lineage = {}
+    in_progress = set()
+
+    def columns_of(name):
+        definition = datasets[name]
+        if "destination" in definition:
+            return datasets.get(definition["source"], {}).get("columns", [])
+        return definition["columns"]
+
+    for root in datasets:
+        stack = [root]
+        while stack:
+            name = stack[-1]
+            if name in lineage:
+                stack.pop()
+                continue
+            definition = datasets[name]
+            source = definition["source"]
+            if source != "*" and source in datasets and source not in lineage:
+                if source in in_progress:
+                    raise ValueError(
+                        "Dataset {} depends on itself through {}".format(name, source))
+                in_progress.add(name)
+                stack.append(source)
+                continue
+
+            if source == "*":
+                resolved = {c: [(name, c)] for c in definition["columns"]}
+            else:
+                upstream = lineage.get(source, {})
+                resolved = {c: upstream.get(c, []) for c in columns_of(name)}
+            lineage[name] = resolved
+            in_progress.discard(name)
+            stack.pop()
+
+    return lineage
+
+
+def find_scripts(directory, pattern="*.custom"):
+    """
+    Find every stored procedure file under a directory (recursively).
+
+    :param str directory: The directory to search.
+    :param str pattern: The glob pattern of stored procedure files.
+    :return: The sorted paths of the matching files.
+    :rtype: list(str)
+    """
+    return sorted(glob.glob(os.path.join(directory, "**", pattern), recursive=True))
+
+
+def _parse_and_resolve(path, directory):
+    # Runs inside a worker process, so it only returns plain, picklable
+    # data. A broken script is reported rather than failing the whole batch.
+    name = os.path.relpath(path, directory).replace(os.sep, "/")
+    try:
+        return name, resolve_datasets(parse_file(path, name)), None
+    except (ValueError, NotImplementedError) as e:
+        return name, None, "{}: {}".format(path, e)
+
+
+def parse_directory(directory, max_workers=None, pattern="*.custom"):
+    """
+    Parse and resolve every stored procedure under a directory across a pool
+    of worker processes. Parsing is CPU bound python, so processes (rather
+    than threads) are what lets this scale across cores.
+
+    The name of each procedure is its path relative to the directory.
+
+    :param str directory: The directory to search.
+    :param int max_workers: The number of worker processes (defaults to the
+        number of cores).
+    :param str pattern: The glob pattern of stored procedure files.
+    :return: A generator of (name, datasets, error) in file order. Either
+        datasets (see :func:`resolve_datasets`) or error is None.
+    :rtype: Iterator(tuple(str, dict, str))
+    """
+    paths = find_scripts(directory, pattern)
+    if not paths:
+        return
+    max_workers = max_workers or os.cpu_count() or 1
+    # Hand out work in chunks so that thousands of small files don't turn
+    # into thousands of round trips to the workers.
+    chunksize = max(1, len(paths) // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(
+            _parse_and_resolve, paths, [directory] * len(paths), chunksize=chunksize)
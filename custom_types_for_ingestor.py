@@ -1,22 +1,29 @@
-import os
+import argparse
 import json
 
 from pyapacheatlas.core import AtlasEntity, AtlasProcess
 from pyapacheatlas.core.util import GuidTracker
-from pyapacheatlas.auth import ServicePrincipalAuthentication
-from pyapacheatlas.core.client import PurviewClient
 from pyapacheatlas.core.typedef import AtlasAttributeDef, EntityTypeDef, RelationshipTypeDef, ParentEndDef, ChildEndDef
 
+from ingestor_client import add_client_arguments, get_client, govern_client
+from typedef_sync import DEFAULT_TYPEDEF_CACHE_PATH, sync_typedefs
 
-oauth = ServicePrincipalAuthentication(
-    tenant_id=os.environ.get("TENANT_ID", ""),
-    client_id=os.environ.get("CLIENT_ID", ""),
-    client_secret=os.environ.get("CLIENT_SECRET", "")
-)
-client = PurviewClient(
-    account_name=os.environ.get("PURVIEW_NAME", ""),
-    authentication=oauth
-)
+
+parser = argparse.ArgumentParser(description="Upload the custom types used by the ingestors")
+add_client_arguments(parser, export=False)
+parser.add_argument("--force", action="store_true",
+                    help="Force an update of every type, even if it hasn't changed")
+parser.add_argument("--check-server", action="store_true",
+                    help="Compare with Purview even if the local cache says nothing changed")
+parser.add_argument("--typedef-cache", default=DEFAULT_TYPEDEF_CACHE_PATH,
+                    help="The local cache of the types last synced ('' to disable)")
+args = parser.parse_args()
+
+# First we need to log in with our Azure Purview Credentials.
+# A --dry-run still reads the types from Purview to show what would change,
+# it just doesn't upload anything. With --rate-governor, those reads (and
+# the uploads) share the rate of the other ingestors.
+client = govern_client(get_client(token_cache_path=args.token_cache or None), args)
 
 # Let's create five custom types for use in our fictional ETL and Data Source custom ingestor
 # You should customize this script for your custom data source and etl tools.
@@ -34,6 +41,10 @@ custom_db = EntityTypeDef(
 )
 custom_db.attributeDefs.append(AtlasAttributeDef(
     "container", isOptional=True, typeName="string").to_json())
+# When the data is profiled (parse_datasource_sys_table.py --profile), the
+# table also gets its row count.
+custom_db.attributeDefs.append(AtlasAttributeDef(
+    "rowCount", isOptional=True, typeName="long").to_json())
 
 # I need to represent columns in my custom database too!
 # I can use the built-in column entity type as the basis.
@@ -42,6 +53,16 @@ custom_db_column = EntityTypeDef(
     superTypes=["column"]
 )
 
+# And each column gets the statistics of its values. The min, max and mean
+# are only set for numeric columns and the distinct count is an estimate.
+custom_db_column.attributeDefs.extend([
+    AtlasAttributeDef("nullCount", isOptional=True, typeName="long").to_json(),
+    AtlasAttributeDef("distinctCount", isOptional=True, typeName="long").to_json(),
+    AtlasAttributeDef("minValue", isOptional=True, typeName="double").to_json(),
+    AtlasAttributeDef("maxValue", isOptional=True, typeName="double").to_json(),
+    AtlasAttributeDef("meanValue", isOptional=True, typeName="double").to_json()
+])
+
 # I also need a relationship type that connects the columns to the tables
 # The 'COMPOSITION' relationship Category means a table can't be deleted
 # without deleting the columns first (i.e. the columns can't be orphaned).
@@ -90,12 +111,28 @@ custom_etl_job.attributeDefs.extend([AtlasAttributeDef(
 
 
 # Finally, let's upload these types and confirm that they uploaded successfully
-types_results = client.upload_typedefs(
-    entityDefs=[custom_db, custom_db_column,
-                custom_db_storedproc, custom_etl_job],
-    relationshipDefs=[table_column_relationship],
-    force_update=True
-)
-
-print("Results from upload:")
+typedefs = {
+    "entityDefs": [custom_db, custom_db_column,
+                   custom_db_storedproc, custom_etl_job],
+    "relationshipDefs": [table_column_relationship]
+}
+
+if args.force and not args.dry_run:
+    types_results = client.upload_typedefs(force_update=True, **typedefs)
+else:
+    # Forcing an update of every type on every deployment is expensive for
+    # the catalog. Instead, only the types that are new or changed since the
+    # last sync are uploaded. (See `typedef_sync.py` for the details.)
+    types_results = sync_typedefs(
+        client, typedefs, cache_path=args.typedef_cache or None, dry_run=args.dry_run,
+        check_server=args.check_server or args.force)
+    for name, status in types_results["types"].items():
+        print("{}: {}".format(name, status))
+    for name, diff in types_results.pop("diffs").items():
+        print(diff)
+
+if args.dry_run:
+    print("Results of the dry run (nothing was uploaded):")
+else:
+    print("Results from upload:")
 print(json.dumps(types_results, indent=2))
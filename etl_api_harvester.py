@@ -0,0 +1,152 @@
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# This module harvests every job from my fictional ETL tool's API rather than
+# one hard-coded job at a time. With thousands of jobs, fetching them one
+# after the other means the ingestor spends almost all of its time waiting on
+# the network, so the jobs are fetched concurrently instead:
+# * asyncio coordinates the requests and hands each response back as soon as
+#   it arrives (not in the order they were asked for).
+# * A requests.Session with a bounded connection pool keeps the connections
+#   to the ETL server alive, so each job doesn't pay for a new TCP handshake.
+# * Every request has a timeout, and transient failures (connection errors,
+#   timeouts, 5xx and 429 responses) are retried with a backoff.
+
+# The api looks like (see `ETLTool/server.py`):
+# GET /api/jobs        -> {"jobs": ["001", "002", ...]}
+# GET /api/job/<jobId> -> {"name": "...", "lastRun": "...", "inputs": [...], "outputs": [...]}
+
+DEFAULT_BASE_URL = "http://localhost:8088"
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 0.5
+
+
+def make_session(max_connections=DEFAULT_MAX_CONNECTIONS):
+    """
+    Create a requests Session whose connection pool holds (and blocks at)
+    `max_connections` keep-alive connections per host.
+
+    :param int max_connections: The most connections open to the ETL server.
+    :rtype: :class:`requests.Session`
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=max_connections, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _get_json(session, url, timeout):
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def _is_retryable(error):
+    """
+    Connection errors, timeouts and 5xx / 429 responses are worth another
+    try. Anything else (a 404 for a job that doesn't exist, a response that
+    isn't json) will fail the same way every time.
+    """
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else 0
+        return status >= 500 or status == 429
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+async def _fetch_json(url, session, executor, semaphore, timeout, max_retries, backoff_seconds):
+    loop = asyncio.get_running_loop()
+    attempt = 0
+    while True:
+        # The semaphore is only held for the request itself, so a job that
+        # is backing off doesn't keep a connection away from the others.
+        async with semaphore:
+            try:
+                return await loop.run_in_executor(executor, _get_json, session, url, timeout)
+            except requests.RequestException as e:
+                error = e
+        if not _is_retryable(error) or attempt >= max_retries:
+            raise error
+        await asyncio.sleep(backoff_seconds * (2 ** attempt) * (1 + random.random()))
+        attempt += 1
+
+
+async def harvest_jobs(base_url=DEFAULT_BASE_URL, job_ids=None,
+                       max_connections=DEFAULT_MAX_CONNECTIONS, timeout=DEFAULT_TIMEOUT,
+                       max_retries=DEFAULT_MAX_RETRIES, backoff_seconds=DEFAULT_BACKOFF_SECONDS):
+    """
+    Fetch many jobs from the ETL tool's API concurrently, yielding each job
+    as soon as its response arrives. Only `max_connections * 2` jobs are in
+    flight at once, so the list of job ids can be as long as you like.
+
+    A job that can't be fetched does not stop the harvest. It is yielded
+    with its error instead of its response.
+
+    :param str base_url: The root of the ETL tool's API.
+    :param job_ids: The ids of the jobs to fetch. Defaults to every job
+        listed by GET /api/jobs.
+    :param int max_connections: The most requests in flight at once.
+    :param float timeout: Seconds to wait on the server for each request.
+    :param int max_retries: How many times a request is retried on a
+        transient failure.
+    :param float backoff_seconds: The base delay between retries.
+    :return: An async generator of (job id, response json, error) where
+        either the response json or the error is None.
+    :rtype: AsyncIterator(tuple(str, dict, str))
+    """
+    base_url = base_url.rstrip("/")
+    semaphore = asyncio.Semaphore(max_connections)
+    session = make_session(max_connections)
+    executor = ThreadPoolExecutor(max_workers=max_connections)
+
+    async def fetch(path):
+        return await _fetch_json(base_url + path, session, executor, semaphore,
+                                 timeout, max_retries, backoff_seconds)
+
+    async def fetch_job(job_id):
+        try:
+            return job_id, await fetch("/api/job/{}".format(job_id)), None
+        # A body that isn't json raises a ValueError
+        except (requests.RequestException, ValueError) as e:
+            return job_id, None, str(e)
+
+    pending = set()
+    try:
+        if job_ids is None:
+            job_ids = (await fetch("/api/jobs"))["jobs"]
+
+        for job_id in job_ids:
+            if len(pending) >= max_connections * 2:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            pending.add(asyncio.ensure_future(fetch_job(job_id)))
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        executor.shutdown(wait=False)
+        session.close()
+
+
+def harvest_all_jobs(base_url=DEFAULT_BASE_URL, job_ids=None, **kwargs):
+    """
+    Run :func:`harvest_jobs` to completion from synchronous code. It takes
+    the same keyword arguments.
+
+    :return: Every (job id, response json, error) in the order they arrived.
+    :rtype: list(tuple(str, dict, str))
+    """
+    async def collect():
+        return [job async for job in harvest_jobs(base_url, job_ids, **kwargs)]
+    return asyncio.run(collect())
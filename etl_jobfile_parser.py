@@ -0,0 +1,310 @@
+import xml.etree.ElementTree as ET
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List
+# NOTE: Python documentation encourages you to use defusedxml
+# if you can't trust the source to be non-malicious
+
+# This module reads my fictional ETL tool's job files. Rather than loading
+# the whole document into a DOM (like xml.dom.minidom does), it uses
+# iterparse to stream through the file. Each input, column mapping and
+# output is emitted as soon as its element has been read and the element is
+# then cleared, so memory stays small even for job files with thousands of
+# projection columns.
+
+# A job file looks like:
+# <job name="..." jobId="...">
+#     <node type="join" id="start">
+#         <inputs><input typeName="customDB">tblDailySales</input></inputs>
+#     </node>
+#     <node type="projection" id="step01">
+#         <columns>
+#             <column>
+#                 <sourceName>tblCustomer.customerId</sourceName>
+#                 <targetName>customerId</targetName>
+#             </column>
+#         </columns>
+#         <dependsOn><step>start</step></dependsOn>
+#     </node>
+#     <node type="sink" id="step002">
+#         <output typeName="blob">https://...</output>
+#         <dependsOn><step>step01</step></dependsOn>
+#     </node>
+# </job>
+
+
+def _text(elem):
+    return (elem.text or "").strip()
+
+
+def iter_job_events(source):
+    """
+    Stream the contents of a job file as events. Each event is a tuple of
+    (kind, dict) where kind is one of:
+
+    * job: The job's attributes (e.g. name and jobId). Always first.
+    * input: {"name", "type", "nodeId", "nodeType"} for each <input>.
+    * mapping: {"Source", "Sink", "nodeId", "nodeType"} for each <column>.
+    * output: {"name", "type", "nodeId", "nodeType"} for each <output>.
+    * node: {"nodeId", "nodeType", "dependsOn"} when a <node> closes, where
+      dependsOn is the list of node ids from its <dependsOn> steps.
+
+    :param source: A path or file object of the job file.
+    :return: A generator of events in document order.
+    :rtype: Iterator(tuple(str, dict))
+    :raises JobGraphError: When an <input>, <column>, <output> or <step>
+        isn't inside a <node>.
+    """
+    # The elements that are currently open, so that a finished element
+    # can be removed from its parent once it has been emitted.
+    open_elements = []
+    # The node that is currently open, if any
+    node = {}
+    depends_on = []
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if not open_elements:
+                yield "job", dict(elem.attrib)
+            elif tag == "node":
+                node = {"nodeId": elem.get("id"), "nodeType": elem.get("type")}
+                depends_on = []
+            open_elements.append(elem)
+            continue
+
+        open_elements.pop()
+        if tag in ("input", "column", "output", "step") and not node:
+            raise JobGraphError("<{}> is outside of a <node>".format(tag))
+        if tag == "input":
+            yield "input", dict(name=_text(elem), type=elem.get("typeName"), **node)
+        elif tag == "column":
+            yield "mapping", dict(
+                Source=elem.findtext("sourceName", "").strip(),
+                Sink=elem.findtext("targetName", "").strip(),
+                **node
+            )
+        elif tag == "output":
+            yield "output", dict(name=_text(elem), type=elem.get("typeName"), **node)
+        elif tag == "step":
+            depends_on.append(_text(elem))
+            continue
+        elif tag == "node":
+            yield "node", dict(dependsOn=depends_on, **node)
+            node = {}
+            depends_on = []
+        else:
+            continue
+
+        # Everything in this element has been emitted, so drop it from the
+        # partially built tree. It is always the last child of its parent.
+        elem.clear()
+        if open_elements and len(open_elements[-1]) and open_elements[-1][-1] is elem:
+            del open_elements[-1][-1]
+
+
+# A job is really a graph: every node lists the nodes it depends on in its
+# <dependsOn> steps. The classes below collect the streamed events into
+# that graph so a job can have several sources, joins, projections and
+# sinks in any shape rather than a single start node and a straight line.
+
+
+class JobGraphError(ValueError):
+    """
+    Raised when a job's nodes don't form a valid graph (duplicate ids or
+    cycles). A reference to a node that doesn't exist is only dropped, see
+    :meth:`JobGraph.validate`.
+    """
+
+
+@dataclass
+class JobNode:
+    id: str
+    type: str
+    depends_on: List[str] = field(default_factory=list)
+    inputs: List[dict] = field(default_factory=list)
+    mappings: List[dict] = field(default_factory=list)
+    outputs: List[dict] = field(default_factory=list)
+
+
+@dataclass
+class JobGraph:
+    attributes: Dict[str, str]
+    nodes: Dict[str, JobNode]
+
+    @classmethod
+    def from_events(cls, events):
+        """
+        Build the graph from the events of :func:`iter_job_events`.
+        """
+        attributes = {}
+        nodes = {}
+        current = {}
+        for event, item in events:
+            if event == "job":
+                attributes = item
+                continue
+            node_id = item["nodeId"]
+            if node_id not in current:
+                current[node_id] = JobNode(node_id, item["nodeType"])
+            node = current[node_id]
+            if event == "input":
+                node.inputs.append({"name": item["name"], "type": item["type"]})
+            elif event == "mapping":
+                node.mappings.append({"Source": item["Source"], "Sink": item["Sink"]})
+            elif event == "output":
+                node.outputs.append({"name": item["name"], "type": item["type"]})
+            elif event == "node":
+                node.depends_on = item["dependsOn"]
+                del current[node_id]
+                if node_id in nodes:
+                    raise JobGraphError("Node {} is defined more than once".format(node_id))
+                nodes[node_id] = node
+        return cls(attributes, nodes)
+
+    def validate(self):
+        """
+        Drop every <dependsOn> step that refers to a node that isn't in the
+        job (e.g. a step that was renamed in the UI), so the rest of the job
+        can still be ingested. The caller decides how to report them.
+
+        :return: The dropped dependencies, as "node -> step".
+        :rtype: list(str)
+        """
+        dangling = []
+        for node in self.nodes.values():
+            kept = [d for d in node.depends_on if d in self.nodes]
+            dangling.extend("{} -> {}".format(node.id, d)
+                            for d in node.depends_on if d not in self.nodes)
+            node.depends_on = kept
+        return dangling
+
+    def topological_order(self):
+        """
+        The nodes ordered so that every node comes after the nodes it depends
+        on (Kahn's algorithm). Ties keep the order of the job file.
+
+        The graph must have been validated first (see :func:`load_job_graph`).
+
+        :return: The ordered nodes.
+        :rtype: list(:class:`JobNode`)
+        """
+        remaining = {node_id: len(set(node.depends_on)) for node_id, node in self.nodes.items()}
+        dependents = {node_id: [] for node_id in self.nodes}
+        for node in self.nodes.values():
+            for dependency in set(node.depends_on):
+                dependents[dependency].append(node.id)
+
+        ready = deque(node_id for node_id, count in remaining.items() if count == 0)
+        order = []
+        while ready:
+            node_id = ready.popleft()
+            order.append(self.nodes[node_id])
+            for dependent in dependents[node_id]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(order) < len(self.nodes):
+            cycle = [node_id for node_id, count in remaining.items() if count > 0]
+            raise JobGraphError("Job {} has a cycle between nodes: {}".format(
+                self.attributes.get("jobId"), ", ".join(cycle)))
+        return order
+
+    @property
+    def inputs(self):
+        """Every input of every node, without duplicates."""
+        seen = {}
+        for node in self.topological_order():
+            for inp in node.inputs:
+                seen.setdefault((inp["name"], inp["type"]), inp)
+        return list(seen.values())
+
+    @property
+    def outputs(self):
+        """Every output of every sink, without duplicates."""
+        seen = {}
+        for node in self.topological_order():
+            for outp in node.outputs:
+                seen.setdefault((outp["name"], outp["type"]), outp)
+        return list(seen.values())
+
+    def resolve_columns(self):
+        """
+        Work out where every column of every node comes from. Nodes without
+        a projection pass their upstream columns through. A projection's
+        source is either "table.column" for a table read upstream, or the
+        name of a column produced by an upstream projection.
+
+        :return: For each node id, each column mapped to the list of
+            (source table, source column) pairs it is derived from.
+        :rtype: dict(str, dict(str, list(tuple(str, str))))
+        """
+        columns = {}
+        tables = {}
+        for node in self.topological_order():
+            upstream_columns = {}
+            upstream_tables = set(inp["name"] for inp in node.inputs)
+            for dependency in node.depends_on:
+                upstream_columns.update(columns[dependency])
+                upstream_tables.update(tables[dependency])
+            tables[node.id] = upstream_tables
+
+            if not node.mappings:
+                columns[node.id] = upstream_columns
+                continue
+
+            resolved = {}
+            for mapping in node.mappings:
+                table, _, column = mapping["Source"].partition(".")
+                if column and table in upstream_tables:
+                    origins = [(table, column)]
+                else:
+                    origins = upstream_columns.get(mapping["Source"], [])
+                existing = resolved.setdefault(mapping["Sink"], [])
+                existing.extend(o for o in origins if o not in existing)
+            columns[node.id] = resolved
+        return columns
+
+    def column_mappings(self):
+        """
+        The column mappings of every sink, grouped by source table.
+
+        :return: A list of {"sink": output, "source": table name,
+            "mappings": [{"Source": column, "Sink": column}]}.
+        :rtype: list(dict)
+        """
+        columns = self.resolve_columns()
+        results = []
+        for node in self.topological_order():
+            if not node.outputs:
+                continue
+            by_source = {}
+            for sink_column, origins in columns[node.id].items():
+                for table, source_column in origins:
+                    by_source.setdefault(table, []).append(
+                        {"Source": source_column, "Sink": sink_column})
+            for output in node.outputs:
+                for table, mappings in by_source.items():
+                    results.append({"sink": output, "source": table, "mappings": mappings})
+        return results
+
+
+def load_job_graph(source, on_dangling=print):
+    """
+    Stream a job file into a :class:`JobGraph` and check that it's a valid
+    graph. A dependency on a node that doesn't exist is dropped (see
+    :meth:`JobGraph.validate`) and reported through `on_dangling`; cycles
+    and nodes defined twice can't be ingested and raise.
+
+    :param source: A path or file object of the job file.
+    :param on_dangling: Called with a warning for each dropped dependency.
+    :rtype: :class:`JobGraph`
+    :raises JobGraphError: When the job isn't a valid graph.
+    """
+    job = JobGraph.from_events(iter_job_events(source))
+    for dependency in job.validate():
+        on_dangling("Warning: ignoring a dependency on a node that doesn't exist in {}: {}".format(
+            getattr(source, "name", source), dependency))
+    # Sorting the nodes checks that there are no cycles
+    job.topological_order()
+    return job
@@ -0,0 +1,312 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+# This module is the one place the ingestors get their Purview client from.
+# Every ingestor in this sample is a short lived script, often run thousands
+# of times a day by a scheduler, so what happens before the first upload
+# matters:
+# * The client (and pyapacheatlas' client module with it) is only built the
+#   first time it's used. A run that finds nothing to upload never builds it.
+# * The AAD bearer token is cached on disk, so back to back runs reuse it
+#   instead of asking Azure for a new one every time. It's refreshed a few
+#   minutes before it expires.
+# * A dry run (--dry-run) never authenticates or sends anything. It only
+#   counts what would have been sent.
+# * An export (--export DIR) writes what would have been sent to local files
+#   for `replay_entities.py` to upload later (see `ingestor_export.py`).
+# * pyapacheatlas opens a new connection (and TLS handshake) for every
+#   request. The bulk uploads are sent through one requests Session instead,
+#   whose pool keeps the connections to Purview alive and shared by every
+#   upload thread (see :class:`PooledClient`).
+
+DEFAULT_TOKEN_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "purview-ingestor", "tokens.json")
+# A cached token is refreshed once it's this close to expiring
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+# The most keep-alive connections held open to Purview
+DEFAULT_MAX_CONNECTIONS = 16
+# This is the resource id for the data catalog
+PURVIEW_RESOURCE = "73c2949e-da2d-457a-9607-fcc665198967"
+
+
+class TokenCache():
+    """
+    Bearer tokens kept in a small json file (readable only by you) keyed by
+    tenant, client id and resource.
+
+    :param str path: The file to keep the tokens in.
+    :param int refresh_margin: Seconds before expiry that a token is
+        treated as expired.
+    """
+
+    def __init__(self, path=DEFAULT_TOKEN_CACHE_PATH,
+                 refresh_margin=TOKEN_REFRESH_MARGIN_SECONDS):
+        self.path = path
+        self.refresh_margin = refresh_margin
+
+    def _read(self):
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        """
+        :return: The cached (access token, expires on) or None if there is
+            no token that is still good.
+        :rtype: tuple(str, float)
+        """
+        entry = self._read().get(key)
+        if not entry or entry["expires_on"] - self.refresh_margin <= time.time():
+            return None
+        return entry["access_token"], entry["expires_on"]
+
+    def put(self, key, access_token, expires_on):
+        """
+        Store a token, dropping any that have expired.
+        """
+        now = time.time()
+        tokens = {k: v for k, v in self._read().items() if v.get("expires_on", 0) > now}
+        tokens[key] = {"access_token": access_token, "expires_on": expires_on}
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file and swap it in so that concurrent runs
+        # never read half a file.
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as fp:
+            json.dump(tokens, fp)
+        os.replace(temp_path, self.path)
+
+
+class CachedServicePrincipalAuthentication():
+    """
+    Authenticates to the Azure OAuth provider using a service principal,
+    like pyapacheatlas' ServicePrincipalAuthentication, but shares its token
+    with other runs through a :class:`TokenCache`.
+
+    :param str tenant_id: The tenant id of your Azure subscription.
+    :param str client_id: The client id or application id of your
+        service principal.
+    :param str client_secret: The client secret or application secret
+        of your service principal.
+    :param cache: Where to cache the token. None disables the disk cache.
+    :type cache: :class:`TokenCache`
+    """
+
+    def __init__(self, tenant_id, client_id, client_secret, cache=None):
+        self.oauth_url = "https://login.microsoftonline.com/{}/oauth2/token".format(tenant_id)
+        self.data = {
+            "resource": PURVIEW_RESOURCE,
+            "client_id": client_id,
+            "grant_type": "client_credentials",
+            "client_secret": client_secret
+        }
+        self.cache = cache
+        self.cache_key = "{}:{}:{}".format(tenant_id, client_id, PURVIEW_RESOURCE)
+        self.access_token = None
+        self.expires_on = 0
+        # The upload workers all ask for headers at once
+        self.lock = threading.Lock()
+
+    def _request_token(self):
+        import requests
+        response = requests.post(self.oauth_url, data=self.data)
+        response.raise_for_status()
+        auth_json = response.json()
+        return auth_json["access_token"], float(auth_json["expires_on"])
+
+    def get_authentication_headers(self):
+        """
+        Gets the current access token or finds / requests a new one if it
+        is about to expire.
+
+        :return: The authorization headers.
+        :rtype: dict(str, str)
+        """
+        with self.lock:
+            margin = self.cache.refresh_margin if self.cache else TOKEN_REFRESH_MARGIN_SECONDS
+            if self.access_token is None or self.expires_on - margin <= time.time():
+                cached = self.cache.get(self.cache_key) if self.cache else None
+                if cached:
+                    self.access_token, self.expires_on = cached
+                else:
+                    self.access_token, self.expires_on = self._request_token()
+                    if self.cache:
+                        self.cache.put(self.cache_key, self.access_token, self.expires_on)
+            return {
+                "Authorization": "Bearer " + self.access_token,
+                "Content-Type": "application/json"
+            }
+
+
+class LazyClient():
+    """
+    Stands in for a client and only builds the real one (with the factory)
+    the first time one of its methods is used.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return getattr(self._client, name)
+
+
+class PooledClient():
+    """
+    Wraps an AtlasClient or PurviewClient to send its bulk uploads through
+    one requests Session, so that concurrent uploads reuse a pool of
+    keep-alive connections. Anything else is passed through to the wrapped
+    client.
+
+    :param client: The client to wrap.
+    :param int max_connections: How many connections the pool keeps open.
+    """
+
+    def __init__(self, client, max_connections=DEFAULT_MAX_CONNECTIONS):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self._client = client
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def upload_entities(self, batch):
+        # The same request as AtlasClient.upload_entities, on the session
+        response = self.session.post(
+            self._client.endpoint_url + "/entity/bulk",
+            json=self._client._prepare_entity_upload(batch),
+            headers=self._client.authentication.get_authentication_headers()
+        )
+        return self._client._handle_response(response)
+
+
+class DryRunClient():
+    """
+    A client that sends nothing. It answers like Purview would for an upload
+    that changed nothing and counts what it was asked to do.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.entities = 0
+
+    def _count(self, name, entities=0):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.entities += entities
+
+    def upload_entities(self, batch):
+        self._count("upload_entities", len(batch))
+        return {"mutatedEntities": {}, "guidAssignments": {}}
+
+    def partial_update_entity(self, guid=None, typeName=None, qualifiedName=None, attributes={}):
+        self._count("partial_update_entity")
+        return {}
+
+    def upload_typedefs(self, **kwargs):
+        self._count("upload_typedefs")
+        return {}
+
+    def summary(self):
+        with self.lock:
+            return {"dryRun": True, "calls": dict(self.calls), "entities": self.entities}
+
+
+def get_client(dry_run=False, token_cache_path=DEFAULT_TOKEN_CACHE_PATH,
+               max_connections=DEFAULT_MAX_CONNECTIONS):
+    """
+    Get the Purview client for an ingestor. The account and service principal
+    come from the PURVIEW_NAME, TENANT_ID, CLIENT_ID and CLIENT_SECRET
+    environment variables.
+
+    :param bool dry_run: Return a :class:`DryRunClient` that never
+        authenticates or sends anything.
+    :param str token_cache_path: The file to cache bearer tokens in. None
+        disables the disk cache.
+    :param int max_connections: How many connections to Purview the uploads
+        share (see :class:`PooledClient`).
+    :return: A client that is built on first use.
+    :rtype: Union(:class:`LazyClient`, :class:`DryRunClient`)
+    """
+    if dry_run:
+        return DryRunClient()
+
+    def build():
+        from pyapacheatlas.core.client import PurviewClient
+        authentication = CachedServicePrincipalAuthentication(
+            tenant_id=os.environ.get("TENANT_ID", ""),
+            client_id=os.environ.get("CLIENT_ID", ""),
+            client_secret=os.environ.get("CLIENT_SECRET", ""),
+            cache=TokenCache(token_cache_path) if token_cache_path else None
+        )
+        return PooledClient(PurviewClient(
+            account_name=os.environ.get("PURVIEW_NAME", ""),
+            authentication=authentication
+        ), max_connections)
+    return LazyClient(build)
+
+
+def add_client_arguments(parser, export=True):
+    """
+    Add the --dry-run, --token-cache, --rate-governor and --max-rate options
+    (and --export unless `export` is False) to an ingestor's argparse parser.
+    """
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Parse everything but don't authenticate or upload")
+    parser.add_argument("--token-cache", default=DEFAULT_TOKEN_CACHE_PATH,
+                        help="Where to cache the Purview bearer token ('' to disable)")
+    parser.add_argument("--rate-governor", default=None, metavar="FILE",
+                        help="Share a request rate that backs off when Purview throttles with every"
+                             " ingestor using this file (see ingestor_governor.py)")
+    parser.add_argument("--max-rate", type=float, default=None,
+                        help="The most requests per second the rate governor allows")
+    if export:
+        parser.add_argument("--export", default=None, metavar="DIRECTORY",
+                            help="Write the entities to NDJSON files here instead of uploading")
+    return parser
+
+
+def client_from_args(args):
+    """
+    The client for the options added by :func:`add_client_arguments`.
+    """
+    if getattr(args, "export", None):
+        from ingestor_export import EntityExporter, ExportClient
+        client = ExportClient(EntityExporter(args.export))
+        atexit.register(client.close)
+        return client
+    client = get_client(dry_run=args.dry_run, token_cache_path=args.token_cache or None)
+    if args.dry_run:
+        return client
+    return govern_client(client, args)
+
+
+def govern_client(client, args):
+    """
+    Wrap a client in the shared rate governor (see `ingestor_governor.py`)
+    if --rate-governor was given.
+    """
+    if not getattr(args, "rate_governor", None):
+        return client
+    from ingestor_governor import DEFAULT_MAX_RATE, GovernedClient, RateGovernor
+    governor = RateGovernor(args.rate_governor, max_rate=args.max_rate or DEFAULT_MAX_RATE)
+    return GovernedClient(client, governor)
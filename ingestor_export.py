@@ -0,0 +1,327 @@
+import json
+import os
+import threading
+import time
+
+from ingestor_upload import (
+    DEFAULT_BACKOFF_SECONDS,
+    DEFAULT_MAX_BYTES,
+    DEFAULT_MAX_ENTITIES,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_MAX_WORKERS,
+    _merge_results,
+    entity_to_json,
+    group_entities,
+    partial_update_entities,
+    upload_batches
+)
+
+# This module splits an ingestor in two: parsing the source and building the
+# entities, and uploading them to Purview. Instead of uploading, an ingestor
+# can export its entities to local newline-delimited json (NDJSON) files,
+# one Atlas entity per line. `replay_entities.py` later streams those files
+# back into batched, concurrent uploads. That way:
+# * The parse work isn't lost when Purview is slow or down.
+# * Parsing can run at full speed on nodes without any access to Purview
+#   and the upload can run elsewhere with its own concurrency.
+# * You get a local artifact you can diff, grep and test against.
+
+# The layout of an export directory:
+# * <run>-s<stage>-<sequence>.ndjson: The entities. Entities that must be
+#   uploaded together (they point at each other's placeholder guids) are
+#   written on consecutive lines followed by an empty line. A group is never
+#   split across files, and files roll over once they reach --max-file-bytes.
+#   Each stage (e.g. the tables before the processes that refer to them by
+#   qualified name) starts a new file.
+# * <run>-updates.ndjson: Partial attribute updates (e.g. a job's lastRun),
+#   one set of `partial_update_entity` arguments per line.
+# * replay_offsets.json: How far the replay has got in each file.
+# The file names sort in the order they have to be replayed.
+
+DEFAULT_MAX_FILE_BYTES = 64 * 1024 * 1024
+OFFSETS_FILE = "replay_offsets.json"
+UPDATES_SUFFIX = "-updates.ndjson"
+
+
+class EntityExporter():
+    """
+    Writes groups of entities to size-rotated NDJSON files. It's safe to
+    write from several threads.
+
+    :param str directory: The export directory (created if needed).
+    :param int max_file_bytes: Roll over to a new file past this size.
+    """
+
+    def __init__(self, directory, max_file_bytes=DEFAULT_MAX_FILE_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_file_bytes = max_file_bytes
+        # The run id keeps the files of separate runs apart and in order
+        self.run = "{}-{}".format(time.strftime("%Y%m%dT%H%M%S"), os.getpid())
+        self.lock = threading.Lock()
+        self.stage = 1
+        self.sequence = 0
+        self.fp = None
+        self.file_bytes = 0
+        self.updates_fp = None
+        self.entities = 0
+        self.updates = 0
+
+    def _next_file(self):
+        if self.fp:
+            self.fp.close()
+        self.sequence += 1
+        name = "{}-s{:02d}-{:06d}.ndjson".format(self.run, self.stage, self.sequence)
+        self.fp = open(os.path.join(self.directory, name), "w", encoding="utf-8")
+        self.file_bytes = 0
+
+    def write_group(self, entities):
+        """
+        Write entities that must be uploaded together.
+
+        :param list entities: AtlasEntity objects or dicts.
+        """
+        lines = [json.dumps(entity_to_json(e), separators=(",", ":")) for e in entities]
+        if not lines:
+            return
+        data = "\n".join(lines) + "\n\n"
+        with self.lock:
+            if self.fp is None or (self.file_bytes and
+                                   self.file_bytes + len(data) > self.max_file_bytes):
+                self._next_file()
+            self.fp.write(data)
+            self.file_bytes += len(data)
+            self.entities += len(lines)
+
+    def write_entities(self, entities):
+        """
+        Split the entities into the groups that must be uploaded together
+        (see :func:`~ingestor_upload.group_entities`) and write them.
+        """
+        for group in group_entities(entities):
+            self.write_group(group)
+
+    def end_stage(self):
+        """
+        Anything written after this is replayed only once everything written
+        before it has been uploaded.
+        """
+        with self.lock:
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+            self.stage += 1
+            self.sequence = 0
+
+    def write_update(self, **kwargs):
+        """
+        Record a partial attribute update with the keyword arguments of
+        `partial_update_entity`.
+        """
+        line = json.dumps(kwargs, separators=(",", ":")) + "\n"
+        with self.lock:
+            if self.updates_fp is None:
+                self.updates_fp = open(os.path.join(
+                    self.directory, self.run + UPDATES_SUFFIX), "w", encoding="utf-8")
+            self.updates_fp.write(line)
+            self.updates += 1
+
+    def close(self):
+        with self.lock:
+            for fp in [self.fp, self.updates_fp]:
+                if fp:
+                    fp.close()
+            self.fp = self.updates_fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ExportClient():
+    """
+    A client that writes every upload to an :class:`EntityExporter` instead
+    of sending it to Purview, so any ingestor can export without changes.
+    It answers like Purview would for an upload that changed nothing.
+    """
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+
+    def upload_entities(self, batch):
+        # A batch is made of whole groups, so it is kept together
+        self.exporter.write_group(batch)
+        return {"mutatedEntities": {}, "guidAssignments": {}}
+
+    def partial_update_entity(self, guid=None, typeName=None, qualifiedName=None, attributes={}):
+        update = {"attributes": attributes}
+        if guid:
+            update["guid"] = guid
+        else:
+            update.update(typeName=typeName, qualifiedName=qualifiedName)
+        self.exporter.write_update(**update)
+        return {}
+
+    def end_stage(self):
+        self.exporter.end_stage()
+
+    def close(self):
+        self.exporter.close()
+
+    def summary(self):
+        return {"export": self.exporter.directory, "run": self.exporter.run,
+                "entities": self.exporter.entities, "updates": self.exporter.updates}
+
+
+def iter_groups(path, offset=0):
+    """
+    Stream the groups of an export file.
+
+    :param str path: The export file.
+    :param int offset: The byte offset to start from (a group boundary).
+    :return: A generator of (group, end offset, size in bytes) where the
+        group is a list of entity dicts.
+    :rtype: Iterator(tuple(list(dict), int, int))
+    """
+    with open(path, "rb") as fp:
+        fp.seek(offset)
+        group, group_bytes = [], 0
+        for line in iter(fp.readline, b""):
+            if line.strip():
+                group.append(json.loads(line))
+                group_bytes += len(line)
+            elif group:
+                yield group, fp.tell(), group_bytes
+                group, group_bytes = [], 0
+        # The last group of a file that was cut short
+        if group:
+            yield group, fp.tell(), group_bytes
+
+
+def export_files(directory):
+    """The export files of a directory in the order they must be replayed."""
+    return sorted(f for f in os.listdir(directory) if f.endswith(".ndjson"))
+
+
+def _load_offsets(directory):
+    try:
+        with open(os.path.join(directory, OFFSETS_FILE)) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_offsets(directory, offsets):
+    path = os.path.join(directory, OFFSETS_FILE)
+    with open(path + ".tmp", "w") as fp:
+        json.dump(offsets, fp, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _replay_file(client, path, offset, on_progress, max_entities, max_bytes, **kwargs):
+    # The end offset of every batch, by batch number
+    ends = []
+
+    def batches():
+        batch, batch_bytes, end = [], 0, offset
+        for group, group_end, group_bytes in iter_groups(path, offset):
+            too_many = len(batch) + len(group) > max_entities
+            too_large = batch_bytes + group_bytes > max_bytes
+            if batch and (too_many or too_large):
+                ends.append(end)
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.extend(group)
+            batch_bytes += group_bytes
+            end = group_end
+        if batch:
+            ends.append(end)
+            yield batch
+
+    # Batches finish out of order. The offset only moves past a batch once
+    # it and every batch before it have been uploaded, so a replay that is
+    # stopped (or hits a failure) resumes from the first batch not known to
+    # be uploaded. Uploads are create-or-update, so sending a batch twice
+    # is harmless.
+    succeeded = set()
+    progress = {"next": 0}
+
+    def on_batch_done(batch_number, error):
+        if error is None:
+            succeeded.add(batch_number)
+        while progress["next"] in succeeded:
+            on_progress(ends[progress["next"]])
+            progress["next"] += 1
+
+    return upload_batches(client, batches(), on_batch_done=on_batch_done, **kwargs)
+
+
+def _replay_updates(client, path, offset, on_progress, max_workers, max_retries,
+                    backoff_seconds):
+    updates = []
+    with open(path, "rb") as fp:
+        fp.seek(offset)
+        updates = [json.loads(line) for line in fp if line.strip()]
+        end = fp.tell()
+    results = partial_update_entities(client, updates, max_workers, max_retries,
+                                      backoff_seconds)
+    if not results["failedUpdates"]:
+        on_progress(end)
+    return results
+
+
+def replay_exports(client, directory, max_entities=DEFAULT_MAX_ENTITIES,
+                   max_bytes=DEFAULT_MAX_BYTES, max_workers=DEFAULT_MAX_WORKERS,
+                   max_retries=DEFAULT_MAX_RETRIES, backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+                   restart=False, record_progress=True):
+    """
+    Upload every export file in a directory, in order, picking up where the
+    last replay left off. Each file is streamed into bounded batches and
+    uploaded concurrently (see :func:`~ingestor_upload.upload_batches`).
+    The progress is saved to replay_offsets.json as batches complete.
+
+    :param client: The AtlasClient or PurviewClient to upload with.
+    :param str directory: The export directory.
+    :param bool restart: Ignore the saved offsets and replay everything.
+    :param bool record_progress: Save the offsets (turn off for a dry run).
+    :return: The merged results, plus the number of partial updates and
+        those that failed.
+    :rtype: dict
+    """
+    offsets = {} if restart else _load_offsets(directory)
+    merged = {"mutatedEntities": {}, "guidAssignments": {}, "failedBatches": [],
+              "updatedEntities": 0, "failedUpdates": []}
+    upload_options = dict(max_workers=max_workers, max_retries=max_retries,
+                          backoff_seconds=backoff_seconds)
+
+    for name in export_files(directory):
+        path = os.path.join(directory, name)
+        offset = offsets.get(name, 0)
+        if offset >= os.path.getsize(path):
+            continue
+
+        def on_progress(end):
+            offsets[name] = end
+            if record_progress:
+                _save_offsets(directory, offsets)
+
+        if name.endswith(UPDATES_SUFFIX):
+            results = _replay_updates(client, path, offset, on_progress, **upload_options)
+            merged["updatedEntities"] += results["updated"]
+            merged["failedUpdates"].extend(results["failedUpdates"])
+            continue
+
+        results = _replay_file(client, path, offset, on_progress, max_entities, max_bytes,
+                               **upload_options)
+        _merge_results(merged, results)
+        for failed in results["failedBatches"]:
+            failed["file"] = name
+        merged["failedBatches"].extend(results["failedBatches"])
+        # Later files may refer to entities in this one (e.g. the processes
+        # of the next stage), so stop here and let the next replay resume.
+        if results["failedBatches"]:
+            break
+
+    return merged
@@ -0,0 +1,299 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# A throttled request is recognized the same way the upload's retries do
+from ingestor_upload import is_throttled
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the governor still works, but only within one process
+    fcntl = None
+
+# This module keeps the ingestors from throttling each other. Each ingestor
+# uploads concurrently and retries on its own, so when many of them run at
+# once on the same node (say one per source, on the same schedule) they
+# collectively send more than Purview accepts, get throttled (429 Too Many
+# Requests) and retry into more throttling, and everything ends up slower
+# than if they had taken turns.
+
+# The rate governor is a token bucket shared by every ingestor on the node:
+# * Every request to Purview takes a token first. Tokens are added at the
+#   current rate (requests per second), up to a small burst.
+# * The bucket lives in a small json file that is locked while it's read and
+#   written (flock), so every process (and thread) draws from the same one.
+# * The rate adapts like TCP's congestion control (AIMD): every request that
+#   succeeds adds a little to the rate, up to a maximum, and a request that
+#   is throttled halves it. Several requests that are throttled at the same
+#   moment only halve it once.
+# * How many requests are waiting for a token across every process (the
+#   queue depth) is kept in the file too, by process id.
+# Point every ingestor at the same file with --rate-governor.
+
+DEFAULT_GOVERNOR_PATH = "./.rate_governor.json"
+DEFAULT_INITIAL_RATE = 10.0
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_RATE = 50.0
+DEFAULT_BURST = 5.0
+# The rate grows by this many requests per second for every second of
+# requests that succeed
+DEFAULT_INCREASE = 2.0
+DEFAULT_DECREASE = 0.5
+# Throttles within this many seconds of a decrease are the same congestion
+DEFAULT_DECREASE_INTERVAL = 1.0
+DEFAULT_THROTTLE_RETRIES = 5
+# Sleep at most this long between looks at the bucket, so a waiting request
+# notices when the rate goes up
+_MAX_SLEEP = 0.5
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class RateGovernor():
+    """
+    A token bucket whose rate adapts to throttling, shared through a file by
+    every process that uses the same path.
+
+    :param str path: The file to share the bucket through, or None to keep
+        it in this process only.
+    :param float rate: The rate (requests per second) to start at if the
+        file doesn't exist yet.
+    :param float min_rate: The rate never drops below this.
+    :param float max_rate: The rate never grows above this.
+    :param float burst: The most tokens the bucket holds.
+    :param float increase: How many requests per second the rate grows by
+        for every second of successful requests.
+    :param float decrease: What the rate is multiplied by when a request is
+        throttled.
+    :param observer: Called with :meth:`snapshot`'s dict whenever the bucket
+        changes (e.g. to record metrics).
+    """
+
+    def __init__(self, path=DEFAULT_GOVERNOR_PATH, rate=DEFAULT_INITIAL_RATE,
+                 min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE, burst=DEFAULT_BURST,
+                 increase=DEFAULT_INCREASE, decrease=DEFAULT_DECREASE,
+                 decrease_interval=DEFAULT_DECREASE_INTERVAL, observer=None):
+        self.path = path if fcntl is not None else None
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.decrease_interval = decrease_interval
+        self.observer = observer
+        self._initial_rate = min(max(rate, min_rate), max_rate)
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _initial_state(self):
+        return {"rate": self._initial_rate, "tokens": self.burst, "updated": time.time(),
+                "lastDecrease": 0.0, "throttles": 0, "waiting": {}}
+
+    @contextmanager
+    def _bucket(self):
+        with self._lock:
+            if self.path is None:
+                if self._state is None:
+                    self._state = self._initial_state()
+                yield self._state
+                return
+            with open(self.path, "a+") as fp:
+                # The lock is released when the file is closed
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+                fp.seek(0)
+                state = self._load(fp.read())
+                yield state
+                fp.seek(0)
+                fp.truncate()
+                json.dump(state, fp)
+
+    def _load(self, text):
+        # A write that was interrupted (e.g. the process was killed) can
+        # leave a truncated file behind. Rather than failing every request
+        # of every ingestor until someone deletes it, the bucket starts over.
+        try:
+            state = json.loads(text) if text else None
+        except ValueError:
+            state = None
+        if not isinstance(state, dict) or not all(
+                key in state for key in self._initial_state()):
+            state = self._initial_state()
+        return state
+
+    def _refill(self, state, now):
+        elapsed = max(0.0, now - state["updated"])
+        state["tokens"] = min(self.burst, state["tokens"] + elapsed * state["rate"])
+        state["updated"] = now
+
+    def _queue_depth(self, state):
+        if self.path is not None:
+            # Forget the waits of processes that died while waiting
+            for pid in list(state["waiting"]):
+                if not _process_alive(int(pid)):
+                    del state["waiting"][pid]
+        return sum(state["waiting"].values())
+
+    def _snapshot(self, state):
+        return {"rate": state["rate"], "tokens": state["tokens"],
+                "queueDepth": self._queue_depth(state), "throttles": state["throttles"]}
+
+    def _notify(self, snapshot):
+        if self.observer:
+            self.observer(snapshot)
+        return snapshot
+
+    def _wait(self, state, change):
+        pid = str(os.getpid())
+        state["waiting"][pid] = state["waiting"].get(pid, 0) + change
+        if state["waiting"][pid] <= 0:
+            del state["waiting"][pid]
+
+    def acquire(self):
+        """
+        Take a token, waiting for one if the bucket is empty.
+
+        :return: How many seconds were spent waiting (0 if there was a token).
+        :rtype: float
+        """
+        started = time.monotonic()
+        waiting = False
+        queued = False
+        try:
+            while True:
+                with self._bucket() as state:
+                    self._refill(state, time.time())
+                    if state["tokens"] >= 1:
+                        state["tokens"] -= 1
+                        if waiting:
+                            self._wait(state, -1)
+                            waiting = False
+                        snapshot = self._snapshot(state)
+                        break
+                    if not waiting:
+                        self._wait(state, 1)
+                        waiting = queued = True
+                    sleep = (1 - state["tokens"]) / state["rate"]
+                    snapshot = self._snapshot(state)
+                self._notify(snapshot)
+                time.sleep(min(sleep, _MAX_SLEEP))
+        finally:
+            if waiting:
+                # Interrupted while waiting
+                with self._bucket() as state:
+                    self._wait(state, -1)
+        self._notify(snapshot)
+        return time.monotonic() - started if queued else 0.0
+
+    def succeeded(self):
+        """
+        A request went through: grow the rate a little (additive increase).
+        """
+        with self._bucket() as state:
+            state["rate"] = min(self.max_rate, state["rate"] + self.increase / state["rate"])
+            snapshot = self._snapshot(state)
+        self._notify(snapshot)
+
+    def throttled(self):
+        """
+        A request was throttled: cut the rate (multiplicative decrease) and
+        empty the bucket, unless that just happened.
+        """
+        with self._bucket() as state:
+            now = time.time()
+            if now - state["lastDecrease"] >= self.decrease_interval:
+                self._refill(state, now)
+                state["rate"] = max(self.min_rate, state["rate"] * self.decrease)
+                state["tokens"] = min(state["tokens"], 0.0)
+                state["lastDecrease"] = now
+            state["throttles"] += 1
+            snapshot = self._snapshot(state)
+        self._notify(snapshot)
+
+    def snapshot(self):
+        """
+        :return: The current rate, tokens, queue depth (requests waiting for
+            a token in every process) and how many requests were throttled.
+        :rtype: dict
+        """
+        with self._bucket() as state:
+            self._refill(state, time.time())
+            return self._snapshot(state)
+
+
+class GovernedClient():
+    """
+    Wraps a client so that every request to Purview waits for the governor.
+    A throttled request slows the governor down and is sent again, up to
+    `max_throttle_retries` times. If it's still throttled, the error is
+    marked (`governed`) so that the upload's own retries (see
+    `ingestor_upload.py`) don't retry it all over again. Anything that isn't
+    a request is passed through to the wrapped client.
+
+    :param client: The client to wrap.
+    :param governor: The rate governor to share.
+    :type governor: :class:`RateGovernor`
+    """
+
+    REQUESTS = {"upload_entities", "partial_update_entity", "get_entity", "delete_entity",
+                "upload_typedefs", "get_typedef", "get_all_typedefs"}
+
+    def __init__(self, client, governor, max_throttle_retries=DEFAULT_THROTTLE_RETRIES):
+        self._client = client
+        self.governor = governor
+        self.max_throttle_retries = max_throttle_retries
+        self._metrics = None
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in self.REQUESTS:
+            return attribute
+        return lambda *args, **kwargs: self._request(attribute, *args, **kwargs)
+
+    def attach_metrics(self, metrics):
+        """
+        Record the time spent waiting for the governor, its rate and its
+        queue depth (see `ingestor_metrics.py`). The MeteredClient wraps this
+        client, so its request time includes the waits.
+        """
+        self._metrics = metrics
+
+        def observe(snapshot):
+            metrics.set_gauge("rate_governor_rate", snapshot["rate"],
+                              "The shared rate governor's requests per second.")
+            metrics.set_gauge("rate_governor_queue_depth", snapshot["queueDepth"],
+                              "Requests waiting for the shared rate governor on this node.")
+        self.governor.observer = observe
+
+    def _request(self, call, *args, **kwargs):
+        attempt = 0
+        while True:
+            waited = self.governor.acquire()
+            if self._metrics and waited:
+                self._metrics.add_time("governor wait", waited)
+            try:
+                results = call(*args, **kwargs)
+            # AtlasException derives from BaseException
+            except BaseException as e:
+                if not is_throttled(e):
+                    raise
+                self.governor.throttled()
+                if self._metrics:
+                    self._metrics.count_request("throttled", failed=True)
+                if attempt >= self.max_throttle_retries:
+                    e.governed = True
+                    raise
+                attempt += 1
+                continue
+            self.governor.succeeded()
+            return results
@@ -0,0 +1,318 @@
+import json
+import sqlite3
+
+from ingestor_names import table_qualified_name
+from ingestor_upload import entity_to_json
+
+# This module keeps a local index of the lineage the ingestors build, so that
+# questions like "what is downstream of tblDailySales?" (what breaks if I
+# change it?) can be answered without a round trip to Purview, e.g. in CI.
+# Every process the ingestors build already knows its edges: each of its
+# inputs flows into each of its outputs, and its columnMapping says which
+# column flows into which.
+
+# The index is a SQLite file with two tables:
+# * nodes: Every dataset, column and process, by qualified name, with a
+#   small integer id.
+# * edges: (source, target, process) ids, one row per input / output pair of
+#   a process and per column pair of its columnMapping. The primary key is
+#   the downstream adjacency list and a second index on (target, source) is
+#   the upstream one, so each step of a traversal is one index range scan per
+#   node instead of a scan of the whole graph.
+# A traversal walks the graph one level at a time, so it visits every node
+# once and stops at the depth limit.
+# Re-indexing a process replaces its edges, so the index always has the
+# latest version of every process the ingestors built.
+
+DEFAULT_LINEAGE_PATH = "./.lineage_index.sqlite"
+
+DATASET = "dataset"
+COLUMN = "column"
+PROCESS = "process"
+
+# Stay below SQLite's limit on the number of query parameters
+_CHUNK = 500
+
+
+def _reference_name(ref):
+    if not isinstance(ref, dict):
+        return None, None
+    qualified_name = ref.get("qualifiedName") or ref.get("uniqueAttributes", {}).get(
+        "qualifiedName")
+    return ref.get("typeName"), qualified_name
+
+
+def _chunks(items, size=_CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def process_edges(entity):
+    """
+    The lineage edges of a process.
+
+    :param entity: An AtlasProcess or the dict of one.
+    :return: The dataset edges (every input to every output) and the column
+        edges (from its columnMapping, if it has one) as (source, target)
+        pairs of (typeName, qualifiedName), or None if the entity isn't a
+        process.
+    :rtype: tuple(list, list)
+    """
+    attributes = entity_to_json(entity).get("attributes", {})
+    if "inputs" not in attributes and "outputs" not in attributes:
+        return None
+    inputs = [_reference_name(r) for r in attributes.get("inputs") or []]
+    outputs = [_reference_name(r) for r in attributes.get("outputs") or []]
+    dataset_edges = [(i, o) for i in inputs if i[1] for o in outputs if o[1]]
+
+    column_edges = []
+    column_mapping = attributes.get("columnMapping")
+    if isinstance(column_mapping, str):
+        column_mapping = json.loads(column_mapping or "[]")
+    for dataset_mapping in column_mapping or []:
+        source = dataset_mapping["DatasetMapping"]["Source"]
+        sink = dataset_mapping["DatasetMapping"]["Sink"]
+        for mapping in dataset_mapping.get("ColumnMapping", []):
+            # A "*" mapping is all of the columns, which the dataset edge
+            # already covers
+            if mapping["Source"] == "*" or mapping["Sink"] == "*":
+                continue
+            column_edges.append((
+                (None, "{}#{}".format(source, mapping["Source"])),
+                (None, "{}#{}".format(sink, mapping["Sink"]))
+            ))
+    return dataset_edges, column_edges
+
+
+class LineageIndex():
+    """
+    A local index of the lineage between datasets (and their columns).
+
+        index = LineageIndex()
+        index.add_processes(entities)
+        index.downstream("custom://tblDailySales", depth=2)
+
+    :param str path: The SQLite file to keep the index in.
+    """
+
+    def __init__(self, path=DEFAULT_LINEAGE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS nodes ("
+            " id INTEGER PRIMARY KEY,"
+            " qualified_name TEXT NOT NULL UNIQUE,"
+            " type_name TEXT,"
+            " kind TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS edges ("
+            " source INTEGER NOT NULL,"
+            " target INTEGER NOT NULL,"
+            " process INTEGER NOT NULL,"
+            " PRIMARY KEY (source, target, process)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS edges_upstream ON edges (target, source, process)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS edges_process ON edges (process)")
+        self.conn.commit()
+        self._ids = {}
+
+    def _node_id(self, qualified_name, type_name, kind):
+        # qualified name -> (id, whether its type is known). Columns are
+        # only known by name, and a dataset that one process only refers
+        # to by guid gets its type once another process names it.
+        cached = self._ids.get(qualified_name)
+        if cached is None:
+            row = self.conn.execute(
+                "SELECT id, type_name FROM nodes WHERE qualified_name = ?",
+                [qualified_name]).fetchone()
+            if row is None:
+                row = (self.conn.execute(
+                    "INSERT INTO nodes (qualified_name, type_name, kind) VALUES (?, ?, ?)",
+                    [qualified_name, type_name, kind]).lastrowid, type_name)
+            cached = (row[0], row[1] is not None)
+        if type_name and not cached[1]:
+            self.conn.execute("UPDATE nodes SET type_name = ? WHERE id = ?", [type_name, cached[0]])
+            cached = (cached[0], True)
+        self._ids[qualified_name] = cached
+        return cached[0]
+
+    def add_processes(self, entities):
+        """
+        Index the lineage of every process among the entities, replacing
+        whatever was indexed for them before. Anything that isn't a process
+        is skipped.
+
+        :param entities: AtlasEntity / AtlasProcess objects or dicts.
+        :return: How many processes were indexed.
+        :rtype: int
+        """
+        processes = 0
+        for entity in entities:
+            edges = process_edges(entity)
+            if edges is None:
+                continue
+            entity_json = entity_to_json(entity)
+            process_id = self._node_id(
+                entity_json["attributes"]["qualifiedName"], entity_json.get("typeName"), PROCESS)
+            self.conn.execute("DELETE FROM edges WHERE process = ?", [process_id])
+            dataset_edges, column_edges = edges
+            rows = [
+                (self._node_id(source[1], source[0], DATASET),
+                 self._node_id(target[1], target[0], DATASET), process_id)
+                for source, target in dataset_edges
+            ]
+            rows.extend(
+                (self._node_id(source[1], None, COLUMN),
+                 self._node_id(target[1], None, COLUMN), process_id)
+                for source, target in column_edges
+            )
+            self.conn.executemany("INSERT OR IGNORE INTO edges VALUES (?, ?, ?)", rows)
+            processes += 1
+        self.conn.commit()
+        return processes
+
+    def remove_processes(self, qualified_names):
+        """
+        Forget the lineage of processes (e.g. ones that were deleted from
+        Purview).
+        """
+        for chunk in _chunks(qualified_names):
+            self.conn.execute(
+                "DELETE FROM edges WHERE process IN"
+                " (SELECT id FROM nodes WHERE kind = ? AND qualified_name IN ({}))".format(
+                    ",".join("?" * len(chunk))),
+                [PROCESS] + chunk)
+        self.conn.commit()
+
+    def find(self, name):
+        """
+        :return: The qualified name of a node, or None if it isn't indexed.
+            A bare table name (e.g. tblDailySales or tblDailySales#id) is
+            looked up as a table (or column) of my custom database too.
+        :rtype: str
+        """
+        for qualified_name in [name, table_qualified_name(name)]:
+            row = self.conn.execute(
+                "SELECT 1 FROM nodes WHERE qualified_name = ?", [qualified_name]).fetchone()
+            if row:
+                return qualified_name
+        return None
+
+    def _walk(self, qualified_name, depth, from_column, to_column):
+        row = self.conn.execute(
+            "SELECT id FROM nodes WHERE qualified_name = ?", [qualified_name]).fetchone()
+        if row is None:
+            raise KeyError("{} isn't in the lineage index".format(qualified_name))
+        # node id -> (depth, the process of the edge it was first reached by)
+        reached = {row[0]: (0, None)}
+        frontier = [row[0]]
+        level = 0
+        while frontier and (depth is None or level < depth):
+            level += 1
+            next_frontier = []
+            for chunk in _chunks(frontier):
+                rows = self.conn.execute(
+                    "SELECT {}, process FROM edges WHERE {} IN ({})".format(
+                        to_column, from_column, ",".join("?" * len(chunk))),
+                    chunk)
+                for node_id, process_id in rows:
+                    if node_id not in reached:
+                        reached[node_id] = (level, process_id)
+                        next_frontier.append(node_id)
+            frontier = next_frontier
+        del reached[row[0]]
+
+        names = {}
+        ids = set(reached) | set(p for _, p in reached.values())
+        for chunk in _chunks(ids):
+            names.update(
+                (node_id, (qn, type_name)) for node_id, qn, type_name in self.conn.execute(
+                    "SELECT id, qualified_name, type_name FROM nodes WHERE id IN ({})".format(
+                        ",".join("?" * len(chunk))),
+                    chunk)
+            )
+        results = [
+            {"qualifiedName": names[node_id][0], "typeName": names[node_id][1],
+             "depth": node_depth, "process": names[process_id][0]}
+            for node_id, (node_depth, process_id) in reached.items()
+        ]
+        return sorted(results, key=lambda r: (r["depth"], r["qualifiedName"]))
+
+    def downstream(self, qualified_name, depth=None):
+        """
+        Everything that (directly or through other datasets) is built from a
+        dataset or column.
+
+        :param str qualified_name: The dataset or column to start from.
+        :param int depth: How many hops to follow at most (None follows them
+            all).
+        :return: The qualifiedName, typeName and depth of every node reached
+            and the process it was first reached through, closest first.
+        :rtype: list(dict)
+        :raises KeyError: If the dataset or column isn't indexed.
+        """
+        return self._walk(qualified_name, depth, "source", "target")
+
+    def upstream(self, qualified_name, depth=None):
+        """
+        Everything a dataset or column is (directly or through other
+        datasets) built from. See :meth:`downstream`.
+        """
+        return self._walk(qualified_name, depth, "target", "source")
+
+    def stats(self):
+        """
+        :return: How many nodes of each kind and how many edges are indexed.
+        :rtype: dict
+        """
+        counts = dict(self.conn.execute("SELECT kind, COUNT(*) FROM nodes GROUP BY kind"))
+        counts["edges"] = self.conn.execute("SELECT COUNT(*) FROM edges").fetchone()[0]
+        return counts
+
+    def close(self):
+        self.conn.close()
+
+
+def record_lineage(path, entities):
+    """
+    Index the lineage of the processes among an ingestor's entities, if
+    there's a lineage index to keep.
+
+    :param str path: The lineage index, or None to do nothing.
+    :return: How many processes were indexed.
+    :rtype: int
+    """
+    if not path:
+        return 0
+    index = LineageIndex(path)
+    try:
+        return index.add_processes(entities)
+    finally:
+        index.close()
+
+
+def forget_lineage(path, qualified_names):
+    """
+    Forget the lineage of processes that were deleted, if there's a lineage
+    index to keep. See :func:`record_lineage`.
+    """
+    if not path:
+        return
+    index = LineageIndex(path)
+    try:
+        index.remove_processes(qualified_names)
+    finally:
+        index.close()
+
+
+def add_lineage_arguments(parser):
+    """
+    Add the --lineage-index option to an ingestor's argparse parser.
+    """
+    parser.add_argument("--lineage-index", default=None, metavar="PATH",
+                        help="Also record the lineage of the processes in this local index"
+                             " (see query_lineage.py)")
+    return parser
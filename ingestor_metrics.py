@@ -0,0 +1,309 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from ingestor_upload import entity_to_json
+
+# This module measures where an ingestor's run goes. Every ingestor times its
+# stages (reading / parsing the source, building the entities and uploading
+# them) and wraps its client in a :class:`MeteredClient` that times each
+# upload request, the serialization of its payload and counts the entities
+# (by typeName) and bytes that were sent.
+# At the end of the run, the numbers can be written as:
+# * A json report (--metrics-report FILE) to keep alongside the run's logs.
+# * Prometheus text format metrics (--prometheus-textfile FILE), e.g. into
+#   the directory of node_exporter's textfile collector, so that nightly
+#   runs can be graphed and alerted on.
+# Stage timings are summed over every time the stage was entered. The upload
+# requests run concurrently, so the time of the "upload" stage is the wall
+# clock time of the uploads while the "request" time is summed over workers.
+
+
+class IngestorMetrics():
+    """
+    The timings and counts of one ingestor run. It's safe to record from
+    several threads.
+
+    :param str ingestor: The name of the ingestor (e.g. the script's name).
+    """
+
+    def __init__(self, ingestor):
+        self.ingestor = ingestor
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.stages = {}
+        self.entities = {}
+        self.bytes_sent = 0
+        self.requests = {}
+        self.gauges = {}
+        self._current = None
+
+    def add_time(self, name, seconds):
+        """
+        Add to the time spent in a stage.
+        """
+        with self.lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "count": 0, "max": 0.0})
+            stage["seconds"] += seconds
+            stage["count"] += 1
+            stage["max"] = max(stage["max"], seconds)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the code in a `with` block as part of a stage.
+        """
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def begin(self, name):
+        """
+        End the stage started by the last `begin` (if any) and start the
+        next one. This suits scripts that run their stages one after the
+        other without wrapping each in a `with` block.
+        """
+        now = time.perf_counter()
+        if self._current:
+            self.add_time(self._current[0], now - self._current[1])
+        self._current = (name, now) if name else None
+
+    def iter_stage(self, name, iterable):
+        """
+        Iterate over `iterable`, timing how long each item takes to arrive
+        as part of a stage (e.g. a generator that reads and parses files).
+        """
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - started)
+                return
+            self.add_time(name, time.perf_counter() - started)
+            yield item
+
+    def count_entities(self, entities):
+        """
+        Count entity dicts by typeName.
+        """
+        with self.lock:
+            for entity in entities:
+                type_name = entity.get("typeName", "unknown")
+                self.entities[type_name] = self.entities.get(type_name, 0) + 1
+
+    def count_request(self, operation, failed=False, bytes_sent=0):
+        with self.lock:
+            counts = self.requests.setdefault(operation, {"succeeded": 0, "failed": 0})
+            counts["failed" if failed else "succeeded"] += 1
+            self.bytes_sent += bytes_sent
+
+    def set_gauge(self, name, value, help_text=""):
+        """
+        Record the latest value of something that goes up and down (e.g. the
+        rate of the rate governor). The lowest and highest values of the run
+        are kept too.
+        """
+        with self.lock:
+            gauge = self.gauges.setdefault(
+                name, {"value": value, "min": value, "max": value, "help": help_text})
+            gauge["value"] = value
+            gauge["min"] = min(gauge["min"], value)
+            gauge["max"] = max(gauge["max"], value)
+
+    def finish(self):
+        """
+        End the stage started by the last `begin` (if any).
+        """
+        self.begin(None)
+
+    def to_json(self):
+        """
+        :return: The json report of the run.
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                "ingestor": self.ingestor,
+                "startTime": self.start_time,
+                "elapsedSeconds": round(time.perf_counter() - self._started, 6),
+                "stages": {name: {"seconds": round(s["seconds"], 6), "count": s["count"],
+                                  "maxSeconds": round(s["max"], 6)}
+                           for name, s in self.stages.items()},
+                "entities": dict(self.entities),
+                "requests": {op: dict(c) for op, c in self.requests.items()},
+                "bytesSent": self.bytes_sent,
+                "gauges": {name: {k: g[k] for k in ["value", "min", "max"]}
+                           for name, g in self.gauges.items()}
+            }
+
+    def to_prometheus(self):
+        """
+        :return: The metrics of the run in the Prometheus text format.
+        :rtype: str
+        """
+        report = self.to_json()
+        ingestor = 'ingestor="{}"'.format(_escape_label(self.ingestor))
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, value in samples:
+                label_text = ",".join([ingestor] + ['{}="{}"'.format(k, _escape_label(v))
+                                                    for k, v in labels])
+                lines.append("{}{{{}}} {}".format(name, label_text, value))
+
+        metric("purview_ingestor_last_run_timestamp_seconds", "gauge",
+               "When the last run started.", [([], report["startTime"])])
+        metric("purview_ingestor_run_seconds", "gauge",
+               "How long the last run took.", [([], report["elapsedSeconds"])])
+        metric("purview_ingestor_stage_seconds", "gauge",
+               "Time spent in each stage of the last run.",
+               [([("stage", name)], s["seconds"]) for name, s in report["stages"].items()])
+        metric("purview_ingestor_stage_calls", "gauge",
+               "How many times each stage ran in the last run.",
+               [([("stage", name)], s["count"]) for name, s in report["stages"].items()])
+        metric("purview_ingestor_entities_sent", "gauge",
+               "Entities uploaded in the last run by type.",
+               [([("type_name", t)], n) for t, n in sorted(report["entities"].items())])
+        metric("purview_ingestor_requests", "gauge",
+               "Requests made to Purview in the last run by operation and outcome.",
+               [([("operation", op), ("status", status)], n)
+                for op, counts in sorted(report["requests"].items())
+                for status, n in sorted(counts.items())])
+        metric("purview_ingestor_bytes_sent", "gauge",
+               "Bytes of entity payloads sent in the last run.", [([], report["bytesSent"])])
+        with self.lock:
+            help_texts = {name: g["help"] for name, g in self.gauges.items()}
+        for name, gauge in sorted(report["gauges"].items()):
+            metric("purview_ingestor_" + name, "gauge", help_texts[name] or name,
+                   [([("stat", stat)], gauge[stat]) for stat in ["value", "min", "max"]])
+        return "\n".join(lines) + "\n"
+
+    def format_summary(self):
+        """
+        :return: A short human readable summary of the run.
+        :rtype: str
+        """
+        report = self.to_json()
+        lines = ["{} finished in {:.2f}s".format(self.ingestor, report["elapsedSeconds"])]
+        for name, s in report["stages"].items():
+            lines.append("  {:12s} {:9.3f}s over {} call(s)".format(name, s["seconds"], s["count"]))
+        lines.append("  {} entities ({} bytes) sent: {}".format(
+            sum(report["entities"].values()), report["bytesSent"],
+            ", ".join("{} {}".format(n, t) for t, n in sorted(report["entities"].items()))
+            or "none"))
+        for name, gauge in sorted(report["gauges"].items()):
+            lines.append("  {} {:g} (between {:g} and {:g})".format(
+                name, gauge["value"], gauge["min"], gauge["max"]))
+        return "\n".join(lines)
+
+    def write(self, report_path=None, prometheus_path=None):
+        """
+        Write the json report and / or the Prometheus metrics.
+        """
+        if report_path:
+            _write_atomic(report_path, json.dumps(self.to_json(), indent=2))
+        if prometheus_path:
+            _write_atomic(prometheus_path, self.to_prometheus())
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _write_atomic(path, text):
+    # The textfile collector may read the file at any time, so it's swapped
+    # in whole.
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp_path, "w") as fp:
+        fp.write(text)
+    os.replace(temp_path, path)
+
+
+class MeteredClient():
+    """
+    Wraps a client to time every request and count what it sends. Anything
+    that isn't measured is passed through to the wrapped client.
+
+    :param client: The client to wrap.
+    :param metrics: Where to record the measurements.
+    :type metrics: :class:`IngestorMetrics`
+    """
+
+    def __init__(self, client, metrics):
+        self._client = client
+        self._metrics = metrics
+        # A client that measures something of its own (e.g. the
+        # GovernedClient of `ingestor_governor.py`) records it here too. The
+        # type is checked so that a LazyClient isn't built just to ask.
+        if hasattr(type(client), "attach_metrics"):
+            client.attach_metrics(metrics)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _request(self, operation, call, bytes_sent=0):
+        started = time.perf_counter()
+        try:
+            results = call()
+        # AtlasException derives from BaseException
+        except BaseException:
+            self._metrics.add_time("request", time.perf_counter() - started)
+            self._metrics.count_request(operation, failed=True, bytes_sent=bytes_sent)
+            raise
+        self._metrics.add_time("request", time.perf_counter() - started)
+        self._metrics.count_request(operation, bytes_sent=bytes_sent)
+        return results
+
+    def upload_entities(self, batch):
+        # The client serializes the batch again when it sends it, but this
+        # is the only way to know the size of the payload.
+        with self._metrics.stage("serialize"):
+            batch = [entity_to_json(e) for e in batch]
+            payload_bytes = len(json.dumps({"entities": batch}).encode("utf-8"))
+        results = self._request("upload_entities", lambda: self._client.upload_entities(batch),
+                                payload_bytes)
+        self._metrics.count_entities(batch)
+        return results
+
+    def partial_update_entity(self, **kwargs):
+        return self._request("partial_update_entity",
+                             lambda: self._client.partial_update_entity(**kwargs))
+
+    def get_entity(self, **kwargs):
+        return self._request("get_entity", lambda: self._client.get_entity(**kwargs))
+
+    def delete_entity(self, guid):
+        return self._request("delete_entity", lambda: self._client.delete_entity(guid))
+
+
+def add_metrics_arguments(parser):
+    """
+    Add the -v, --metrics-report and --prometheus-textfile options to an
+    ingestor's argparse parser.
+    """
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="Print the parsed structures and full upload results")
+    parser.add_argument("--metrics-report", default=None, metavar="FILE",
+                        help="Write a json report of the run's timings and counts")
+    parser.add_argument("--prometheus-textfile", default=None, metavar="FILE",
+                        help="Write the run's metrics in the Prometheus text format")
+    return parser
+
+
+def finish_metrics(metrics, args):
+    """
+    End the run's measurements, print the summary and write the files
+    asked for by the options added by :func:`add_metrics_arguments`.
+    """
+    metrics.finish()
+    print(metrics.format_summary())
+    metrics.write(args.metrics_report, args.prometheus_textfile)
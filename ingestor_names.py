@@ -0,0 +1,147 @@
+import os
+import sqlite3
+import threading
+
+from ingestor_state import DEFAULT_STATE_PATH
+from ingestor_upload import entity_to_json
+
+# This module is the one place the qualified names of my custom database's
+# tables, columns and processes are built, so that every ingestor names the
+# same table the same way. When the ETL tool ingestors named tables
+# customDB://tblDailySales and the others custom://tblDailySales, every job
+# run created a duplicate of each table it touched and the lineage of the
+# jobs never met the lineage of the stored procedures.
+
+# It also keeps an index of the entities that were already ingested, by
+# qualified name. An ETL job or stored procedure that reads a table the
+# catalog already has doesn't need to send the table (and its columns)
+# again: its process refers to the existing table by qualified name instead.
+# The index is loaded from the local state store (see `ingestor_state.py`),
+# which holds every entity an ingestor has successfully uploaded, and is
+# a plain dict so every lookup is O(1).
+
+SCHEME = "custom://"
+TABLE_TYPE_NAME = "my_custom_db"
+COLUMN_TYPE_NAME = "my_custom_db_column"
+BLOB_TYPE_NAME = "azure_blob_path"
+
+
+def table_qualified_name(table_name):
+    """
+    :return: The qualified name of a table of my custom database.
+    :rtype: str
+    """
+    return SCHEME + table_name
+
+
+def column_qualified_name(table_name, column_name):
+    """
+    :return: The qualified name of a column: its table's qualified name,
+        a # and the column's name.
+    :rtype: str
+    """
+    return "{}#{}".format(table_qualified_name(table_name), column_name)
+
+
+def process_qualified_name(name):
+    """
+    :return: The qualified name of a stored procedure or ETL job.
+    :rtype: str
+    """
+    return SCHEME + name
+
+
+def etl_dataset_name(dataset_object):
+    """
+    The type and qualified name of a dataset an ETL job reads or writes. Both
+    the job files and the api describe a dataset with its name and type and,
+    for a blob, its path.
+
+    :param dict dataset_object: The dataset, e.g. {"name": "tblDailySales",
+        "type": "customDB"}.
+    :return: The typeName and qualifiedName.
+    :rtype: tuple(str, str)
+    """
+    if dataset_object["type"] == "blob":
+        # The etl tool provides the blob storage path, which happens to be
+        # the correct qualified name!
+        return BLOB_TYPE_NAME, dataset_object.get("path", dataset_object["name"])
+    if dataset_object["type"] == "customDB":
+        return TABLE_TYPE_NAME, table_qualified_name(dataset_object["name"])
+    return "DataSet", ""
+
+
+class QualifiedNameIndex():
+    """
+    The type of every entity that was already ingested, by qualified name.
+    It's safe to add to from several threads (e.g. the stages of
+    `run_pipeline.py`).
+    """
+
+    def __init__(self):
+        self._types = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_state(cls, path):
+        """
+        Load every entity in a state store, whichever ingestor uploaded it.
+
+        :param str path: The SQLite state store. The index is empty if it
+            doesn't exist yet.
+        :rtype: :class:`QualifiedNameIndex`
+        """
+        index = cls()
+        if not path or not os.path.exists(path):
+            return index
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT qualified_name, type_name FROM entity_state")
+            index._types.update(rows)
+        except sqlite3.OperationalError:
+            # A state store without any entities in it (e.g. only ETL jobs)
+            pass
+        finally:
+            conn.close()
+        return index
+
+    def add(self, qualified_name, type_name):
+        with self._lock:
+            self._types[qualified_name] = type_name
+
+    def add_entities(self, entities):
+        """
+        Add the entities of this run (e.g. the tables of the system table) so
+        that the entities built after them can refer to them.
+        """
+        with self._lock:
+            for entity in entities:
+                entity_json = entity_to_json(entity)
+                self._types[entity_json["attributes"]["qualifiedName"]] = entity_json["typeName"]
+
+    def __contains__(self, qualified_name):
+        return qualified_name in self._types
+
+    def __len__(self):
+        return len(self._types)
+
+    def reference(self, qualified_name):
+        """
+        :return: A reference to the ingested entity by its type and
+            qualified name, or None if it hasn't been ingested.
+        :rtype: dict
+        """
+        type_name = self._types.get(qualified_name)
+        if type_name is None:
+            return None
+        return {"typeName": type_name, "uniqueAttributes": {"qualifiedName": qualified_name}}
+
+
+def add_name_index_arguments(parser):
+    """
+    Add the --name-index option to an ingestor's argparse parser.
+    """
+    parser.add_argument("--name-index", default=DEFAULT_STATE_PATH, metavar="STATE",
+                        help="Refer to the tables in this state store instead of uploading them"
+                             " again ('' to always upload them)")
+    return parser
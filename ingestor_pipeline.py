@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from pyapacheatlas.core.util import GuidTracker
+
+from ingestor_upload import merge_entity_lists
+
+# This module runs several ingestors as the stages of one pipeline (see
+# `run_pipeline.py`). Run one after the other, every ingestor pays for its
+# own start up, authentication and upload and the whole refresh takes as long
+# as all of them added up. As stages of one process instead:
+# * The stages run concurrently in a pool of threads. Most of their time is
+#   spent waiting on files, the ETL api or their own worker processes, so the
+#   pipeline takes about as long as its slowest stage. A stage that needs
+#   another one to finish first lists it in its depends_on.
+# * Every stage hands its placeholder guids out from one
+#   :class:`SharedGuidTracker`, so the entities of every stage can be
+#   uploaded together without two of them getting the same guid.
+# * The entities of every stage are merged into one de-duplicated set of
+#   datasets plus the processes (see `merge_entity_lists`) and uploaded in
+#   batches through one client, which authenticates once and keeps its
+#   connections to Purview alive (see `ingestor_client.py`).
+
+# A pipeline config is a json file listing the sources, for example:
+# {
+#     "sources": [
+#         {"name": "database", "type": "sys_table", "path": "./DataSource/myCustomDatabase/sys.json"},
+#         {"name": "procedures", "type": "custom_sp", "directory": "./DataSource/myCustomDatabase"},
+#         {"name": "jobs", "type": "etl_api", "all_jobs": true, "depends_on": ["database"]}
+#     ]
+# }
+# The name defaults to the type. The other keys are the options of each type
+# of source (see `run_pipeline.py`).
+
+
+class SharedGuidTracker(GuidTracker):
+    """
+    A GuidTracker that is safe to take guids from in several threads at once.
+    """
+
+    def __init__(self, starting=-1000, direction="decrease"):
+        super().__init__(starting, direction)
+        self._lock = threading.Lock()
+
+    def get_guid(self):
+        with self._lock:
+            return super().get_guid()
+
+
+def load_pipeline_config(path, source_types):
+    """
+    Read and check a pipeline config.
+
+    :param str path: The json config file.
+    :param source_types: The types of source the pipeline knows how to run.
+    :return: The sources, each with a name and its depends_on.
+    :rtype: list(dict)
+    :raises ValueError: For an unknown type, a name used twice or a
+        depends_on that's unknown or circular.
+    """
+    with open(path) as fp:
+        config = json.load(fp)
+
+    sources = []
+    names = set()
+    for source in config.get("sources", []):
+        source = dict(source)
+        if source.get("type") not in source_types:
+            raise ValueError("Unknown source type {!r}, expected one of {}".format(
+                source.get("type"), ", ".join(source_types)))
+        source.setdefault("name", source["type"])
+        source["depends_on"] = list(source.get("depends_on", []))
+        if source["name"] in names:
+            raise ValueError("There's more than one source named {!r}".format(source["name"]))
+        names.add(source["name"])
+        sources.append(source)
+
+    for source in sources:
+        for dependency in source["depends_on"]:
+            if dependency not in names:
+                raise ValueError("{!r} depends on {!r}, which isn't a source".format(
+                    source["name"], dependency))
+
+    # Every source has to be reachable by only ever starting the sources
+    # whose dependencies are done, otherwise the depends_on are circular.
+    done = set()
+    while len(done) < len(sources):
+        ready = [s["name"] for s in sources
+                 if s["name"] not in done and all(d in done for d in s["depends_on"])]
+        if not ready:
+            raise ValueError("The depends_on of {} are circular".format(
+                ", ".join(sorted(names - done))))
+        done.update(ready)
+    return sources
+
+
+def run_stages(stages, max_workers=None, on_stage_done=None):
+    """
+    Run the stages of a pipeline in a pool of threads. A stage starts as soon
+    as every stage it depends on has finished, so independent stages run
+    concurrently. A stage that fails doesn't stop the others, but the stages
+    that depend on it are skipped.
+
+    :param list stages: Dicts with the stage's name, its depends_on and `run`,
+        a function without arguments that returns (or yields) the stage's
+        entity lists.
+    :param int max_workers: How many stages may run at once (defaults to all
+        of them).
+    :param on_stage_done: Called with (name, result) as each stage finishes,
+        from the calling thread.
+    :return: The result of each stage by name: its entity lists (`groups`),
+        the error (or None) and how many seconds it took.
+    :rtype: dict(str, dict)
+    """
+    results = {}
+    pending = list(stages)
+    running = {}
+
+    def timed(run):
+        started = time.perf_counter()
+        # Generators are run to the end here, in the stage's own thread
+        groups = list(run())
+        return groups, time.perf_counter() - started
+
+    def finish(name, result):
+        results[name] = result
+        if on_stage_done:
+            on_stage_done(name, result)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages) or 1) as executor:
+        while pending or running:
+            # Skipping a stage can decide the fate of the stages after it,
+            # so look again until nothing changes.
+            changed = True
+            while changed:
+                changed = False
+                for stage in list(pending):
+                    failed = [d for d in stage["depends_on"]
+                              if d in results and results[d]["error"]]
+                    if failed:
+                        pending.remove(stage)
+                        finish(stage["name"], {"groups": [], "seconds": 0.0,
+                                               "error": "Skipped because {} failed".format(
+                                                   ", ".join(failed))})
+                        changed = True
+                    elif all(d in results for d in stage["depends_on"]):
+                        pending.remove(stage)
+                        running[executor.submit(timed, stage["run"])] = stage["name"]
+            if not running:
+                # Nothing left can ever start (see load_pipeline_config)
+                for stage in pending:
+                    finish(stage["name"], {"groups": [], "seconds": 0.0,
+                                           "error": "Its depends_on are circular or unknown"})
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    groups, seconds = future.result()
+                    finish(name, {"groups": groups, "seconds": seconds, "error": None})
+                # AtlasException derives from BaseException, so it has to be
+                # caught explicitly along with everything else.
+                except BaseException as e:
+                    if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                        raise
+                    finish(name, {"groups": [], "seconds": 0.0,
+                                  "error": "{}: {}".format(type(e).__name__, e)})
+    return results
+
+
+def merge_stage_results(stages, results):
+    """
+    Merge the entities of every stage into one de-duplicated set of datasets
+    plus the processes. Where two stages produce the same dataset, the one of
+    the stage listed first in the config is kept, so list the sources with
+    the most complete datasets (e.g. the system table, with descriptions and
+    column types) first.
+
+    :param list stages: The stages in the order of the config.
+    :param dict results: The results of :func:`run_stages`.
+    :return: The de-duplicated datasets and the processes.
+    :rtype: tuple(list, list)
+    """
+    return merge_entity_lists(
+        entities
+        for stage in stages
+        for entities in results[stage["name"]]["groups"]
+    )
@@ -0,0 +1,244 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from ingestor_upload import (
+    DEFAULT_BACKOFF_SECONDS,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_MAX_WORKERS,
+    _call_with_retry,
+    entity_to_json
+)
+
+# This module removes what the ingestors uploaded once it's gone from the
+# source: a table that was dropped from the system table, a column that was
+# removed from a table, a table that no process reads or writes any more.
+# Uploading only ever adds to the catalog, so without this stale entities
+# pile up in every search and lineage graph.
+
+# The state store (see `ingestor_state.py`) knows what was ingested for a
+# source before and what was seen in this run, so the orphans are the
+# entities it reports as deleted. They're removed in stages:
+# * The columns of a table are deleted before the table. The table and its
+#   columns are a COMPOSITION relationship (see `custom_types_for_ingestor.py`),
+#   which means the columns can't be orphaned.
+# * Purview deletes by guid, so the guids of each stage's entities are looked
+#   up by qualified name, a type and a bounded number of names per request.
+# * The guids are deleted in bounded batches, several batches at once, and
+#   failed requests are retried with a backoff.
+# A dry run only reports what would be deleted, in order.
+
+DEFAULT_DELETE_BATCH_SIZE = 50
+# Every qualified name is a query parameter, so this keeps the URL short
+DEFAULT_LOOKUP_BATCH_SIZE = 50
+
+# The (parent type, child type) of every COMPOSITION relationship
+COMPOSITIONS = [("my_custom_db", "my_custom_db_column")]
+
+
+def referenced_names(entities):
+    """
+    The qualified names every entity refers to through its process inputs
+    and outputs or its relationship attributes. A table that a process of
+    this run refers to is still in use even if its body wasn't sent again
+    (see `ingestor_names.py`).
+
+    :param entities: AtlasEntity objects or dicts.
+    :rtype: set(str)
+    """
+    names = set()
+    for entity in entities:
+        entity_json = entity_to_json(entity)
+        attributes = entity_json.get("attributes", {})
+        candidates = [attributes.get("inputs"), attributes.get("outputs")]
+        candidates.extend(entity_json.get("relationshipAttributes", {}).values())
+        for candidate in candidates:
+            if isinstance(candidate, dict):
+                candidate = [candidate]
+            for ref in candidate or []:
+                if not isinstance(ref, dict):
+                    continue
+                name = ref.get("qualifiedName") or ref.get("uniqueAttributes", {}).get(
+                    "qualifiedName")
+                if name:
+                    names.add(name)
+    return names
+
+
+def deletion_stages(orphans, compositions=COMPOSITIONS):
+    """
+    Order the orphans so that the children of a COMPOSITION relationship are
+    deleted before their parents.
+
+    :param list orphans: Dicts with the typeName and qualifiedName of each
+        entity to delete.
+    :param list compositions: The (parent type, child type) pairs.
+    :return: The stages of orphans, to be deleted one after the other.
+    :rtype: list(list(dict))
+    """
+    children = {}
+    for parent, child in compositions:
+        children.setdefault(parent, []).append(child)
+
+    def depth(type_name, seen=()):
+        # How many levels of children a type has below it
+        if type_name in seen:
+            raise ValueError("The compositions of {} are circular".format(type_name))
+        return max([depth(c, seen + (type_name,)) + 1 for c in children.get(type_name, [])],
+                   default=0)
+
+    stages = {}
+    for orphan in orphans:
+        stages.setdefault(depth(orphan["typeName"]), []).append(orphan)
+    return [sorted(stages[d], key=lambda o: o["qualifiedName"]) for d in sorted(stages)]
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _lookup_guids(client, type_name, qualified_names, max_retries, backoff_seconds):
+    results = _call_with_retry(
+        lambda: client.get_entity(typeName=type_name, qualifiedName=qualified_names),
+        max_retries, backoff_seconds)
+    return {e["attributes"]["qualifiedName"]: e["guid"] for e in results.get("entities", [])}
+
+
+def _delete_guids(client, guids, max_retries, backoff_seconds):
+    return _call_with_retry(lambda: client.delete_entity(guid=guids), max_retries,
+                            backoff_seconds)
+
+
+def delete_orphans(client, orphans, dry_run=False, batch_size=DEFAULT_DELETE_BATCH_SIZE,
+                   lookup_batch_size=DEFAULT_LOOKUP_BATCH_SIZE, max_workers=DEFAULT_MAX_WORKERS,
+                   max_retries=DEFAULT_MAX_RETRIES, backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+                   compositions=COMPOSITIONS):
+    """
+    Delete the orphaned entities from Purview, children before their parents.
+
+    :param client: The AtlasClient or PurviewClient to delete with.
+    :param list orphans: Dicts with the typeName and qualifiedName of each
+        entity to delete (e.g. from `EntityStateStore.deleted`).
+    :param bool dry_run: Only report what would be deleted.
+    :param int batch_size: The most guids deleted per request.
+    :param int lookup_batch_size: The most qualified names looked up per
+        request.
+    :param int max_workers: How many requests may be in flight at once.
+    :return: The report: the stages of orphans, the entities that were
+        deleted, those that were already gone and those that failed (with
+        the error).
+    :rtype: dict
+    """
+    stages = deletion_stages(orphans, compositions)
+    report = {
+        "dryRun": dry_run,
+        "orphans": len(orphans),
+        "stages": [[{"typeName": o["typeName"], "qualifiedName": o["qualifiedName"]}
+                    for o in stage] for stage in stages],
+        "deleted": [],
+        "missing": [],
+        "failed": []
+    }
+    if dry_run:
+        return report
+
+    def fail(entities, error):
+        report["failed"].extend(dict(e, error=error) for e in entities)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for stage in stages:
+            by_type = {}
+            for orphan in stage:
+                by_type.setdefault(orphan["typeName"], []).append(orphan)
+            lookups = [
+                (executor.submit(_lookup_guids, client, type_name,
+                                 [o["qualifiedName"] for o in chunk], max_retries,
+                                 backoff_seconds), chunk)
+                for type_name, entities in by_type.items()
+                for chunk in _chunks(entities, lookup_batch_size)
+            ]
+            found = []
+            for future, chunk in lookups:
+                try:
+                    guids = future.result()
+                # AtlasException derives from BaseException (see upload_batches)
+                except BaseException as e:
+                    if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                        raise
+                    fail(chunk, str(e))
+                    continue
+                for orphan in chunk:
+                    if orphan["qualifiedName"] in guids:
+                        found.append((guids[orphan["qualifiedName"]], orphan))
+                    else:
+                        # Someone (or a cascade) already deleted it
+                        report["missing"].append(orphan)
+
+            deletes = [
+                (executor.submit(_delete_guids, client, [guid for guid, _ in chunk],
+                                 max_retries, backoff_seconds), chunk)
+                for chunk in _chunks(found, batch_size)
+            ]
+            for future, chunk in deletes:
+                entities = [orphan for _, orphan in chunk]
+                try:
+                    future.result()
+                except BaseException as e:
+                    if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                        raise
+                    fail(entities, str(e))
+                    continue
+                report["deleted"].extend(entities)
+    return report
+
+
+def reconcile_state(client, state, dry_run=False, batch_size=DEFAULT_DELETE_BATCH_SIZE,
+                    max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Delete what a state store reports as deleted at the source. Call it
+    after the run's entities went through `filter_changed` and before
+    `commit(results, forget_deleted=True)`: the orphans that couldn't be
+    deleted (or, on a dry run, weren't) are kept in the state so the next
+    run tries again.
+
+    :param state: The state store of the source.
+    :type state: :class:`~ingestor_state.EntityStateStore`
+    :return: The report of :func:`delete_orphans`.
+    :rtype: dict
+    """
+    orphans = state.deleted()
+    report = delete_orphans(client, orphans, dry_run=dry_run, batch_size=batch_size,
+                            max_workers=max_workers)
+    state.keep(o["qualifiedName"] for o in (orphans if dry_run else report["failed"]))
+    return report
+
+
+def add_reconcile_arguments(parser):
+    """
+    Add the --reconcile and --delete-batch-size options to an ingestor's
+    argparse parser.
+    """
+    parser.add_argument("--reconcile", action="store_true",
+                        help="Delete the entities that are gone from the source from Purview"
+                             " (only reports them with --dry-run or --export)")
+    parser.add_argument("--delete-batch-size", type=int, default=DEFAULT_DELETE_BATCH_SIZE,
+                        help="The most entities deleted per request")
+    return parser
+
+
+def format_report(report):
+    """
+    :return: A short, human readable summary of a reconciliation report.
+    :rtype: str
+    """
+    if report["dryRun"]:
+        lines = ["{} orphaned entities would be deleted:".format(report["orphans"])]
+        for number, stage in enumerate(report["stages"]):
+            lines.append("  stage {}:".format(number + 1))
+            lines.extend("    {} {}".format(o["typeName"], o["qualifiedName"]) for o in stage)
+        return "\n".join(lines)
+    lines = ["{} orphaned entities: {} deleted, {} already gone, {} failed".format(
+        report["orphans"], len(report["deleted"]), len(report["missing"]),
+        len(report["failed"]))]
+    lines.extend("  Couldn't delete {} {}: {}".format(
+        f["typeName"], f["qualifiedName"], f["error"]) for f in report["failed"])
+    return "\n".join(lines)
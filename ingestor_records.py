@@ -0,0 +1,138 @@
+import sys
+
+from ingestor_names import COLUMN_TYPE_NAME, SCHEME, TABLE_TYPE_NAME
+
+# This module has the compact records the ingestors build for the tables and
+# columns of my custom database instead of pyapacheatlas AtlasEntity objects.
+# An AtlasEntity carries an instance dict, a dict of attributes (with its own
+# copy of the qualified name), a dict of relationship attributes and, for a
+# column, a copy of the reference to its table. That's fine for a handful of
+# tables but a catalog with millions of columns spends most of its memory
+# (and garbage collection time) on those dicts.
+# * A record keeps its fields in __slots__ and nothing else.
+# * The type name and the qualified name's prefix are the same interned
+#   string for every record. A qualified name is only built when it's asked
+#   for: a table's is the scheme and its name, a column's is its table's and
+#   its name.
+# * A column keeps a pointer to its table instead of a reference dict.
+# The Atlas json is only built when the entity is serialized for an upload
+# (or hashed, exported, ...) through `to_json`, which returns exactly what
+# the AtlasEntity would have. Anything that takes an AtlasEntity through
+# `entity_to_json` (see `ingestor_upload.py`) takes a record too.
+
+# The description of a column that doesn't have one, as opposed to one
+# whose description is None
+_NO_DESCRIPTION = object()
+
+
+class TableRecord():
+    """
+    A table of my custom database.
+
+    :param str name: The table's name.
+    :param int guid: The table's (placeholder) guid.
+    :param dict attributes: The table's attributes (e.g. its description),
+        if it has any.
+    """
+
+    __slots__ = ("name", "guid", "attributes")
+
+    typeName = sys.intern(TABLE_TYPE_NAME)
+    prefix = sys.intern(SCHEME)
+
+    def __init__(self, name, guid, attributes=None):
+        self.name = name
+        self.guid = guid
+        self.attributes = attributes or None
+
+    @property
+    def qualifiedName(self):
+        return self.prefix + self.name
+
+    @property
+    def relationshipAttributes(self):
+        return {}
+
+    def __repr__(self):
+        return "TableRecord({})".format(self.qualifiedName)
+
+    def to_json(self, minimum=False):
+        """
+        :param bool minimum: Only the reference to the table (its type, guid
+            and qualified name), as AtlasEntity.to_json(minimum=True).
+        :return: The Atlas json of the table.
+        :rtype: dict
+        """
+        if minimum:
+            return {"typeName": self.typeName, "guid": self.guid,
+                    "qualifiedName": self.qualifiedName}
+        attributes = dict(self.attributes) if self.attributes else {}
+        attributes["name"] = self.name
+        attributes["qualifiedName"] = self.qualifiedName
+        return {"typeName": self.typeName, "guid": self.guid, "attributes": attributes,
+                "relationshipAttributes": {}}
+
+
+class ColumnRecord():
+    """
+    A column of a table of my custom database.
+
+    :param table: The column's table.
+    :type table: Union(:class:`TableRecord`, :class:`~pyapacheatlas.core.entity.AtlasEntity`)
+    :param str name: The column's name.
+    :param int guid: The column's (placeholder) guid.
+    :param str type: The column's data type.
+    :param str description: The column's description, if it has one.
+    :param dict extra: Any other attributes (e.g. its profile).
+    """
+
+    __slots__ = ("table", "name", "guid", "type", "description", "extra")
+
+    typeName = sys.intern(COLUMN_TYPE_NAME)
+
+    def __init__(self, table, name, guid, type, description=_NO_DESCRIPTION, extra=None):
+        self.table = table
+        self.name = name
+        self.guid = guid
+        self.type = type
+        self.description = description
+        self.extra = extra or None
+
+    @property
+    def qualifiedName(self):
+        return "{}#{}".format(self.table.qualifiedName, self.name)
+
+    @property
+    def relationshipAttributes(self):
+        return {"table": self.table.to_json(minimum=True)}
+
+    def addRelationship(self, table):
+        """
+        Point the column at another table (e.g. the one a duplicate was
+        merged into, see `merge_entity_lists`).
+        """
+        self.table = table
+
+    def __repr__(self):
+        return "ColumnRecord({})".format(self.qualifiedName)
+
+    def to_json(self, minimum=False):
+        """
+        :param bool minimum: Only the reference to the column.
+        :return: The Atlas json of the column.
+        :rtype: dict
+        """
+        if minimum:
+            return {"typeName": self.typeName, "guid": self.guid,
+                    "qualifiedName": self.qualifiedName}
+        table = self.table.to_json(minimum=True)
+        attributes = {"type": self.type}
+        if self.description is not _NO_DESCRIPTION:
+            attributes["description"] = self.description
+        attributes["name"] = self.name
+        # The table's qualified name is only built once
+        attributes["qualifiedName"] = "{}#{}".format(table["qualifiedName"], self.name)
+        if self.extra:
+            attributes.update(self.extra)
+        return {"typeName": self.typeName, "guid": self.guid, "attributes": attributes,
+                "relationshipAttributes": {"table": table}}
@@ -0,0 +1,417 @@
+import hashlib
+import json
+import sqlite3
+
+from ingestor_upload import entity_to_json
+
+# This module keeps a small local state store (a SQLite file) of what each
+# ingestor uploaded the last time it ran. For every entity I keep its
+# qualified name (e.g. custom://tblDailySales and custom://tblDailySales#id)
+# and a stable hash of its attributes. On the next run only the entities that
+# are new or whose hash changed need to be sent to Purview and anything that
+# is in the store but was not seen this run has been deleted at the source.
+
+# This is the "Watermarking" tip from the README in its simplest form. If you
+# run your ingestor on several machines you'd keep this state in something
+# like Azure SQL DB instead of a local file.
+
+DEFAULT_STATE_PATH = "./.ingestor_state.sqlite"
+
+
+def _reference_key(ref):
+    """
+    Reduce a reference to another entity to something that doesn't change
+    between runs. Placeholder guids are regenerated on every run, so a
+    reference is identified by its type and qualified name instead.
+    """
+    if not isinstance(ref, dict):
+        return ref
+    qualified_name = ref.get("qualifiedName")
+    if qualified_name is None:
+        qualified_name = ref.get("uniqueAttributes", {}).get("qualifiedName")
+    if qualified_name is None:
+        return {k: v for k, v in ref.items() if k != "guid"}
+    return [ref.get("typeName"), qualified_name]
+
+
+def _normalize_references(value):
+    if isinstance(value, list):
+        return [_reference_key(v) for v in value]
+    return _reference_key(value)
+
+
+def entity_hash(entity):
+    """
+    Compute a stable hash of an entity's type, attributes and relationships.
+    The placeholder guid is left out so the same entity hashes the same
+    from one run to the next.
+
+    :param entity: The entity to hash.
+    :type entity: Union(dict, :class:`~pyapacheatlas.core.entity.AtlasEntity`)
+    :return: The hex digest of the entity's content.
+    :rtype: str
+    """
+    entity_json = entity_to_json(entity)
+    attributes = dict(entity_json.get("attributes", {}))
+    for process_attribute in ["inputs", "outputs"]:
+        if attributes.get(process_attribute) is not None:
+            attributes[process_attribute] = _normalize_references(
+                attributes[process_attribute])
+    relationships = {
+        k: _normalize_references(v)
+        for k, v in entity_json.get("relationshipAttributes", {}).items()
+    }
+    canonical = json.dumps(
+        [entity_json.get("typeName"), attributes, relationships,
+         entity_json.get("classifications")],
+        sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _is_placeholder(guid):
+    try:
+        return int(guid) < 0
+    except (TypeError, ValueError):
+        return False
+
+
+def _as_unique_reference(ref, uploading_guids):
+    """
+    Point a reference at an existing entity by its qualified name when the
+    entity it references is not part of this upload.
+    """
+    if not isinstance(ref, dict) or "guid" not in ref:
+        return ref
+    if str(ref["guid"]) in uploading_guids or not _is_placeholder(ref["guid"]):
+        return ref
+    return {
+        "typeName": ref.get("typeName"),
+        "uniqueAttributes": {"qualifiedName": ref.get("qualifiedName")}
+    }
+
+
+def _rewrite_references(entity_json, uploading_guids):
+    def rewrite(value):
+        if isinstance(value, list):
+            return [_as_unique_reference(v, uploading_guids) for v in value]
+        return _as_unique_reference(value, uploading_guids)
+
+    entity_json = dict(entity_json)
+    entity_json["relationshipAttributes"] = {
+        k: rewrite(v) for k, v in entity_json.get("relationshipAttributes", {}).items()
+    }
+    attributes = dict(entity_json.get("attributes", {}))
+    for process_attribute in ["inputs", "outputs"]:
+        if attributes.get(process_attribute) is not None:
+            attributes[process_attribute] = rewrite(attributes[process_attribute])
+    entity_json["attributes"] = attributes
+    return entity_json
+
+
+class EntityStateStore():
+    """
+    A persistent record of the entities an ingestor has uploaded, keyed by
+    qualified name and scoped to a source (e.g. one database).
+
+    A run looks like:
+
+        state = EntityStateStore(source="myCustomDatabase")
+        to_upload = state.filter_changed(entities)
+        results = upload_entities_in_batches(client, to_upload)
+        deleted = state.deleted()
+        state.commit(results)  # or commit(results, forget_deleted=True) after deleting them
+
+    :param str path: The SQLite file to keep the state in.
+    :param str source: The name of the source this ingestor is reading.
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH, source="default"):
+        self.path = path
+        self.source = source
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entity_state ("
+            " source TEXT NOT NULL,"
+            " qualified_name TEXT NOT NULL,"
+            " type_name TEXT,"
+            " hash TEXT NOT NULL,"
+            " PRIMARY KEY (source, qualified_name))"
+        )
+        # Everything seen during this run. It lives in a temporary table
+        # rather than in memory so very large runs stay cheap.
+        self.conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS run_entities ("
+            " qualified_name TEXT PRIMARY KEY,"
+            " type_name TEXT,"
+            " hash TEXT NOT NULL,"
+            " failed INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.conn.commit()
+
+    def _stored_hashes(self, qualified_names):
+        stored = {}
+        qualified_names = list(qualified_names)
+        # Stay below SQLite's limit on the number of query parameters
+        for start in range(0, len(qualified_names), 500):
+            chunk = qualified_names[start:start + 500]
+            rows = self.conn.execute(
+                "SELECT qualified_name, hash FROM entity_state"
+                " WHERE source = ? AND qualified_name IN ({})".format(
+                    ",".join("?" * len(chunk))),
+                [self.source] + chunk
+            )
+            stored.update(dict(rows))
+        return stored
+
+    def filter_changed(self, entities):
+        """
+        Record the entities seen in this run and return only those that are
+        new or changed since the last committed run. References from a
+        changed entity to an unchanged one (e.g. a new column on an existing
+        table) are rewritten to point at the existing entity by qualified
+        name, since the unchanged entity will not be part of the upload.
+
+        :param list entities: AtlasEntity objects or dicts produced this run.
+        :return: The entity dicts that need to be uploaded.
+        :rtype: list(dict)
+        """
+        entity_jsons = [entity_to_json(e) for e in entities]
+        hashes = [entity_hash(e) for e in entity_jsons]
+        qualified_names = [e["attributes"]["qualifiedName"] for e in entity_jsons]
+        stored = self._stored_hashes(qualified_names)
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO run_entities (qualified_name, type_name, hash)"
+            " VALUES (?, ?, ?)",
+            [(qn, e.get("typeName"), h)
+             for qn, e, h in zip(qualified_names, entity_jsons, hashes)]
+        )
+
+        changed = [
+            e for qn, e, h in zip(qualified_names, entity_jsons, hashes)
+            if stored.get(qn) != h
+        ]
+        uploading_guids = set(str(e.get("guid")) for e in changed)
+        return [_rewrite_references(e, uploading_guids) for e in changed]
+
+    def deleted(self):
+        """
+        The entities that were ingested for this source before but were not
+        seen during this run.
+
+        :return: The typeName and qualifiedName of each deleted entity.
+        :rtype: list(dict)
+        """
+        rows = self.conn.execute(
+            "SELECT type_name, qualified_name FROM entity_state"
+            " WHERE source = ? AND qualified_name NOT IN"
+            " (SELECT qualified_name FROM run_entities)"
+            " ORDER BY qualified_name",
+            [self.source]
+        )
+        return [{"typeName": t, "qualifiedName": qn} for t, qn in rows]
+
+    def keep(self, qualified_names):
+        """
+        Count entities as seen in this run, with their previous state, even
+        though they weren't produced again. That's a table a process of this
+        run only refers to, or a deleted entity that couldn't be removed
+        from Purview yet (see `ingestor_reconcile.py`).
+
+        :param qualified_names: The qualified names to keep.
+        """
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO run_entities (qualified_name, type_name, hash)"
+            " SELECT qualified_name, type_name, hash FROM entity_state"
+            " WHERE source = ? AND qualified_name = ?",
+            [(self.source, qn) for qn in qualified_names]
+        )
+
+    def commit(self, results=None, forget_deleted=False):
+        """
+        Make this run the new baseline. Entities in batches that failed to
+        upload keep their previous state so they are retried next run.
+
+        Entities that were deleted at the source are still in Purview until
+        something deletes them, so they are kept (and reported by
+        :meth:`deleted` again next run) unless `forget_deleted` is set. The
+        reconciliation (see `ingestor_reconcile.py`) sets it once it has
+        deleted them, and keeps the ones it couldn't delete with :meth:`keep`.
+
+        :param dict results: The results of
+            :func:`~ingestor_upload.upload_entities_in_batches`, if any.
+        :param bool forget_deleted: Forget the entities that were deleted
+            at the source.
+        """
+        failed = [
+            (e["attributes"]["qualifiedName"],)
+            for batch in (results or {}).get("failedBatches", [])
+            for e in batch["entities"]
+        ]
+        self.conn.executemany(
+            "UPDATE run_entities SET failed = 1 WHERE qualified_name = ?", failed)
+        if forget_deleted:
+            self.conn.execute(
+                "DELETE FROM entity_state WHERE source = ? AND qualified_name NOT IN"
+                " (SELECT qualified_name FROM run_entities)",
+                [self.source]
+            )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entity_state"
+            " SELECT ?, qualified_name, type_name, hash FROM run_entities"
+            " WHERE failed = 0",
+            [self.source]
+        )
+        self.conn.execute("DELETE FROM run_entities")
+        self.conn.commit()
+
+    def discard(self):
+        """
+        Forget what was seen during this run without making it the baseline
+        (e.g. after a dry run), so the store can be used for another run.
+        """
+        self.conn.execute("DELETE FROM run_entities")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# ETL jobs get their own, much cheaper, record. A job's api response carries
+# a lastRun that changes every time the job runs, but the job's definition
+# (its inputs and outputs) rarely changes. So for every job I keep a
+# fingerprint of the response without the lastRun, the lastRun itself and
+# the job's guid in Purview. A job whose fingerprint is unchanged only needs
+# its lastRun attribute updated instead of re-uploading the process and all
+# of its datasets.
+
+JOB_CHANGED = "changed"
+JOB_LAST_RUN_CHANGED = "lastRunChanged"
+JOB_UNCHANGED = "unchanged"
+
+
+def job_fingerprint(response_json, volatile=("lastRun",)):
+    """
+    Compute a stable hash of an ETL job's definition.
+
+    :param dict response_json: The job as returned by the ETL tool's api.
+    :param volatile: The fields that change on every run and are left out.
+    :return: The hex digest of the job's definition.
+    :rtype: str
+    """
+    definition = {k: v for k, v in response_json.items() if k not in volatile}
+    canonical = json.dumps(definition, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class JobStateStore():
+    """
+    A persistent record of the ETL jobs an ingestor has uploaded, keyed by
+    the qualified name of the job's process and scoped to a source (e.g. one
+    ETL server). It lives in the same SQLite file as :class:`EntityStateStore`.
+
+    A run looks like:
+
+        state = JobStateStore(source="myETLTool")
+        status = state.check(qualified_name, response_json)
+        # JOB_CHANGED: upload the job's entities
+        # JOB_LAST_RUN_CHANGED: update lastRun on state.guid(qualified_name)
+        # JOB_UNCHANGED: nothing to do
+        state.commit(results)
+
+    :param str path: The SQLite file to keep the state in.
+    :param str source: The name of the ETL tool this ingestor is reading.
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH, source="default"):
+        self.path = path
+        self.source = source
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_state ("
+            " source TEXT NOT NULL,"
+            " qualified_name TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " last_run TEXT,"
+            " guid TEXT,"
+            " PRIMARY KEY (source, qualified_name))"
+        )
+        self.conn.commit()
+        # qualified name -> [fingerprint, last_run, guid] of the jobs seen
+        # this run. A job record is small, so this stays in memory.
+        self.pending = {}
+
+    def check(self, qualified_name, response_json):
+        """
+        Record a job seen in this run and compare it with the last committed
+        run.
+
+        :param str qualified_name: The qualified name of the job's process.
+        :param dict response_json: The job as returned by the ETL tool's api.
+        :return: JOB_CHANGED for a new job or one whose definition changed,
+            JOB_LAST_RUN_CHANGED when only lastRun changed, or JOB_UNCHANGED.
+        :rtype: str
+        """
+        fingerprint = job_fingerprint(response_json)
+        last_run = response_json.get("lastRun")
+        row = self.conn.execute(
+            "SELECT fingerprint, last_run, guid FROM job_state"
+            " WHERE source = ? AND qualified_name = ?",
+            [self.source, qualified_name]
+        ).fetchone()
+
+        if row is None or row[0] != fingerprint:
+            self.pending[qualified_name] = [fingerprint, last_run, None]
+            return JOB_CHANGED
+        self.pending[qualified_name] = [fingerprint, last_run, row[2]]
+        if row[1] != last_run:
+            return JOB_LAST_RUN_CHANGED
+        return JOB_UNCHANGED
+
+    def guid(self, qualified_name):
+        """
+        The guid of the job's process in Purview, if it is known.
+        """
+        return (self.pending.get(qualified_name) or [None, None, None])[2]
+
+    def commit(self, results=None):
+        """
+        Make the jobs seen in this run the new baseline. Jobs whose upload
+        (in `failedBatches`) or lastRun update (in `failedUpdates`) failed
+        keep their previous state so they are retried next run. The guids
+        Purview assigned to newly uploaded jobs are remembered from the
+        `mutatedEntities` of the results.
+
+        :param dict results: The results of the upload, if any.
+        """
+        results = results or {}
+        failed = set(
+            e["attributes"]["qualifiedName"]
+            for batch in results.get("failedBatches", [])
+            for e in batch["entities"]
+        )
+        # A lastRun update is identified either by guid or by qualified name
+        failed_updates = [f["update"] for f in results.get("failedUpdates", [])]
+        failed.update(u["qualifiedName"] for u in failed_updates if u.get("qualifiedName"))
+        failed_guids = set(u["guid"] for u in failed_updates if u.get("guid"))
+        failed.update(
+            qn for qn, (_, _, guid) in self.pending.items() if guid and guid in failed_guids)
+
+        for mutated in results.get("mutatedEntities", {}).values():
+            for header in mutated:
+                qualified_name = header.get("attributes", {}).get("qualifiedName")
+                if qualified_name in self.pending and header.get("guid"):
+                    self.pending[qualified_name][2] = header["guid"]
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO job_state VALUES (?, ?, ?, ?, ?)",
+            [(self.source, qn, fingerprint, last_run, guid)
+             for qn, (fingerprint, last_run, guid) in self.pending.items()
+             if qn not in failed]
+        )
+        self.conn.commit()
+        self.pending = {}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,452 @@
+import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# This module is the shared upload stage for every ingestor in this sample.
+# Sending every entity in one giant `client.upload_entities(entities)` call
+# works for a handful of tables but falls over on a real catalog: the request
+# hits payload limits, takes forever and a single failure throws away all of
+# the work. Instead, I split the entities into size-bounded batches and send
+# those batches concurrently, retrying the ones that fail.
+
+# The one rule we must respect when splitting is that entities which point at
+# each other through their placeholder (negative) guids have to travel in the
+# same request. A column refers to its table through the `table` relationship
+# attribute (the my_custom_db_table_columns relationship) and a process refers
+# to its inputs and outputs. Purview only knows how to resolve a placeholder
+# guid inside the request that defines it.
+
+DEFAULT_MAX_ENTITIES = 500
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 1.0
+
+# Which failed requests are worth retrying. pyapacheatlas turns an error
+# response into an exception and drops its status code along the way:
+# * AtlasException (with the body as its message) when the body has an
+#   Atlas errorCode, which carries the status (e.g. ATLAS-404-00-007).
+# * ValueError when the body isn't json (e.g. a gateway's 502 / 503 page).
+# * requests.RequestException with the body as its message otherwise (e.g.
+#   Purview's {"error": {"code": "TooManyRequests", ...}}).
+# Connection errors and timeouts are requests exceptions too (they're told
+# apart by their class names, so that this module doesn't import requests
+# on every cold start, see `ingestor_client.py`). Throttling
+# (429), server errors (5xx) and connection problems are transient. Anything
+# else (a bad payload, an expired token, ...) fails the same way every time,
+# so it isn't retried.
+_ATLAS_ERROR_CODE = re.compile(r"ATLAS-(\d{3})-")
+_HTML_TITLE_STATUS = re.compile(r"<title>\s*(\d{3})\b", re.IGNORECASE)
+_ERROR_BODY_CODE = re.compile(r'"code"\s*:\s*"(\w+)"')
+_ERROR_CODE_STATUS = {
+    "badrequest": 400, "unauthorized": 401, "forbidden": 403, "notfound": 404,
+    "conflict": 409, "requestentitytoolarge": 413, "toomanyrequests": 429,
+    "internalservererror": 500, "badgateway": 502, "serviceunavailable": 503,
+    "gatewaytimeout": 504
+}
+THROTTLE_MARKERS = ["too many requests", "toomanyrequests", "rate limit", "throttl"]
+_CONNECTION_ERRORS = {"ConnectionError", "Timeout", "TimeoutError"}
+SERVER_ERROR_MARKERS = ["internal server error", "bad gateway", "service unavailable",
+                        "gateway timeout", "gateway time-out", "temporarily unavailable"]
+
+
+def entity_to_json(entity):
+    """
+    Coerce an AtlasEntity (or anything with a to_json method) into the
+    dict that will be sent to the bulk entity endpoint.
+
+    :param entity: The entity to convert. Dicts are returned untouched.
+    :type entity: Union(dict, :class:`~pyapacheatlas.core.entity.AtlasEntity`)
+    :return: The json representation of the entity.
+    :rtype: dict
+    """
+    if isinstance(entity, dict):
+        return entity
+    return entity.to_json()
+
+
+def _referenced_guids(entity_json):
+    """
+    Collect every guid this entity references through its relationship
+    attributes and its process inputs / outputs.
+    """
+    references = []
+    candidates = list(entity_json.get("relationshipAttributes", {}).values())
+    attributes = entity_json.get("attributes", {})
+    candidates.extend([attributes.get("inputs"), attributes.get("outputs")])
+    for candidate in candidates:
+        if isinstance(candidate, dict):
+            candidate = [candidate]
+        if not isinstance(candidate, list):
+            continue
+        for ref in candidate:
+            if isinstance(ref, dict) and ref.get("guid") is not None:
+                references.append(str(ref["guid"]))
+    return references
+
+
+def group_entities(entities):
+    """
+    Split the entities into groups that must be uploaded together. Two
+    entities land in the same group when one references the other's guid
+    (e.g. a column and its table, a process and its inputs).
+
+    :param list entities: AtlasEntity objects or dicts to group.
+    :return: The groups of entity dicts in the order they were first seen.
+    :rtype: list(list(dict))
+    """
+    entity_jsons = [entity_to_json(e) for e in entities]
+    # A small union-find over the position of each entity in the list
+    parents = list(range(len(entity_jsons)))
+
+    def find(idx):
+        while parents[idx] != idx:
+            parents[idx] = parents[parents[idx]]
+            idx = parents[idx]
+        return idx
+
+    position_by_guid = {}
+    for idx, entity_json in enumerate(entity_jsons):
+        if entity_json.get("guid") is not None:
+            position_by_guid[str(entity_json["guid"])] = idx
+
+    for idx, entity_json in enumerate(entity_jsons):
+        for guid in _referenced_guids(entity_json):
+            # References to entities outside of this upload (real guids)
+            # don't constrain how we batch.
+            if guid not in position_by_guid:
+                continue
+            root_a, root_b = find(idx), find(position_by_guid[guid])
+            if root_a != root_b:
+                parents[max(root_a, root_b)] = min(root_a, root_b)
+
+    groups = {}
+    for idx, entity_json in enumerate(entity_jsons):
+        groups.setdefault(find(idx), []).append(entity_json)
+    return list(groups.values())
+
+
+def pack_batches(groups, max_entities=DEFAULT_MAX_ENTITIES, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Pack groups of entities into batches bounded by entity count and by
+    serialized size. A group is never split, so a single group larger than
+    the limits becomes a batch of its own.
+
+    :param groups: An iterable of lists of entity dicts (or AtlasEntity).
+    :param int max_entities: The most entities a batch should carry.
+    :param int max_bytes: The largest json payload a batch should carry.
+    :return: A generator of batches (lists of entity dicts).
+    :rtype: Iterator(list(dict))
+    """
+    batch, batch_bytes = [], 0
+    for group in groups:
+        group = [entity_to_json(e) for e in group]
+        group_bytes = sum(len(json.dumps(e)) for e in group)
+        too_many = len(batch) + len(group) > max_entities
+        too_large = batch_bytes + group_bytes > max_bytes
+        if batch and (too_many or too_large):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.extend(group)
+        batch_bytes += group_bytes
+    if batch:
+        yield batch
+
+
+def error_status(error):
+    """
+    :return: The http status of the response an exception raised by a client
+        call stands for, or None if it can't be told (e.g. a connection
+        error).
+    :rtype: int
+    """
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None):
+        return response.status_code
+    text = str(error)
+    match = _ATLAS_ERROR_CODE.search(text) or _HTML_TITLE_STATUS.search(text)
+    if match:
+        return int(match.group(1))
+    match = _ERROR_BODY_CODE.search(text)
+    if match:
+        return _ERROR_CODE_STATUS.get(match.group(1).lower())
+    return None
+
+
+def is_throttled(error):
+    """
+    :return: Whether an exception raised by a client call means the request
+        was throttled (a 429).
+    :rtype: bool
+    """
+    if error_status(error) == 429:
+        return True
+    text = str(error).lower()
+    return any(marker in text for marker in THROTTLE_MARKERS)
+
+
+def is_transient(error):
+    """
+    :return: Whether an exception raised by a client call is worth retrying:
+        a connection error, a throttled request or a server error.
+    :rtype: bool
+    """
+    # requests' ConnectionError, Timeout (and its ConnectTimeout /
+    # ReadTimeout) or python's own
+    if _CONNECTION_ERRORS.intersection(cls.__name__ for cls in type(error).__mro__):
+        return True
+    status = error_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    text = str(error).lower()
+    return any(marker in text for marker in THROTTLE_MARKERS + SERVER_ERROR_MARKERS)
+
+
+def _call_with_retry(call, max_retries, backoff_seconds):
+    """
+    Make a call to Purview, retrying transient failures (see
+    :func:`is_transient`) with an exponential backoff and a bit of jitter.
+    Any other failure is raised straight away.
+    """
+    attempt = 0
+    while True:
+        try:
+            return call()
+        # AtlasException derives from BaseException
+        except BaseException as e:
+            if isinstance(e, (KeyboardInterrupt, SystemExit)) or not is_transient(e):
+                raise
+            # A governed client (see `ingestor_governor.py`) already retried
+            # this throttled request as many times as it should be
+            if getattr(e, "governed", False):
+                raise
+            if attempt >= max_retries:
+                raise
+            time.sleep(backoff_seconds * (2 ** attempt) * (1 + random.random()))
+            attempt += 1
+
+
+def _upload_with_retry(client, batch, max_retries, backoff_seconds):
+    return _call_with_retry(lambda: client.upload_entities(batch), max_retries, backoff_seconds)
+
+
+def _merge_results(merged, results):
+    """
+    Fold one bulk upload response into the running results of the run.
+    """
+    if not isinstance(results, dict):
+        return
+    for operation, mutated in results.get("mutatedEntities", {}).items():
+        merged["mutatedEntities"].setdefault(operation, []).extend(mutated)
+    merged["guidAssignments"].update(results.get("guidAssignments", {}))
+
+
+def upload_batches(client, batches, max_workers=DEFAULT_MAX_WORKERS,
+                   max_retries=DEFAULT_MAX_RETRIES, backoff_seconds=DEFAULT_BACKOFF_SECONDS,
+                   on_batch_done=None):
+    """
+    Send batches of entities concurrently with a pool of workers. Batches are
+    pulled from the iterable lazily, so at most `max_workers * 2` batches are
+    held in memory at any time.
+
+    A failed batch does not stop the run. It is recorded in the
+    `failedBatches` list of the results (with the error and its entities)
+    so that it can be inspected or retried later.
+
+    :param client: The AtlasClient or PurviewClient to upload with.
+    :param batches: An iterable of lists of entity dicts.
+    :param int max_workers: How many batches may be in flight at once.
+    :param int max_retries: How many times a batch is retried on a
+        transient failure.
+    :param float backoff_seconds: The base delay between retries.
+    :param on_batch_done: Called with (batch number, error or None) as each
+        batch finishes, from the calling thread. Batches finish out of order.
+    :return: The merged mutatedEntities and guidAssignments of every batch
+        plus the batches that failed.
+    :rtype: dict
+    """
+    merged = {"mutatedEntities": {}, "guidAssignments": {}, "failedBatches": []}
+    in_flight = {}
+
+    def collect(done):
+        for future in done:
+            batch_number, batch = in_flight.pop(future)
+            error = None
+            try:
+                _merge_results(merged, future.result())
+            # AtlasException derives from BaseException, so it has to be
+            # caught explicitly along with everything else.
+            except BaseException as e:
+                if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                    raise
+                error = str(e)
+                merged["failedBatches"].append({
+                    "batch": batch_number,
+                    "error": error,
+                    "entities": batch
+                })
+            if on_batch_done:
+                on_batch_done(batch_number, error)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch_number, batch in enumerate(batches):
+            if len(in_flight) >= max_workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = executor.submit(
+                _upload_with_retry, client, batch, max_retries, backoff_seconds)
+            in_flight[future] = (batch_number, batch)
+        collect(list(in_flight))
+
+    merged["failedBatches"].sort(key=lambda f: f["batch"])
+    return merged
+
+
+def upload_entities_in_batches(client, entities, max_entities=DEFAULT_MAX_ENTITIES,
+                               max_bytes=DEFAULT_MAX_BYTES, max_workers=DEFAULT_MAX_WORKERS,
+                               max_retries=DEFAULT_MAX_RETRIES,
+                               backoff_seconds=DEFAULT_BACKOFF_SECONDS):
+    """
+    The drop in replacement for `client.upload_entities(entities)`. Groups
+    the entities that reference each other, packs the groups into bounded
+    batches and uploads them concurrently.
+
+    :param client: The AtlasClient or PurviewClient to upload with.
+    :param list entities: AtlasEntity objects or dicts to upload.
+    :return: The merged results, see :func:`upload_batches`.
+    :rtype: dict
+    """
+    batches = pack_batches(group_entities(entities), max_entities, max_bytes)
+    return upload_batches(client, batches, max_workers, max_retries, backoff_seconds)
+
+
+def upload_entity_groups(client, groups, max_entities=DEFAULT_MAX_ENTITIES,
+                         max_bytes=DEFAULT_MAX_BYTES, max_workers=DEFAULT_MAX_WORKERS,
+                         max_retries=DEFAULT_MAX_RETRIES,
+                         backoff_seconds=DEFAULT_BACKOFF_SECONDS):
+    """
+    Upload a stream of entity groups that are already self contained (e.g.
+    a table and its columns). Unlike :func:`upload_entities_in_batches`, the
+    groups are consumed lazily so a generator of groups is never fully
+    held in memory.
+
+    :param client: The AtlasClient or PurviewClient to upload with.
+    :param groups: An iterable of lists of AtlasEntity objects or dicts.
+    :return: The merged results, see :func:`upload_batches`.
+    :rtype: dict
+    """
+    batches = pack_batches(groups, max_entities, max_bytes)
+    return upload_batches(client, batches, max_workers, max_retries, backoff_seconds)
+
+
+def _as_unique_reference(ref):
+    if "uniqueAttributes" in ref:
+        return ref
+    return {"typeName": ref["typeName"],
+            "uniqueAttributes": {"qualifiedName": ref["qualifiedName"]}}
+
+
+def merge_entity_lists(entity_lists):
+    """
+    Merge the entities of many processes (stored procedures, ETL jobs) that
+    share the same tables into one de-duplicated set of datasets plus the
+    processes. The first entity seen for a qualified name is kept and any
+    columns that pointed at a dropped duplicate table are pointed at the
+    kept one instead.
+
+    The processes refer to their inputs and outputs by qualified name rather
+    than by placeholder guid. Otherwise every process reading a popular
+    table would have to be uploaded in the same request as it. This means
+    the datasets must be uploaded before the processes, see
+    :func:`upload_in_stages`.
+
+    :param entity_lists: An iterable of lists of AtlasEntity / AtlasProcess.
+    :return: The de-duplicated datasets and the processes.
+    :rtype: tuple(list, list)
+    """
+    datasets = {}
+    processes = []
+    kept = {}
+
+    for entities in entity_lists:
+        for entity in entities:
+            if hasattr(entity, "inputs"):
+                entity.inputs = [_as_unique_reference(r) for r in entity.inputs]
+                entity.outputs = [_as_unique_reference(r) for r in entity.outputs]
+                processes.append(entity)
+            elif entity.qualifiedName in datasets:
+                kept[entity.guid] = datasets[entity.qualifiedName]
+            else:
+                table_ref = entity.relationshipAttributes.get("table")
+                if table_ref and table_ref.get("guid") in kept:
+                    entity.addRelationship(table=kept[table_ref["guid"]])
+                datasets[entity.qualifiedName] = entity
+
+    return list(datasets.values()), processes
+
+
+def upload_in_stages(client, *stages, **kwargs):
+    """
+    Upload several lists of entities one after the other (e.g. the tables
+    before the processes that refer to them by qualified name). Each stage
+    is batched and uploaded concurrently like
+    :func:`upload_entities_in_batches`, which takes the same keyword
+    arguments.
+
+    A client that records the uploads rather than sending them (see
+    `ingestor_export.py`) is told where each stage ends with `end_stage()`
+    so that replaying the recording keeps the order.
+
+    :return: The merged results of every stage.
+    :rtype: dict
+    """
+    merged = {"mutatedEntities": {}, "guidAssignments": {}, "failedBatches": []}
+    for number, stage in enumerate(stages):
+        if number and hasattr(client, "end_stage"):
+            client.end_stage()
+        results = upload_entities_in_batches(client, stage, **kwargs)
+        _merge_results(merged, results)
+        merged["failedBatches"].extend(results["failedBatches"])
+    return merged
+
+
+def partial_update_entities(client, updates, max_workers=DEFAULT_MAX_WORKERS,
+                            max_retries=DEFAULT_MAX_RETRIES,
+                            backoff_seconds=DEFAULT_BACKOFF_SECONDS):
+    """
+    Apply many small attribute updates (e.g. a job's lastRun) concurrently
+    with `client.partial_update_entity`. This is far cheaper than uploading
+    the whole entity again when only an attribute or two changed.
+
+    An update identified by guid can only change one attribute but costs a
+    single request. One identified by typeName and qualifiedName first reads
+    the entity back, so prefer the guid when you know it.
+
+    :param client: The AtlasClient or PurviewClient to update with.
+    :param updates: A list of dicts of the keyword arguments of
+        `partial_update_entity`: guid or typeName and qualifiedName, plus
+        attributes.
+    :return: How many updates succeeded and the updates that failed (with
+        their error).
+    :rtype: dict
+    """
+    results = {"updated": 0, "failedUpdates": []}
+
+    def update(kwargs):
+        return _call_with_retry(
+            lambda: client.partial_update_entity(**kwargs), max_retries, backoff_seconds)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(executor.submit(update, u), u) for u in updates]
+        for future, kwargs in futures:
+            try:
+                future.result()
+                results["updated"] += 1
+            # AtlasException derives from BaseException (see upload_batches)
+            except BaseException as e:
+                if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                    raise
+                results["failedUpdates"].append({"update": kwargs, "error": str(e)})
+    return results
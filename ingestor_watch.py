@@ -0,0 +1,252 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+# This module watches the directories the ingestors read (the ETL tool's job
+# files, the database's system table export and stored procedures) and
+# reports which files changed, so that `watch_sources.py` can re-ingest just
+# those files as soon as they land instead of waiting for the nightly run.
+# * On Linux, the kernel tells us about changes through inotify, which is
+#   called through ctypes so nothing needs to be installed.
+# * Everywhere else (or when inotify isn't available, e.g. the user is out
+#   of watches) the directories are polled: each file's modification time
+#   and size are compared with the last scan.
+# A file is usually written in several steps (or many files are copied at
+# once), so changes are debounced: they're collected until the directories
+# have been quiet for a moment and then handed over as one batch.
+
+DEFAULT_DEBOUNCE_SECONDS = 1.0
+# A batch is handed over after this long even if the changes keep coming
+DEFAULT_MAX_DELAY_SECONDS = 10.0
+DEFAULT_POLL_SECONDS = 2.0
+
+# The inotify events (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+# A file counts as changed once it's been written and closed or moved in,
+# not on every write while it's still being written.
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _walk_directories(root):
+    yield root
+    for directory, subdirectories, _ in os.walk(root):
+        for subdirectory in subdirectories:
+            yield os.path.join(directory, subdirectory)
+
+
+class InotifyWatcher():
+    """
+    Watches directories (and the directories under them) with inotify.
+
+    :param list directories: The directories to watch.
+    :raises OSError: If inotify isn't available.
+    """
+
+    def __init__(self, directories):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_init1 failed: " + os.strerror(errno))
+        self.directories = [os.path.abspath(d) for d in directories]
+        self._paths = {}
+        try:
+            for root in self.directories:
+                for directory in _walk_directories(root):
+                    self._add_watch(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "Can't watch {}: {}".format(directory, os.strerror(errno)))
+        self._paths[wd] = directory
+
+    def _rescan(self):
+        # Events were lost, so every file counts as changed
+        changed = set()
+        for root in self.directories:
+            for directory, _, files in os.walk(root):
+                changed.update(os.path.join(directory, f) for f in files)
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Wait for files to change.
+
+        :param float timeout: The most seconds to wait (None waits forever).
+        :return: The paths of the files that changed (or were removed), which
+            is empty if nothing changed before the timeout.
+        :rtype: set(str)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return set()
+            # Some events (e.g. a file being created) don't count as a
+            # change on their own, so keep waiting until one does.
+            changed = self._read_events()
+            if changed:
+                return changed
+
+    def _read_events(self):
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                changed.update(self._rescan())
+                continue
+            directory = self._paths.get(wd)
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                # A new directory is watched too, along with whatever was
+                # written to it before the watch was added.
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    for new_directory in _walk_directories(path):
+                        try:
+                            self._add_watch(new_directory)
+                        except OSError as e:
+                            print(e)
+                    changed.update(
+                        os.path.join(d, f) for d, _, files in os.walk(path) for f in files)
+                continue
+            if mask & IN_CREATE:
+                # The file is reported again once it has been written
+                continue
+            changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher():
+    """
+    Watches directories (and the directories under them) by scanning them
+    every `interval` seconds.
+
+    :param list directories: The directories to watch.
+    :param float interval: The seconds between scans.
+    """
+
+    def __init__(self, directories, interval=DEFAULT_POLL_SECONDS):
+        self.directories = [os.path.abspath(d) for d in directories]
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for root in self.directories:
+            for directory, _, files in os.walk(root):
+                for name in files:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, timeout=None):
+        """
+        Wait for files to change. See :meth:`InotifyWatcher.wait`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = set(
+                path for path in set(snapshot) | set(self._snapshot)
+                if snapshot.get(path) != self._snapshot.get(path)
+            )
+            self._snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return set()
+                time.sleep(min(self.interval, remaining))
+            else:
+                time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+def make_watcher(directories, poll=False, interval=DEFAULT_POLL_SECONDS):
+    """
+    Watch directories with inotify where it's available, otherwise by
+    polling them.
+
+    :param list directories: The directories to watch.
+    :param bool poll: Always poll.
+    :param float interval: The seconds between scans when polling.
+    :rtype: Union(:class:`InotifyWatcher`, :class:`PollingWatcher`)
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError) as e:
+            # AttributeError: a libc without inotify_init1
+            print("Polling for changes, inotify isn't available:", e)
+    return PollingWatcher(directories, interval)
+
+
+def debounced_changes(watcher, debounce=DEFAULT_DEBOUNCE_SECONDS,
+                      max_delay=DEFAULT_MAX_DELAY_SECONDS):
+    """
+    Group the changes of a watcher into batches. A batch starts with the
+    first change and ends once nothing has changed for `debounce` seconds,
+    or after `max_delay` seconds at most.
+
+    :return: A generator of the sets of changed paths, forever.
+    :rtype: Iterator(set(str))
+    """
+    while True:
+        changed = watcher.wait(None)
+        if not changed:
+            continue
+        started = time.monotonic()
+        while True:
+            remaining = min(debounce, started + max_delay - time.monotonic())
+            if remaining <= 0:
+                break
+            more = watcher.wait(remaining)
+            if not more:
+                break
+            changed |= more
+        yield changed
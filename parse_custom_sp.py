@@ -1,28 +1,36 @@
+import argparse
 import json
-import os
-import re
 
-from pyapacheatlas.core import AtlasEntity, AtlasProcess
+from pyapacheatlas.core import AtlasProcess
 from pyapacheatlas.core.util import GuidTracker
-from pyapacheatlas.auth import ServicePrincipalAuthentication
-from pyapacheatlas.core.client import PurviewClient
 
-oauth = ServicePrincipalAuthentication(
-    tenant_id=os.environ.get("TENANT_ID", ""),
-    client_id=os.environ.get("CLIENT_ID", ""),
-    client_secret=os.environ.get("CLIENT_SECRET", "")
+from custom_sp_parser import (
+    OUTPUT_VARIABLE,
+    parse_directory,
+    parse_file,
+    resolve_column_lineage,
+    resolve_datasets
 )
-client = PurviewClient(
-    account_name=os.environ.get("PURVIEW_NAME", ""),
-    authentication=oauth
+from ingestor_client import add_client_arguments, client_from_args
+from ingestor_lineage import add_lineage_arguments, record_lineage
+from ingestor_metrics import IngestorMetrics, MeteredClient, add_metrics_arguments, finish_metrics
+from ingestor_names import (
+    QualifiedNameIndex,
+    add_name_index_arguments,
+    process_qualified_name,
+    table_qualified_name
 )
+from ingestor_records import ColumnRecord, TableRecord
+from ingestor_upload import merge_entity_lists, upload_entities_in_batches, upload_in_stages
 
 # This sample demonstrates how you would parse a fictional database's
 # stored procedure logic by parsing the actual text and constructing
 # the Atlas Entities.
 # The goal is to show how you need to be able to understand your databases'
-# syntax.  However, this is not a full lexer / parser. If you're going
-# to get serious about this, there are lots of great tutorials out there.
+# syntax.  The parsing itself lives in `custom_sp_parser.py`: it tokenizes
+# the script once and builds a small syntax tree. It's still not a full
+# lexer / parser framework. If you're going to get serious about this,
+# there are lots of great tutorials out there.
 
 # The steps are primarily:
 ## Create the relevant custom types to represent your data source's types.
@@ -32,197 +40,231 @@ client = PurviewClient(
 ## Massage the inputs and outputs into Atlas Entities
 ## Upload the entities
 
-# First, I need to read in a stored process. In my case, I just have a
-# file but you might have to query your stored proc through your data source
-with open('./DataSource/myCustomDatabase/sp_transform_job.custom') as fp:
-    script = fp.readlines()
-
-# My custom database allows for aliasing datasets so my script needs
-# to be able to identify this alias.
-ALIASES = dict()
-# I'm going to hold all of the inputs, outputs, and intermediate datasets
-# in this variable so I can iterate over it and later create all of the
-# Atlas Entities.
-DATASETS = {
-}
-
-# Now I have to actually parse each line of the script.
-# All of this parsing is completely CUSTOM to my data source / stored proc syntax.
-# As a result, the actual processing done here is likely not useful to you but
-# you can use the concepts / steps in your own implementation.
-
-# I will iterate over each line (and include a line number for debugging)
-for rownum, line in enumerate(script):
-    if line == "" or line == "\n":
-        continue
-    # Each line must contain a variable declaration and operation separated by an equal symbol
-    variable, *operation = line.split("=", maxsplit=1)
-
-    operation = operation[0]
-    if not(operation.startswith('(') and operation.endswith(')\n')):
-        # The operation is malformed and we should error out
-        raise ValueError(
-            "Line {}: The operation is malformed: {}".format(rownum, operation))
-
-    # These should be wrapped in parens, so cut off the first and last characters
-    operation = operation[1:-2]
-    arguments = operation.split(",")
-    # Big If condition block to see what operation we're working with
-    function_argument = arguments[0]
-    input_arguments = []
-    # Handle internal aliasing of tables
-    for idx, arg in enumerate(arguments[1:]):
-        output = arg
-        if arg in ALIASES:
-            output = ALIASES[arg]
-        input_arguments.append(output)
-
-    # Now that I have the functions and operations parsed out, I
-    # need to write code on how to handle each function!
-    if function_argument == "ALIAS":
-        # Example: X=(ALIAS,myTable)
-        # X is our variable and myTable is our first input argument
-        ALIASES[variable] = input_arguments[0]
-
-    elif function_argument == "PROJECT":
-        # A projection indicates we are creating an intermediate dataset
-        _source = input_arguments[0]
-        _columns = input_arguments[1:]
-        DATASETS[variable] = {"columns": _columns, "source": _source}
-
-    elif function_argument == "GROUPED_SUM":
-        # A grouped sum indicates we are aggregating a dataset
-        _source = input_arguments[0]
-        _aggregate_column = input_arguments[1:2]
-        # These should be wrapped in parens, so cut off the first and last characters
-        _group_by_columns = input_arguments[2:]
-        DATASETS[variable] = {
-            "columns": _group_by_columns + _aggregate_column, "source": _source}
-
-    elif function_argument == "READ":
-        # Reading a file from the database
-        _source = input_arguments[0]
-        _columns = input_arguments[1:]
-        DATASETS[variable] = {"columns": _columns, "source": "*"}
-
-    elif function_argument == "WRITE":
-        # Writing a file to the database
-        _destTable = input_arguments[0]
-        _source = input_arguments[1]
-        DATASETS[variable] = {"columns": [],
-                              "source": _source, "destination": _destTable}
-    else:
-        raise NotImplementedError(
-            "Line {}: Function {} is not supported".format(rownum, function_argument))
-
-# Printing out the parsed content of the stored proc for debugging
-print("Parsed content from stored procedure:")
-print(json.dumps(DATASETS, indent=2))
-
-# Now that I've parsed the script, I can create the entities
-# Creating a Process to represent the stored proc
-# I will start by setting up a guidtracker to generate unique
-# "dummy guids" (negative numbers) that coordinate our upload
-# to purview.
-gt = GuidTracker()
-
 # I'm also going to include a reference to the type names I'll
-# be using. 
+# be using.
 PROCESS_TYPE_NAME = "my_custom_db_sp"
 TABLE_TYPE_NAME = "my_custom_db"
 COLUMN_TYPE_NAME = "my_custom_db_column"
 
-# Now I create a list that will be used for storing our entities
-entities = []
-# This process will represent the stored procedure as part of the lineage of these tables
-proc = AtlasProcess(
-    # You should programmatically generate this
-    name="sp_transform_job.custom",
-    guid=gt.get_guid(),
-    # You should programmatically generate this
-    qualified_name="custom://sp_transform_job.custom",
-    typeName=PROCESS_TYPE_NAME,
-    inputs=[],
-    outputs=[],
-    attributes={}
-)
 
-# Now that we have parsed the proprietary code of this data source
-# We need to iterate over the results: .items() gives both the key
-# and value of a dictionary. In this case, that means we get the
-# table name and table definition.
-for table, current_table_definition in DATASETS.items():
-    # In my parsing, I wrote a source of '*' to represent an input dataset
-    is_intermediate_table = (current_table_definition["source"] != "*")
-    # The custom code indicates an output line with @@OUTPUT as the variable name
-    is_output_table = (table == "@@OUTPUT")
-    # In this case, I don't care about the intermediate results
-    # If you cared about tracking the transforms at the column
-    # level, you would need to create some means of tracking
-    # transformations at the column level
-    # For ease of this demonstration, I'm keeping it simple
-    if is_intermediate_table and not is_output_table:
-        continue # Skipping this intermediate result
-    
-    # Since the output lines store the table name in "destination"
-    # We need to update the table_name variable with the contents
-    # of the "destination" field.
-    table_name = table
-    if is_output_table:
-        table_name = current_table_definition["destination"]
-        # In addition, the output line doesn't carry the columns
-        # We need to look up the columns from its source and
-        # update our definition 
-        _source = current_table_definition["source"]
-        _source_definition = DATASETS[_source]
-        current_table_definition["columns"] = _source_definition["columns"]
-
-    _tbl = AtlasEntity(
-        name=table_name,
+# Now that I've parsed the script, I can create the entities.
+# This is a function (rather than code at the top of the script) so that
+# it can be reused for as many stored procedures as I like in one process.
+# A table that's already in the index of ingested entities (see
+# `ingestor_names.py`) isn't built again, the process just refers to it.
+def build_sp_entities(procedure_name, datasets, gt, index=None):
+    # Now I create a list that will be used for storing our entities
+    entities = []
+    # This process will represent the stored procedure as part of the lineage of these tables
+    proc = AtlasProcess(
+        name=procedure_name,
         guid=gt.get_guid(),
-        # Your qualified name pattern may include server, database, container, etc. 
-        # You should plan this out carefully.
-        qualified_name="custom://{}".format(table_name), 
-        typeName=TABLE_TYPE_NAME,
-        attributes={}  # Add any custom attributes
+        # You should programmatically generate this
+        qualified_name=process_qualified_name(procedure_name),
+        typeName=PROCESS_TYPE_NAME,
+        inputs=[],
+        outputs=[],
+        attributes={}
     )
-    entities.append(_tbl)
-
-    # Are there columns here?
-    if len(current_table_definition["columns"]) > 0:
-        for col in current_table_definition["columns"]:
-            # Add each column as an entity
-            _c = AtlasEntity(
-                name=col,
-                guid=gt.get_guid(),
-                # Your qualified name pattern may include server, database, container, etc. 
-                # You should plan this out carefully.
-                # Typically, it's <table qualified name>#<column name> for columns
-                qualified_name="custom://{}#{}".format(table_name, col),
-                typeName=COLUMN_TYPE_NAME,
-                # Capture some additional attributes here from your script
-                attributes={
-                    # I'm passing in a default of string, but your code
-                    # should pass in the real type!
-                    "type": "string"
-                } 
-            )
-            # Add a relationship attribute that connects the column to the table
-            # This "table" relationship attribute must be defined in your 
-            # custom type.
-            _c.addRelationship(table=_tbl)
+
+    # Now that we have parsed the proprietary code of this data source
+    # We need to iterate over the results: .items() gives both the key
+    # and value of a dictionary. In this case, that means we get the
+    # table name and table definition.
+    for table, current_table_definition in datasets.items():
+        # In my parsing, I wrote a source of '*' to represent an input dataset
+        is_intermediate_table = (current_table_definition["source"] != "*")
+        # The custom code indicates an output line with @@OUTPUT as the variable name
+        is_output_table = (table == OUTPUT_VARIABLE)
+        # In this case, I don't create entities for the intermediate results.
+        # The transformations at the column level are still tracked through
+        # them, see `build_column_mapping` below.
+        if is_intermediate_table and not is_output_table:
+            continue # Skipping this intermediate result
+
+        # Since the output lines store the table name in "destination"
+        # We need to update the table_name variable with the contents
+        # of the "destination" field.
+        table_name = table
+        columns = current_table_definition["columns"]
+        if is_output_table:
+            table_name = current_table_definition["destination"]
+            # In addition, the output line doesn't carry the columns
+            # We need to look up the columns from its source
+            _source = current_table_definition["source"]
+            columns = datasets[_source]["columns"]
+
+        # The system table ingestor knows much more about this table than
+        # the script does, so if it (or anything else) already ingested it,
+        # I only refer to it.
+        existing = index.reference(table_qualified_name(table_name)) if index else None
+        if existing:
+            if is_output_table:
+                proc.outputs.append(existing)
+            else:
+                proc.inputs.append(existing)
+            continue
+
+        # The tables and columns are compact records rather than AtlasEntity
+        # objects (see `ingestor_records.py`), their qualified names are
+        # built the same way as `table_qualified_name` and
+        # `column_qualified_name` do.
+        _tbl = TableRecord(table_name, gt.get_guid())  # Add any custom attributes
+        entities.append(_tbl)
+
+        # Are there columns here?
+        for col in columns:
+            # Add each column as an entity, connected to its table through
+            # the "table" relationship attribute of my custom type.
+            # I'm passing in a default of string, but your code should pass
+            # in the real type!
+            _c = ColumnRecord(_tbl, col, gt.get_guid(), "string")
             entities.append(_c)
-    
-    if is_output_table:
-        proc.addOutput(_tbl)
+
+        # AtlasProcess only knows how to refer to an AtlasEntity, so it gets
+        # the record's reference
+        if is_output_table:
+            proc.addOutput(_tbl.to_json(minimum=True))
+        else:
+            proc.addInput(_tbl.to_json(minimum=True))
+
+    # The columnMapping attribute (defined on my_custom_db_sp in
+    # `custom_types_for_ingestor.py`) powers the column level lineage in the
+    # Purview UI.
+    column_mapping = build_column_mapping(datasets)
+    if column_mapping:
+        proc.attributes.update({"columnMapping": json.dumps(column_mapping)})
+
+    # Finally, we add the process entity to our list of entities to upload
+    entities.append(proc)
+    return entities
+
+
+# Column Mappings can be complex! Each output column is traced back through
+# any number of aliases, projections and grouped sums to the columns of the
+# tables that were read (see `resolve_column_lineage`). Purview expects one
+# entry per source table / sink table pair with the list of column pairs.
+def build_column_mapping(datasets):
+    lineage = resolve_column_lineage(datasets)
+    column_mapping = []
+    for table, current_table_definition in datasets.items():
+        if table != OUTPUT_VARIABLE:
+            continue
+        sink_qualified_name = table_qualified_name(current_table_definition["destination"])
+        mappings_by_source = {}
+        for sink_column, sources in lineage[table].items():
+            for source_table, source_column in sources:
+                mappings_by_source.setdefault(source_table, []).append(
+                    {"Source": source_column, "Sink": sink_column})
+        for source_table, colmap in mappings_by_source.items():
+            column_mapping.append({
+                "DatasetMapping": {
+                    "Source": table_qualified_name(source_table),
+                    "Sink": sink_qualified_name
+                },
+                "ColumnMapping": colmap
+            })
+    return column_mapping
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest custom stored procedures")
+    parser.add_argument("--directory", default=None,
+                        help="Ingest every *.custom file under this directory")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="How many processes to parse with (defaults to the number of cores)")
+    add_client_arguments(parser)
+    add_metrics_arguments(parser)
+    add_name_index_arguments(parser)
+    add_lineage_arguments(parser)
+    args = parser.parse_args()
+
+    # I want to know where the time of every run goes, so each stage is timed
+    # and every request to Purview is measured. (See `ingestor_metrics.py`.)
+    metrics = IngestorMetrics("parse_custom_sp")
+
+    # First we need to log in with our Azure Purview Credentials.
+    # Nothing is sent to Azure until the first upload, and not at all
+    # with --dry-run. (See `ingestor_client.py`.)
+    client = MeteredClient(client_from_args(args), metrics)
+
+    # I will start by setting up a guidtracker to generate unique
+    # "dummy guids" (negative numbers) that coordinate our upload
+    # to purview.
+    gt = GuidTracker()
+
+    # The tables that were already ingested (e.g. by
+    # `parse_datasource_sys_table.py`), by qualified name.
+    index = QualifiedNameIndex.from_state(args.name_index)
+
+    if args.directory:
+        # In batch mode, every stored procedure under the directory is parsed
+        # across a pool of processes (see `parse_directory`). Only the
+        # parsed datasets come back to this process, where the entities are
+        # built and de-duplicated.
+        def parsed_procedures():
+            parsed = metrics.iter_stage("parse", parse_directory(args.directory, args.workers))
+            for name, datasets, error in parsed:
+                if error:
+                    print("Skipping a stored procedure that failed to parse:", error)
+                    continue
+                try:
+                    with metrics.stage("build"):
+                        entities = build_sp_entities(name, datasets, gt, index)
+                except ValueError as e:
+                    print("Skipping a stored procedure with circular datasets:", name, e)
+                    continue
+                yield entities
+
+        # Many procedures read or write the same tables (e.g. tblDailySales).
+        # I only want to send each table and column once, so the entities of
+        # every procedure are merged into one de-duplicated set of tables /
+        # columns plus the processes. (See `ingestor_upload.py`.)
+        dataset_entities, process_entities = merge_entity_lists(parsed_procedures())
+        print("Parsed {} stored procedures into {} tables and columns".format(
+            len(process_entities), len(dataset_entities)))
+        # With --lineage-index, the lineage is also kept locally (see
+        # `ingestor_lineage.py`).
+        record_lineage(args.lineage_index, process_entities)
+
+        # The tables and columns go first so that the processes can refer
+        # to them by qualified name.
+        metrics.begin("upload")
+        results = upload_in_stages(client, dataset_entities, process_entities)
     else:
-        proc.addInput(_tbl)
+        # First, I need to read in a stored process. In my case, I just have a
+        # file but you might have to query your stored proc through your data source
+        metrics.begin("parse")
+        script = parse_file('./DataSource/myCustomDatabase/sp_transform_job.custom')
+
+        # My custom database allows for aliasing datasets and building
+        # intermediate datasets. Resolving the parsed statements gives me all
+        # of the inputs, outputs, and intermediate datasets so I can iterate
+        # over them and later create all of the Atlas Entities.
+        datasets = resolve_datasets(script)
+
+        # Printing out the parsed content of the stored proc for debugging
+        if args.verbose:
+            print("Parsed content from stored procedure:")
+            print(json.dumps(datasets, indent=2))
 
-# Finally, we add the process entity to our list of entities to upload
-entities.append(proc)
+        metrics.begin("build")
+        entities = build_sp_entities(script.name, datasets, gt, index)
+        # With --lineage-index, the lineage is also kept locally (see
+        # `ingestor_lineage.py`).
+        record_lineage(args.lineage_index, entities)
 
-# Perform the upload and go!
-results = client.upload_entities(entities)
+        # Perform the upload and go!
+        # Rather than one giant request, the entities are split into size-bounded
+        # batches (keeping each entity with the entities it references) and sent
+        # concurrently. See `ingestor_upload.py` for the details.
+        metrics.begin("upload")
+        results = upload_entities_in_batches(client, entities)
 
-# Print out the results
-print(json.dumps(results,indent=2))
+    # Print out the results. The full response can be huge, so by default
+    # only the failures and the timings are reported.
+    if args.verbose:
+        print(json.dumps(results, indent=2))
+    for failed in results["failedBatches"]:
+        print("Batch {} failed: {}".format(failed["batch"], failed["error"]))
+    finish_metrics(metrics, args)
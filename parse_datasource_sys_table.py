@@ -1,21 +1,18 @@
+import argparse
 import json
 import os
 import re
 
-from pyapacheatlas.core import AtlasEntity, AtlasProcess
+from pyapacheatlas.core import AtlasProcess
 from pyapacheatlas.core.util import GuidTracker
-from pyapacheatlas.auth import ServicePrincipalAuthentication
-from pyapacheatlas.core.client import PurviewClient
-
-oauth = ServicePrincipalAuthentication(
-    tenant_id=os.environ.get("TENANT_ID", ""),
-    client_id=os.environ.get("CLIENT_ID", ""),
-    client_secret=os.environ.get("CLIENT_SECRET", "")
-)
-client = PurviewClient(
-    account_name=os.environ.get("PURVIEW_NAME", ""),
-    authentication=oauth
-)
+
+from ingestor_client import add_client_arguments, client_from_args
+from ingestor_metrics import IngestorMetrics, MeteredClient, add_metrics_arguments, finish_metrics
+from ingestor_records import ColumnRecord, TableRecord
+from ingestor_reconcile import add_reconcile_arguments, format_report, reconcile_state
+from ingestor_state import DEFAULT_STATE_PATH, EntityStateStore
+from ingestor_upload import upload_entities_in_batches, upload_entity_groups
+from sys_table_stream import iter_system_tables
 
 # This sample demonstrates how you would parse a fictional database's
 # system metadata tables and constructing the Atlas Entities.
@@ -30,68 +27,241 @@ client = PurviewClient(
 ## Massage the inputs and outputs into Atlas Entities
 ## Upload the entities
 
-# First, I need to read in the system table. In my case, I just have a
-# file but you might have to query your system table through your data source
-# with tools like pyodbc to query a database.
-with open('./DataSource/myCustomDatabase/sys.json') as fp:
-    system_table = json.load(fp)
-
-
-# I will start by setting up a guidtracker to generate unique
-# "dummy guids" (negative numbers) that coordinate our upload
-# to purview.
-gt = GuidTracker()
-
 # I'm also going to include a reference to the type names I'll
-# be using. 
+# be using.
 TABLE_TYPE_NAME = "my_custom_db"
 COLUMN_TYPE_NAME = "my_custom_db_column"
 
-# Now I create a list that will be used for storing our entities
-entities = []
-
-# I want to iterate over every table in my system table
-for table_name, table_object in system_table["tables"].items():
-    _tbl = AtlasEntity(
-        name=table_name,
-        guid=gt.get_guid(),
-        # Your qualified name pattern may include server, database, container, etc. 
-        # You should plan this out carefully.
-        qualified_name="custom://{}".format(table_name), 
-        typeName=TABLE_TYPE_NAME,
-        attributes={"description": table_object["description"]}  # Add any custom attributes
-    )
-    entities.append(_tbl)
+SYSTEM_TABLE_PATH = './DataSource/myCustomDatabase/sys.json'
+
+
+# I'll create a function that turns one table and its columns from the
+# system table into entities. The table and its columns reference each
+# other, so they always travel together as one group.
+# A system table can list millions of columns, so rather than full
+# AtlasEntity objects I build compact records that only become Atlas json
+# when they're uploaded (see `ingestor_records.py`).
+# With --profile, the profile of the table's data (see `data_profiler.py`)
+# adds its row count and the statistics of each column.
+def build_table_entities(table_name, table_object, columns, gt, profile=None):
+    group = []
+    table_attributes = {"description": table_object["description"]}  # Add any custom attributes
+    column_profiles = {}
+    if profile:
+        table_attributes.update(profile.attributes())
+        column_profiles = profile.column_attributes(columns)
+
+    # Your qualified name pattern may include server, database, container, etc.
+    # You should plan this out carefully. Every ingestor builds it the
+    # same way (see `ingestor_names.py`): custom://<table name>
+    _tbl = TableRecord(table_name, gt.get_guid(), table_attributes)
+    group.append(_tbl)
 
     # Are there columns here?
-    if len(system_table["columns"][table_name]) > 0:
-        for col in system_table["columns"][table_name]:
-            # Add each column as an entity
-            _c = AtlasEntity(
-                name=col["name"],
-                guid=gt.get_guid(),
-                # Your qualified name pattern may include server, database, container, etc. 
-                # You should plan this out carefully.
-                # Typically, it's <table qualified name>#<column name> for columns
-                qualified_name="custom://{}#{}".format(table_name, col["name"]),
-                typeName=COLUMN_TYPE_NAME,
-                # Capture some additional attributes here from your script
-                attributes={
-                    # I'm passing in the description and type I found in the
-                    # system table.
-                    "type": col["type"],
-                    "description": col["description"]
-                } 
-            )
-            # Add a relationship attribute that connects the column to the table
-            # This "table" relationship attribute must be defined in your 
-            # custom type.
-            _c.addRelationship(table=_tbl)
-            entities.append(_c)
-
-
-# Perform the upload and go!
-results = client.upload_entities(entities)
-
-# Print out the results
-print(json.dumps(results,indent=2))
+    for col in columns:
+        # Add each column as an entity. Typically, the qualified name of a
+        # column is <table qualified name>#<column name>, and the column
+        # points at its table through the "table" relationship attribute
+        # that is defined in the custom type.
+        # I'm passing in the description and type I found in the system
+        # table.
+        _c = ColumnRecord(_tbl, col["name"], gt.get_guid(), col["type"], col["description"],
+                          column_profiles.get(col["name"]))
+        group.append(_c)
+    return group
+
+
+# Some tables aren't in the system table's columns at all, or have more
+# values per row than it lists. With --infer-schema, the missing columns are
+# inferred from a sample of the table's data files (see
+# `schema_inference.py`) and added after the declared ones.
+# numpy is only imported when it's needed.
+def infer_missing_columns(tables, data_directory, sample_size=1000, max_rows=100000):
+    from data_profiler import table_part_files
+    from schema_inference import infer_table_columns
+    for table_name, table_object, columns in tables:
+        columns, inferred, errors = infer_table_columns(
+            table_part_files(table_name, table_object, data_directory), columns,
+            sample_size, max_rows)
+        if errors:
+            print("Couldn't infer the columns of {} from all of its data: {}".format(
+                table_name, "; ".join(errors)))
+        if inferred:
+            print("Inferred {} column(s) of {}".format(inferred, table_name))
+        yield table_name, table_object, columns
+
+
+# Each table's data files are profiled across a pool of processes and the
+# profile is passed along with the table (see `data_profiler.py`).
+def profile_table_data(tables, data_directory, workers=None):
+    from data_profiler import profile_tables, table_part_files
+    parts = (((table_name, table_object, columns),
+              table_part_files(table_name, table_object, data_directory))
+             for table_name, table_object, columns in tables)
+    for (table_name, table_object, columns), profile in profile_tables(parts, workers):
+        if profile and profile.errors:
+            print("Couldn't profile all of {}: {}".format(table_name, "; ".join(profile.errors)))
+        yield table_name, table_object, columns, profile
+
+
+# The profiling runs in worker processes, which (on Windows and macOS)
+# import this script again, so everything below only runs when it is the
+# script being run.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest a custom database's system table")
+    parser.add_argument("--system-table", default=SYSTEM_TABLE_PATH,
+                        help="The system table export to ingest")
+    parser.add_argument("--state", default=DEFAULT_STATE_PATH,
+                        help="The local state store used for incremental ingestion")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="Upload every entity, even if it hasn't changed")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream very large system table exports instead of loading them whole")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile each table's data files and add the statistics (needs numpy)")
+    parser.add_argument("--data-directory", default=None,
+                        help="Where the tables' data files are (defaults to the system table's folder)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="How many processes to profile with (defaults to the number of cores)")
+    parser.add_argument("--infer-schema", action="store_true",
+                        help="Infer the columns the system table doesn't list from the data files (needs numpy)")
+    parser.add_argument("--sample-size", type=int, default=1000,
+                        help="How many rows of each table to infer the columns from")
+    parser.add_argument("--infer-max-rows", type=int, default=100000,
+                        help="Stop sampling a table after this many rows (0 reads them all)")
+    add_client_arguments(parser)
+    add_metrics_arguments(parser)
+    add_reconcile_arguments(parser)
+    args = parser.parse_args()
+
+    # The run's stages and requests are timed and counted (see `ingestor_metrics.py`).
+    metrics = IngestorMetrics("parse_datasource_sys_table")
+
+    # First we need to log in with our Azure Purview Credentials.
+    # The client is built lazily (see `ingestor_client.py`).
+    client = MeteredClient(client_from_args(args), metrics)
+
+    # I will start by setting up a guidtracker to generate unique
+    # "dummy guids" (negative numbers) that coordinate our upload
+    # to purview.
+    gt = GuidTracker()
+
+    # Most of the time, only a few of these tables and columns have changed
+    # since the last run. The state store remembers a hash of every entity
+    # I uploaded for this source so I only send the new or changed ones.
+    # (See `ingestor_state.py` for the details.)
+    state = EntityStateStore(args.state, source="myCustomDatabase")
+
+    def only_changed(group):
+        if args.full_refresh:
+            state.filter_changed(group)
+            return group
+        return state.filter_changed(group)
+
+    # The tables' data files are only read with --infer-schema or --profile.
+    # They live next to the system table unless --data-directory says
+    # otherwise.
+    data_directory = args.data_directory or os.path.dirname(args.system_table)
+
+    def with_inferred_columns(tables):
+        if not args.infer_schema:
+            return tables
+        return infer_missing_columns(tables, data_directory, args.sample_size,
+                                     args.infer_max_rows or None)
+
+    def with_profiles(tables):
+        if not args.profile:
+            return ((table_name, table_object, columns, None)
+                    for table_name, table_object, columns in tables)
+        return profile_table_data(tables, data_directory, args.workers)
+
+    if args.stream:
+        # In streaming mode, I never hold the whole system table (or all of the
+        # entities) in memory. The export is walked one table at a time and each
+        # table + columns group flows straight into the uploader.
+        # (See `sys_table_stream.py` for the details.)
+        # Reading, building and uploading are interleaved here, so the parse
+        # and build stages are timed table by table. The infer and profile
+        # stages include reading the tables they work on ahead.
+        def changed_groups():
+            tables = metrics.iter_stage("parse", iter_system_tables(args.system_table))
+            tables = metrics.iter_stage("infer", with_inferred_columns(tables))
+            for table_name, table_object, columns, profile in metrics.iter_stage(
+                    "profile", with_profiles(tables)):
+                with metrics.stage("build"):
+                    group = only_changed(build_table_entities(
+                        table_name, table_object, columns, gt, profile))
+                yield group
+
+        metrics.begin("upload")
+        results = upload_entity_groups(client, changed_groups())
+    else:
+        # First, I need to read in the system table. In my case, I just have a
+        # file but you might have to query your system table through your data source
+        # with tools like pyodbc to query a database.
+        metrics.begin("parse")
+        with open(args.system_table) as fp:
+            system_table = json.load(fp)
+
+        # A table that has no columns listed is still cataloged.
+        metrics.begin("infer")
+        tables = list(with_inferred_columns(
+            (table_name, table_object, system_table["columns"].get(table_name, []))
+            for table_name, table_object in system_table["tables"].items()
+        ))
+
+        metrics.begin("profile")
+        tables = list(with_profiles(tables))
+
+        metrics.begin("build")
+
+        # Now I create a list that will be used for storing our entities
+        entities = []
+
+        # I want to iterate over every table in my system table
+        for table_name, table_object, columns, profile in tables:
+            entities.extend(build_table_entities(table_name, table_object, columns, gt, profile))
+
+        entities = only_changed(entities)
+        print("{} new or changed entities to upload".format(len(entities)))
+
+        # Perform the upload and go!
+        # Rather than one giant request, the entities are split into size-bounded
+        # batches (keeping each entity with the entities it references) and sent
+        # concurrently. See `ingestor_upload.py` for the details.
+        metrics.begin("upload")
+        results = upload_entities_in_batches(client, entities)
+
+    # Anything I uploaded before but didn't see in the system table this time
+    # has been deleted from my data source.
+    metrics.begin("state")
+    deleted_entities = state.deleted()
+    print("{} entities deleted since the last run".format(len(deleted_entities)))
+    if deleted_entities and not args.reconcile:
+        print("They stay in Purview (and in the state) until a run with --reconcile")
+    if args.verbose:
+        print(json.dumps(deleted_entities, indent=2))
+
+    # With --reconcile they're deleted from Purview too, columns before their
+    # tables (see `ingestor_reconcile.py`). Exporting doesn't delete anything,
+    # it only reports what would be deleted like a dry run.
+    if args.reconcile and deleted_entities:
+        metrics.begin("reconcile")
+        report = reconcile_state(client, state, args.dry_run or bool(args.export),
+                                 args.delete_batch_size)
+        print(format_report(report))
+        metrics.begin("state")
+
+    # Now that the upload is done, this run becomes the baseline for the next
+    # one. Anything in a failed batch will be tried again next time. A dry run
+    # didn't upload anything, so it leaves the baseline alone. The entities
+    # deleted at the source are only forgotten once --reconcile deleted them.
+    if not args.dry_run:
+        state.commit(results, forget_deleted=args.reconcile)
+
+    # Print out the results (all of them with -v)
+    if args.verbose:
+        print(json.dumps(results, indent=2))
+    for failed in results["failedBatches"]:
+        print("Batch {} failed: {}".format(failed["batch"], failed["error"]))
+    finish_metrics(metrics, args)
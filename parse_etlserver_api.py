@@ -1,12 +1,27 @@
+import argparse
+import asyncio
 import json
-import os
-
-import requests
 
 from pyapacheatlas.core import AtlasEntity, AtlasProcess
 from pyapacheatlas.core.util import GuidTracker
-from pyapacheatlas.auth import ServicePrincipalAuthentication
-from pyapacheatlas.core.client import PurviewClient
+
+from etl_api_harvester import DEFAULT_BASE_URL, DEFAULT_MAX_CONNECTIONS, harvest_jobs
+from ingestor_client import add_client_arguments, client_from_args
+from ingestor_lineage import add_lineage_arguments, record_lineage
+from ingestor_metrics import IngestorMetrics, MeteredClient, add_metrics_arguments, finish_metrics
+from ingestor_names import (
+    QualifiedNameIndex,
+    add_name_index_arguments,
+    etl_dataset_name,
+    process_qualified_name
+)
+from ingestor_state import (
+    DEFAULT_STATE_PATH,
+    JOB_CHANGED,
+    JOB_LAST_RUN_CHANGED,
+    JobStateStore
+)
+from ingestor_upload import merge_entity_lists, partial_update_entities, upload_in_stages
 
 # This sample demonstrates how you would parse a fictional ETL Tool's API
 # The goal is to show how you need to be able to understand your tool's
@@ -21,26 +36,10 @@ from pyapacheatlas.core.client import PurviewClient
 ## Upload the entities
 
 
-# First we need to log in with our Azure Purview Credentials
-oauth = ServicePrincipalAuthentication(
-    tenant_id=os.environ.get("TENANT_ID", ""),
-    client_id=os.environ.get("CLIENT_ID", ""),
-    client_secret=os.environ.get("CLIENT_SECRET", "")
-)
-client = PurviewClient(
-    account_name=os.environ.get("PURVIEW_NAME", ""),
-    authentication=oauth
-)
-
-# Now we can call our API. In this case, the server is running
-# locally but you would need to figure out authentication and
-# the end point for your real server.
+# I'm also going to include a reference to the type names I'll
+# be using. 
+PROCESS_TYPE_NAME = "my_custom_etl_job"
 
-# Here, I'm issuing a GET request the the 'job' api and getting
-# the job with id # 001.  I'll store the json data into a variable
-# so that we can work with it further below.
-results = requests.get("http://localhost:8088/api/job/001")
-response_json = results.json()
 
 # In my case, I've got an ETL tool that will return a response
 # that looks like below:
@@ -53,45 +52,10 @@ response_json = results.json()
 # You will need to do the research to find out what your api looks like
 # and how to access it.
 
-print("Response from ETL tool API:")
-print(json.dumps(response_json,indent=2))
-print()
-
-# I'm also going to include a reference to the type names I'll
-# be using. 
-PROCESS_TYPE_NAME = "my_custom_etl_job"
-
-# Now I am in the Atlas Entities / Purview space!
-# I will start by setting up a guidtracker to generate unique
-# "dummy guids" (negative numbers) that coordinate our upload
-# to purview.
-gt = GuidTracker()
-# Now I create a list that will be used for storing our entities
-entities = []
-
-# Since we are taking a given job from our ETL tool, we will
-# represent it as a single Process entity with inputs and
-# outputs.  We are NOT going to represent intermediate datasets
-# or column transformations in this case but you could implement
-# this if your ETL tool provides it.
-
-proc = AtlasProcess(
-    # You might generate the  name programmatically from the API response
-    name=response_json["name"],
-    guid=gt.get_guid(),
-    # We need to carefully consider the qualified name pattern
-    # so that it's unique, might represent a hierarchy of objects,
-    # and could be generated programmatically
-    qualified_name="custom://" + response_json["name"],
-    typeName=PROCESS_TYPE_NAME,
-    inputs=[],
-    outputs=[],
-    attributes={}
-)
 
 # I'll create a function that I can re-use when iterating
 # over the API response's.
-def create_entity_from_api_schema(api_object):
+def create_entity_from_api_schema(api_object, gt):
     # Now we need to create entities for each input
     # Based on my fictional API, I'm expecting an object that
     # will always have a field of name and type. Any additional
@@ -101,21 +65,10 @@ def create_entity_from_api_schema(api_object):
     # tool's API.
 
     # The qualified name and typename will be different
-    # based on the type response of the API
-    qualified_name = ""
-    typeName = "DataSet"
-    # We need to map our qualified name 
-    if api_object["type"] == "blob":
-        # In this case , the etl tool provides blob storage
-        # path which happens to be the correct qualified name!
-        qualified_name = api_object["path"]
-        typeName = "azure_blob_path"
-
-    elif api_object["type"] == "customDB":
-        # In this case, I have to implement a custom qualified
-        # name because this is the proprietary type from my etl tool
-        qualified_name = "customDB://"+api_object["name"]
-        typeName = "my_custom_db"
+    # based on the type response of the API. A blob's path is its
+    # qualified name and a table of my custom database is named the same way
+    # as every other ingestor names it (see `ingestor_names.py`).
+    typeName, qualified_name = etl_dataset_name(api_object)
 
     _ae = AtlasEntity(
         name=api_object["name"],
@@ -125,28 +78,196 @@ def create_entity_from_api_schema(api_object):
     )
     return _ae
 
-for inp in response_json["inputs"]:
-    # We have inputs to our ETL process
-    _ae = create_entity_from_api_schema(inp)
-    # Now I'll add this as an input to the job process
-    proc.addInput(_ae)
-    entities.append(_ae)
-
-for outp in response_json["outputs"]:
-    # We have outputs from our ETL process
-    
-    _ae = create_entity_from_api_schema(outp)
-    # Now I'll add this as an output to the job process
-    proc.addOutput(_ae)
-    entities.append(_ae)
-
-# Now that I have iterated over all the inputs and outputs
-# I can add the process entity to my list of entities that
-# will be uploaded.
-entities.append(proc)
-
-# Perform the upload and go!
-results = client.upload_entities(entities)
-
-# Print out the results
-print(json.dumps(results, indent=2))
+
+# We need to carefully consider the qualified name pattern
+# so that it's unique, might represent a hierarchy of objects,
+# and could be generated programmatically
+def job_qualified_name(response_json):
+    return process_qualified_name(response_json["name"])
+
+
+# Turning one job's response into entities is a function (rather than code
+# at the top of the script) so that it can be reused for every job I harvest.
+# A dataset that's already in the index of ingested entities (see
+# `ingestor_names.py`) isn't sent again, the process just refers to it.
+def build_job_entities(response_json, gt, index=None):
+    # Now I create a list that will be used for storing our entities
+    entities = []
+
+    # Since we are taking a given job from our ETL tool, we will
+    # represent it as a single Process entity with inputs and
+    # outputs.  We are NOT going to represent intermediate datasets
+    # or column transformations in this case but you could implement
+    # this if your ETL tool provides it.
+
+    proc = AtlasProcess(
+        # You might generate the  name programmatically from the API response
+        name=response_json["name"],
+        guid=gt.get_guid(),
+        qualified_name=job_qualified_name(response_json),
+        typeName=PROCESS_TYPE_NAME,
+        inputs=[],
+        outputs=[],
+        # The lastRun attribute is defined on my_custom_etl_job
+        # in `custom_types_for_ingestor.py`
+        attributes={"lastRun": response_json.get("lastRun")}
+    )
+
+    for inp in response_json["inputs"]:
+        # We have inputs to our ETL process
+        existing = index.reference(etl_dataset_name(inp)[1]) if index else None
+        if existing:
+            proc.inputs.append(existing)
+            continue
+        _ae = create_entity_from_api_schema(inp, gt)
+        # Now I'll add this as an input to the job process
+        proc.addInput(_ae)
+        entities.append(_ae)
+
+    for outp in response_json["outputs"]:
+        # We have outputs from our ETL process
+        existing = index.reference(etl_dataset_name(outp)[1]) if index else None
+        if existing:
+            proc.outputs.append(existing)
+            continue
+        _ae = create_entity_from_api_schema(outp, gt)
+        # Now I'll add this as an output to the job process
+        proc.addOutput(_ae)
+        entities.append(_ae)
+
+    # Now that I have iterated over all the inputs and outputs
+    # I can add the process entity to my list of entities that
+    # will be uploaded.
+    entities.append(proc)
+    return entities
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest jobs from the ETL tool's api")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL,
+                        help="The root of the ETL tool's api")
+    parser.add_argument("--job", default="001", help="The id of the job to ingest")
+    parser.add_argument("--all-jobs", action="store_true",
+                        help="Harvest every job listed by the api instead of just --job")
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help="How many jobs to fetch at once")
+    parser.add_argument("--state", default=DEFAULT_STATE_PATH,
+                        help="The local state store used for incremental ingestion")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="Upload every job even if it hasn't changed")
+    add_client_arguments(parser)
+    add_metrics_arguments(parser)
+    add_name_index_arguments(parser)
+    add_lineage_arguments(parser)
+    args = parser.parse_args()
+
+    # Each stage of the run is timed and every request to Purview is
+    # measured. (See `ingestor_metrics.py`.)
+    metrics = IngestorMetrics("parse_etlserver_api")
+
+    # First we need to log in with our Azure Purview Credentials.
+    # The client is only built (and only asks Azure for a token) the first
+    # time it's used, and the token is cached on disk between runs. With
+    # --dry-run nothing is sent at all. (See `ingestor_client.py`.)
+    client = MeteredClient(client_from_args(args), metrics)
+
+    # Now I am in the Atlas Entities / Purview space!
+    # I will start by setting up a guidtracker to generate unique
+    # "dummy guids" (negative numbers) that coordinate our upload
+    # to purview.
+    gt = GuidTracker()
+
+    # Every job runs on a schedule, so its lastRun changes all the time but
+    # its inputs and outputs rarely do. The state store remembers each job's
+    # lastRun and a fingerprint of the rest of its definition. (See
+    # `ingestor_state.py` for the details.)
+    state = JobStateStore(args.state, source="myETLTool")
+
+    # The tables that were already ingested (e.g. by
+    # `parse_datasource_sys_table.py`), by qualified name.
+    index = QualifiedNameIndex.from_state(args.name_index)
+
+    # Now we can call our API. In this case, the server is running
+    # locally but you would need to figure out authentication and
+    # the end point for your real server.
+    # The jobs are fetched concurrently (see `etl_api_harvester.py`), either
+    # every job the api lists or just the job with id # 001. Each job is
+    # turned into entities as soon as its response arrives rather than
+    # waiting for all of them.
+    async def harvested_jobs():
+        job_entities = []
+        last_run_updates = []
+        unchanged = 0
+        job_ids = None if args.all_jobs else [args.job]
+        async for job_id, response_json, error in harvest_jobs(
+                args.base_url, job_ids, max_connections=args.max_connections):
+            if error:
+                print("Skipping a job that couldn't be fetched:", job_id, error)
+                continue
+            if args.verbose:
+                print("Response from ETL tool API:")
+                print(json.dumps(response_json,indent=2))
+                print()
+
+            qualified_name = job_qualified_name(response_json)
+            status = state.check(qualified_name, response_json)
+            if status == JOB_CHANGED or args.full_refresh:
+                with metrics.stage("build"):
+                    job_entities.append(build_job_entities(response_json, gt, index))
+            elif status == JOB_LAST_RUN_CHANGED:
+                # Only the lastRun moved, so there's no need to send the
+                # process and its datasets again.
+                update = {"attributes": {"lastRun": response_json.get("lastRun")}}
+                if state.guid(qualified_name):
+                    update["guid"] = state.guid(qualified_name)
+                else:
+                    update.update(typeName=PROCESS_TYPE_NAME, qualifiedName=qualified_name)
+                last_run_updates.append(update)
+            else:
+                unchanged += 1
+        return job_entities, last_run_updates, unchanged
+
+    # The jobs are built as they arrive, so the "harvest" stage includes
+    # the "build" stage.
+    with metrics.stage("harvest"):
+        job_entities, last_run_updates, unchanged = asyncio.run(harvested_jobs())
+
+    # Lots of jobs read and write the same tables, so the entities of
+    # every job are merged into one de-duplicated set of datasets plus
+    # the processes. The datasets go first so that the processes can
+    # refer to them by qualified name.
+    dataset_entities, process_entities = merge_entity_lists(job_entities)
+    print("{} changed jobs with {} datasets, {} lastRun updates, {} unchanged jobs".format(
+        len(process_entities), len(dataset_entities), len(last_run_updates), unchanged))
+    # With --lineage-index, the lineage of the changed jobs is also kept
+    # locally (see `ingestor_lineage.py`). The unchanged ones are there
+    # from an earlier run.
+    record_lineage(args.lineage_index, process_entities)
+
+    # Perform the upload and go!
+    # Rather than one giant request, the entities are split into size-bounded
+    # batches and sent concurrently. See `ingestor_upload.py` for the details.
+    metrics.begin("upload")
+    results = upload_in_stages(client, dataset_entities, process_entities)
+    metrics.begin("update")
+    update_results = partial_update_entities(client, last_run_updates)
+    metrics.finish()
+    results["updatedEntities"] = update_results["updated"]
+    results["failedUpdates"] = update_results["failedUpdates"]
+
+    # Jobs that failed to upload or update are left out so they are
+    # retried next run. A dry run leaves the state alone.
+    if not args.dry_run:
+        state.commit(results)
+    state.close()
+
+    # Print out the results (all of them with -v)
+    if args.verbose:
+        print(json.dumps(results, indent=2))
+    for failed in results["failedBatches"]:
+        print("Batch {} failed: {}".format(failed["batch"], failed["error"]))
+    for failed in results["failedUpdates"]:
+        print("Update of {} failed: {}".format(
+            failed["update"].get("guid") or failed["update"].get("qualifiedName"),
+            failed["error"]))
+    finish_metrics(metrics, args)
@@ -1,16 +1,21 @@
-import xml 
-import xml.dom.minidom
-# NOTE: Python documentation encourages you to use defusedxml
-# if you can't trust the source to be non-malicious
+import argparse
 import json
-import os
-
-import requests
+import sys
 
 from pyapacheatlas.core import AtlasEntity, AtlasProcess
 from pyapacheatlas.core.util import GuidTracker
-from pyapacheatlas.auth import ServicePrincipalAuthentication
-from pyapacheatlas.core.client import PurviewClient
+
+from etl_jobfile_parser import JobGraphError, load_job_graph
+from ingestor_client import add_client_arguments, client_from_args
+from ingestor_lineage import add_lineage_arguments, record_lineage
+from ingestor_metrics import IngestorMetrics, MeteredClient, add_metrics_arguments, finish_metrics
+from ingestor_names import (
+    QualifiedNameIndex,
+    add_name_index_arguments,
+    etl_dataset_name,
+    process_qualified_name
+)
+from ingestor_upload import upload_entities_in_batches
 
 # This sample demonstrates how you would parse a fictional ETL Tool's job files
 # The goal is to show how you need to be able to understand your tool's config
@@ -23,121 +28,16 @@ from pyapacheatlas.core.client import PurviewClient
 ## Massage the files into Atlas Entities
 ## Upload the entities
 
-
-# First we need to log in with our Azure Purview Credentials
-oauth = ServicePrincipalAuthentication(
-    tenant_id=os.environ.get("TENANT_ID", ""),
-    client_id=os.environ.get("CLIENT_ID", ""),
-    client_secret=os.environ.get("CLIENT_SECRET", "")
-)
-client = PurviewClient(
-    account_name=os.environ.get("PURVIEW_NAME", ""),
-    authentication=oauth
-)
-
-# Now I will read the example job file into memory and try to process it
-script = xml.dom.minidom.parse('./ETLTool/jobs/job002.xml')
-
-# Next, I want to get some of the job metadata
-# My xml file has some meta data on the root level
-JOB_NAME = script.documentElement.getAttribute("name")
-JOB_ID = script.documentElement.getAttribute("jobId")
-
-# In my case, I've got an ETL tool that generates XML files 
-# that looks like below:
-# TODO
-# You will need to do the research to find out what your job looks like
-# and how to access it.
-
-# I'll create re-usable functions for processing this xml format
-def get_inputs(startNode):
-    output = []
-    # Filter the list down to just the input nodes
-    inputNodes = [x for x in startNode.childNodes if isinstance(x, xml.dom.minidom.Element)][0]
-    for child in inputNodes.childNodes:
-        if isinstance(child, xml.dom.minidom.Element):
-            _typeName = child.getAttribute("typeName")
-            _tableName = child.firstChild.data
-            output.append({"name":_tableName, "type":_typeName})
-    return output
-
-def get_mappings(projectionNode):
-    setOfColumns = [x for x in projectionNode.childNodes if isinstance(x, xml.dom.minidom.Element) and x.tagName == "columns"][0]
-    output = []
-    for columnNode in setOfColumns.childNodes:
-        # Only look at the individual column mappings
-        if not isinstance(columnNode, xml.dom.minidom.Element):
-            continue
-        mappings = [c for c in columnNode.childNodes if c.nodeType != xml.dom.minidom.Node.TEXT_NODE]
-        output.append({'Source':mappings[0].firstChild.data, 'Sink': mappings[1].firstChild.data})
-    
-    return output
-
-
-def get_output(outputNode):
-    # Filter the list down to just the input nodes
-    singleOutputNode = [x for x in outputNode.childNodes if isinstance(x, xml.dom.minidom.Element) and x.tagName == "output"][0]
-    
-    _typeName = singleOutputNode.getAttribute("typeName")
-    _tableName = singleOutputNode.firstChild.data
-
-    return {"name":_tableName, "type":_typeName}
-
-
-input_tables = []
-output_tables = []
-column_mappings = []
-
-for node in script.getElementsByTagName("node"):
-    # Is this the starting node?
-    if node.getAttribute("id") == "start":
-        input_tables.extend(get_inputs(node))
-    elif node.getAttribute("type") == "projection":
-        column_mappings.extend(get_mappings(node))
-    elif node.getAttribute("type") == "sink":
-        output_tables.append(get_output(node))
-    
-print("Looking at the results of parsing")
-print(input_tables)
-print(column_mappings)
-print(output_tables)
-
-# Now I am in the Atlas Entities / Purview space!
-
 # I'm going to include a reference to the type names I'll
 # be using. 
 PROCESS_TYPE_NAME = "my_custom_etl_job"
 
-# I will start by setting up a guidtracker to generate unique
-# "dummy guids" (negative numbers) that coordinate our upload
-# to purview.
-gt = GuidTracker()
-# Now I create a list that will be used for storing our entities
-entities = []
-
-# Since we are taking a given job from our ETL tool, we will
-# represent it as a single Process entity with inputs and
-# outputs.  We are NOT going to represent intermediate datasets
-# but WILL include column mappings in this case but you could implement
-# intermediate datasets if your ETL tool provides it.
-
-proc = AtlasProcess(
-    # You might generate the  name programmatically from the job response
-    name=JOB_NAME,
-    guid=gt.get_guid(),
-    # We need to carefully consider the qualified name pattern
-    # so that it's unique, might represent a hierarchy of objects,
-    # and could be generated programmatically
-    qualified_name="custom://" + JOB_ID,
-    typeName=PROCESS_TYPE_NAME,
-    inputs=[],
-    outputs=[],
-    attributes={}
-)
+JOB_FILE_PATH = "./ETLTool/jobs/job002.xml"
+
 
 # I'll create a function that I can re-use when iterating
 # over the job response's.
-def create_entity_from_job_schema(job_object):
+def create_entity_from_job_schema(job_object, gt):
     # Now we need to create entities for each input
     # Based on my fictional job, I'm expecting an object that
     # will always have a field of name and type. Any additional
@@ -147,21 +47,10 @@ def create_entity_from_job_schema(job_object):
     # tool's job.
 
     # The qualified name and typename will be different
-    # based on the type response of the job
-    qualified_name = ""
-    typeName = "DataSet"
-    # We need to map our qualified name 
-    if job_object["type"] == "blob":
-        # In this case , the etl tool provides blob storage
-        # path which happens to be the correct qualified name!
-        qualified_name = job_object["name"]
-        typeName = "azure_blob_path"
-
-    elif job_object["type"] == "customDB":
-        # In this case, I have to implement a custom qualified
-        # name because this is the proprietary type from my etl tool
-        qualified_name = "customDB://"+job_object["name"]
-        typeName = "my_custom_db"
+    # based on the type of the job's dataset. A blob's path is its
+    # qualified name and a table of my custom database is named the same way
+    # as every other ingestor names it (see `ingestor_names.py`).
+    typeName, qualified_name = etl_dataset_name(job_object)
 
     _ae = AtlasEntity(
         name=job_object["name"],
@@ -171,60 +60,178 @@ def create_entity_from_job_schema(job_object):
     )
     return _ae
 
-for inp in input_tables:
-    # We have inputs to our ETL process
-    _ae = create_entity_from_job_schema(inp)
-    # Now I'll add this as an input to the job process
-    proc.addInput(_ae)
-    entities.append(_ae)
-
-for outp in output_tables:
-    # We have outputs from our ETL process
-    
-    _ae = create_entity_from_job_schema(outp)
-    # Now I'll add this as an output to the job process
-    proc.addOutput(_ae)
-    entities.append(_ae)
-
-
-# Column Mappings can be complex!
-output_qualified_name = (proc.outputs[0]["qualifiedName"])
-
-COLUMN_MAPPING_PRE = {}
-
-# First I have to collect all of the column mappings for each
-# source and sink. In this case, there's only one sink but multiple
-# sources.
-for colmap in column_mappings:
-    source_table, source_column = colmap["Source"].split(".", maxsplit=1)
-    sink_column = colmap["Sink"]
-    _existing_mapping = COLUMN_MAPPING_PRE.get(source_table, [])
-    _existing_mapping.append(  {"Source": source_column, "Sink": sink_column} )
-    COLUMN_MAPPING_PRE[source_table] = _existing_mapping
-
-COLUMN_MAPPING = {}
-for source_table, colmap in COLUMN_MAPPING_PRE.items():
-    # I need to look up the source table's qualified name
-    source_table_qn = [e.qualifiedName for e in entities if e.name == source_table][0]
-    COLUMN_MAPPING = [
-        {
-            "DatasetMapping": {"Source":source_table_qn, "Sink": output_qualified_name},
-            "ColumnMapping": colmap
-        }
-    ]
-
-# Now that the column mapping is complete, I'll add it as an attribute.
-# This only works if my custom type has the columnMapping attribute as
-# part of its definition
-proc.attributes.update({"columnMapping": COLUMN_MAPPING})
-
-# Now that I have iterated over all the inputs and outputs
-# I can add the process entity to my list of entities that
-# will be uploaded.
-entities.append(proc)
-
-# Perform the upload and go!
-results = client.upload_entities(entities)
-
-# Print out the results
-print(json.dumps(results, indent=2))
+
+# Turning a parsed job into entities is a function (rather than code at the
+# top of the script) so that `run_pipeline.py` can reuse it. A dataset that's
+# already in the index of ingested entities (see `ingestor_names.py`) isn't
+# sent again, the process just refers to it.
+def build_jobfile_entities(job, gt, index=None):
+    # Next, I want to get some of the job metadata
+    # My xml file has some meta data on the root level
+    job_name = job.attributes.get("name")
+    job_id = job.attributes.get("jobId")
+
+    # Now I create a list that will be used for storing our entities
+    entities = []
+
+    # Since we are taking a given job from our ETL tool, we will
+    # represent it as a single Process entity with inputs and
+    # outputs.  We are NOT going to represent intermediate datasets
+    # but WILL include column mappings in this case but you could implement
+    # intermediate datasets if your ETL tool provides it.
+
+    proc = AtlasProcess(
+        # You might generate the  name programmatically from the job response
+        name=job_name,
+        guid=gt.get_guid(),
+        # We need to carefully consider the qualified name pattern
+        # so that it's unique, might represent a hierarchy of objects,
+        # and could be generated programmatically
+        qualified_name=process_qualified_name(job_id),
+        typeName=PROCESS_TYPE_NAME,
+        inputs=[],
+        outputs=[],
+        attributes={}
+    )
+
+    # I'll keep an index of the qualified name of every dataset I create
+    # so that I can look them up by name when building the column mappings.
+    qualified_names = {}
+
+    # The inputs of every node that reads tables and the outputs of every sink
+    for inp in job.inputs:
+        # We have inputs to our ETL process
+        qualified_names[inp["name"]] = etl_dataset_name(inp)[1]
+        existing = index.reference(qualified_names[inp["name"]]) if index else None
+        if existing:
+            proc.inputs.append(existing)
+            continue
+        _ae = create_entity_from_job_schema(inp, gt)
+        # Now I'll add this as an input to the job process
+        proc.addInput(_ae)
+        entities.append(_ae)
+
+    for outp in job.outputs:
+        # We have outputs from our ETL process
+        qualified_names[outp["name"]] = etl_dataset_name(outp)[1]
+        existing = index.reference(qualified_names[outp["name"]]) if index else None
+        if existing:
+            proc.outputs.append(existing)
+            continue
+        _ae = create_entity_from_job_schema(outp, gt)
+        # Now I'll add this as an output to the job process
+        proc.addOutput(_ae)
+        entities.append(_ae)
+
+    # Column Mappings can be complex!
+    # Every sink's columns are traced back through any number of joins and
+    # projections to the tables they come from. The job graph has already
+    # collected the column mappings for each source table and sink, so I
+    # only need to turn the table names into qualified names. There can be
+    # several sinks and several sources.
+    column_mapping = []
+    for colmap in job.column_mappings():
+        column_mapping.append(
+            {
+                "DatasetMapping": {
+                    "Source": qualified_names[colmap["source"]],
+                    "Sink": qualified_names[colmap["sink"]["name"]]
+                },
+                "ColumnMapping": colmap["mappings"]
+            }
+        )
+
+    # Now that the column mapping is complete, I'll add it as an attribute
+    # (unless the job doesn't map any columns).
+    # This only works if my custom type has the columnMapping attribute as
+    # part of its definition
+    if column_mapping:
+        proc.attributes.update({"columnMapping": json.dumps(column_mapping)})
+
+    # Now that I have iterated over all the inputs and outputs
+    # I can add the process entity to my list of entities that
+    # will be uploaded.
+    entities.append(proc)
+    return entities
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest an ETL tool's job file")
+    parser.add_argument("--job-file", default=JOB_FILE_PATH,
+                        help="The job file to ingest")
+    add_client_arguments(parser)
+    add_metrics_arguments(parser)
+    add_name_index_arguments(parser)
+    add_lineage_arguments(parser)
+    args = parser.parse_args()
+
+    # Every stage of the run (parsing, building the entities and uploading them)
+    # is timed. See `ingestor_metrics.py`.
+    metrics = IngestorMetrics("parse_etlserver_jobfile")
+
+    # First we need to log in with our Azure Purview Credentials.
+    # See `ingestor_client.py`: the client is built on first use and reuses
+    # a cached token.
+    client = MeteredClient(client_from_args(args), metrics)
+
+    # In my case, I've got an ETL tool that generates XML files 
+    # that looks like below:
+    # <job name="Daily ETL Jobv2" jobId="job002">
+    #     <node type="join" id="start"> ... <input typeName="customDB">tblDailySales</input> ...
+    #     <node type="projection" id="step01"> ... <column> source and target names ...
+    #     <node type="sink" id="step002"> ... <output typeName="blob">https://...</output> ...
+    # </job>
+    # You will need to do the research to find out what your job looks like
+    # and how to access it.
+
+    # Now I will read the example job file and process it. Job files can be
+    # huge, so rather than loading the whole document into memory I stream
+    # through it (see `etl_jobfile_parser.py`).
+    # Each node in the job lists the nodes it depends on, so the job is really a
+    # graph of nodes: sources / joins, projections and sinks. Loading the job
+    # checks that it's a valid graph: a dependency on a node that doesn't
+    # exist is reported and dropped, while cycles and nodes defined twice
+    # can't be ingested.
+    metrics.begin("parse")
+    try:
+        job = load_job_graph(args.job_file)
+        job_nodes = job.topological_order()
+    except JobGraphError as e:
+        print("Error: {} is not a valid job: {}".format(args.job_file, e))
+        sys.exit(1)
+
+    if args.verbose:
+        print("Looking at the results of parsing")
+        print([node.id for node in job_nodes])
+        print(job.inputs)
+        print(job.column_mappings())
+        print(job.outputs)
+
+    # Now I am in the Atlas Entities / Purview space!
+    metrics.begin("build")
+
+    # I will start by setting up a guidtracker to generate unique
+    # "dummy guids" (negative numbers) that coordinate our upload
+    # to purview.
+    gt = GuidTracker()
+    # The tables that were already ingested (e.g. by
+    # `parse_datasource_sys_table.py`), by qualified name.
+    index = QualifiedNameIndex.from_state(args.name_index)
+    entities = build_jobfile_entities(job, gt, index)
+    # With --lineage-index, the job's lineage (down to its columns) is also
+    # kept locally (see `ingestor_lineage.py`).
+    record_lineage(args.lineage_index, entities)
+
+    # Perform the upload and go!
+    # Rather than one giant request, the entities are split into size-bounded
+    # batches (keeping each entity with the entities it references) and sent
+    # concurrently. See `ingestor_upload.py` for the details.
+    metrics.begin("upload")
+    results = upload_entities_in_batches(client, entities)
+
+    # Print out the results (all of them with -v)
+    if args.verbose:
+        print(json.dumps(results, indent=2))
+    for failed in results["failedBatches"]:
+        print("Batch {} failed: {}".format(failed["batch"], failed["error"]))
+    finish_metrics(metrics, args)
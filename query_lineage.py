@@ -0,0 +1,73 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from ingestor_export import export_files, iter_groups
+from ingestor_lineage import DEFAULT_LINEAGE_PATH, LineageIndex
+
+# This script answers lineage questions from the local lineage index (see
+# `ingestor_lineage.py`) instead of asking Purview. Record the lineage while
+# ingesting (it works with --dry-run and --export too):
+#   python run_pipeline.py --dry-run --lineage-index .lineage_index.sqlite
+# or index an export directory after the fact:
+#   python query_lineage.py build ./export
+# and then ask what depends on a table or a column:
+#   python query_lineage.py downstream tblDailySales
+#   python query_lineage.py upstream custom://tblDailySales#id --depth 1
+# A table of my custom database can be named without its custom:// prefix.
+
+
+def print_nodes(nodes, as_json):
+    if as_json:
+        print(json.dumps(nodes, indent=2))
+        return
+    for node in nodes:
+        print("{:>3}  {}  ({}, via {})".format(
+            node["depth"], node["qualifiedName"], node["typeName"] or "column", node["process"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the local lineage index")
+    parser.add_argument("--index", default=DEFAULT_LINEAGE_PATH,
+                        help="The lineage index to query")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for direction in ["downstream", "upstream"]:
+        command = commands.add_parser(direction, help="What is {} of a dataset or column".format(
+            direction))
+        command.add_argument("name", help="The qualified name (or table name) to start from")
+        command.add_argument("--depth", type=int, default=None,
+                             help="How many hops to follow at most (defaults to all of them)")
+        command.add_argument("--json", action="store_true", help="Print the results as json")
+    build = commands.add_parser("build", help="Index the processes of an export directory")
+    build.add_argument("directory", help="The export directory (see ingestor_export.py)")
+    commands.add_parser("stats", help="How many nodes and edges are indexed")
+    args = parser.parse_args()
+
+    if args.command != "build" and not os.path.exists(args.index):
+        sys.exit("There's no lineage index at {}".format(args.index))
+    index = LineageIndex(args.index)
+
+    if args.command == "build":
+        processes = 0
+        for name in export_files(args.directory):
+            for group, _, _ in iter_groups(os.path.join(args.directory, name)):
+                processes += index.add_processes(group)
+        print("Indexed {} processes".format(processes))
+        print(json.dumps(index.stats()))
+    elif args.command == "stats":
+        print(json.dumps(index.stats(), indent=2))
+    else:
+        qualified_name = index.find(args.name)
+        if qualified_name is None:
+            sys.exit("{} isn't in the lineage index".format(args.name))
+        started = time.perf_counter()
+        walk = index.downstream if args.command == "downstream" else index.upstream
+        nodes = walk(qualified_name, args.depth)
+        print_nodes(nodes, args.json)
+        if not args.json:
+            print("{} {} of {} ({:.1f}ms)".format(
+                len(nodes), args.command, qualified_name,
+                (time.perf_counter() - started) * 1000))
+    index.close()
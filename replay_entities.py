@@ -0,0 +1,46 @@
+import argparse
+import json
+
+from ingestor_client import add_client_arguments, client_from_args
+from ingestor_export import replay_exports
+from ingestor_metrics import IngestorMetrics, MeteredClient, add_metrics_arguments, finish_metrics
+from ingestor_upload import DEFAULT_MAX_BYTES, DEFAULT_MAX_ENTITIES, DEFAULT_MAX_WORKERS
+
+# This script uploads the entities that an ingestor exported with --export
+# (see `ingestor_export.py`). For example:
+#   python parse_custom_sp.py --directory ./procs --export ./export
+#   python replay_entities.py ./export --workers 8
+# The replay remembers how far it got in ./export/replay_offsets.json, so if
+# it is stopped or Purview fails part way through, run it again and it picks
+# up from the first batch that wasn't uploaded.
+
+parser = argparse.ArgumentParser(description="Upload the entities exported by an ingestor")
+parser.add_argument("directory", help="The export directory")
+parser.add_argument("--max-entities", type=int, default=DEFAULT_MAX_ENTITIES,
+                    help="The most entities in one upload")
+parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES,
+                    help="The largest payload of one upload")
+parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS,
+                    help="How many uploads to run at once")
+parser.add_argument("--restart", action="store_true",
+                    help="Ignore the saved offsets and upload everything again")
+add_client_arguments(parser, export=False)
+add_metrics_arguments(parser)
+args = parser.parse_args()
+
+metrics = IngestorMetrics("replay_entities")
+client = MeteredClient(client_from_args(args), metrics)
+
+metrics.begin("upload")
+results = replay_exports(
+    client, args.directory, max_entities=args.max_entities, max_bytes=args.max_bytes,
+    max_workers=args.workers, restart=args.restart, record_progress=not args.dry_run)
+
+print("Uploaded {} entities and {} partial updates, {} failed batches, {} failed updates".format(
+    sum(len(m) for m in results["mutatedEntities"].values()), results["updatedEntities"],
+    len(results["failedBatches"]), len(results["failedUpdates"])))
+for failed in results["failedBatches"]:
+    print("Batch {} of {} failed: {}".format(failed["batch"], failed["file"], failed["error"]))
+if args.dry_run:
+    print(json.dumps(client.summary(), indent=2))
+finish_metrics(metrics, args)
@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import json
+import os
+
+from custom_sp_parser import parse_directory, parse_file, resolve_datasets
+from etl_api_harvester import DEFAULT_BASE_URL, DEFAULT_MAX_CONNECTIONS, harvest_jobs
+from etl_jobfile_parser import load_job_graph
+from ingestor_client import add_client_arguments, client_from_args
+from ingestor_lineage import add_lineage_arguments, forget_lineage, record_lineage
+from ingestor_metrics import IngestorMetrics, MeteredClient, add_metrics_arguments, finish_metrics
+from ingestor_names import QualifiedNameIndex, add_name_index_arguments
+from ingestor_pipeline import (
+    SharedGuidTracker,
+    load_pipeline_config,
+    merge_stage_results,
+    run_stages
+)
+from ingestor_reconcile import (
+    add_reconcile_arguments,
+    format_report,
+    reconcile_state,
+    referenced_names
+)
+from ingestor_state import DEFAULT_STATE_PATH, EntityStateStore
+from ingestor_upload import upload_in_stages
+from parse_custom_sp import build_sp_entities
+from parse_datasource_sys_table import (
+    SYSTEM_TABLE_PATH,
+    build_table_entities,
+    infer_missing_columns,
+    profile_table_data
+)
+from parse_etlserver_api import build_job_entities
+from parse_etlserver_jobfile import JOB_FILE_PATH, build_jobfile_entities
+from sys_table_stream import iter_system_tables
+
+# This script runs every ingestor in this sample as a stage of one pipeline
+# and uploads what they found together: the system table of my custom
+# database, its stored procedures, the ETL tool's job files and the jobs of
+# the ETL tool's api. The sources are listed in a json config (see
+# `pipeline.json` and `ingestor_pipeline.py`):
+#   python run_pipeline.py pipeline.json --dry-run
+# Each type of source takes the same options as its own script:
+# * sys_table: path, stream, infer_schema, profile, data_directory,
+#   sample_size, infer_max_rows and workers
+#   (see `parse_datasource_sys_table.py`)
+# * custom_sp: directory (every *.custom file under it) or path (one file)
+#   and workers (see `parse_custom_sp.py`)
+# * jobfile: paths (see `parse_etlserver_jobfile.py`)
+# * etl_api: base_url, jobs (a list of job ids) or all_jobs and
+#   max_connections (see `parse_etlserver_api.py`)
+# Every stage returns lists of entities that reference each other (e.g. a
+# table and its columns, a process and its inputs and outputs).
+# The stages share an index of the entities that were already ingested (see
+# `ingestor_names.py`). The system table stage adds its tables to it, so a
+# stage that depends_on it refers to those tables rather than sending them
+# again.
+
+
+def sys_table_stage(source, gt, index):
+    path = source.get("path", SYSTEM_TABLE_PATH)
+    if source.get("stream"):
+        tables = iter_system_tables(path)
+    else:
+        with open(path) as fp:
+            system_table = json.load(fp)
+        tables = [
+            (table_name, table_object, system_table["columns"].get(table_name, []))
+            for table_name, table_object in system_table["tables"].items()
+        ]
+    data_directory = source.get("data_directory") or os.path.dirname(path)
+    if source.get("infer_schema"):
+        tables = infer_missing_columns(tables, data_directory, source.get("sample_size", 1000),
+                                       source.get("infer_max_rows", 100000) or None)
+    if source.get("profile"):
+        tables = profile_table_data(tables, data_directory, source.get("workers"))
+    else:
+        tables = ((table_name, table_object, columns, None)
+                  for table_name, table_object, columns in tables)
+    for table_name, table_object, columns, profile in tables:
+        group = build_table_entities(table_name, table_object, columns, gt, profile)
+        index.add_entities(group)
+        yield group
+
+
+def custom_sp_stage(source, gt, index):
+    if source.get("path"):
+        script = parse_file(source["path"])
+        yield build_sp_entities(script.name, resolve_datasets(script), gt, index)
+        return
+    directory = source.get("directory", "./DataSource/myCustomDatabase")
+    for name, datasets, error in parse_directory(directory, source.get("workers")):
+        if error:
+            print("Skipping a stored procedure that failed to parse:", error)
+            continue
+        try:
+            yield build_sp_entities(name, datasets, gt, index)
+        except ValueError as e:
+            print("Skipping a stored procedure with circular datasets:", name, e)
+
+
+def jobfile_stage(source, gt, index):
+    for path in source.get("paths", [JOB_FILE_PATH]):
+        # Loading the job checks that it's a valid graph
+        job = load_job_graph(path)
+        yield build_jobfile_entities(job, gt, index)
+
+
+def etl_api_stage(source, gt, index):
+    # The api is harvested concurrently (see `etl_api_harvester.py`) on this
+    # stage's own event loop.
+    async def harvested_jobs():
+        job_entities = []
+        job_ids = None if source.get("all_jobs") else source.get("jobs", ["001"])
+        async for job_id, response_json, error in harvest_jobs(
+                source.get("base_url", DEFAULT_BASE_URL), job_ids,
+                max_connections=source.get("max_connections", DEFAULT_MAX_CONNECTIONS)):
+            if error:
+                print("Skipping a job that couldn't be fetched:", job_id, error)
+                continue
+            job_entities.append(build_job_entities(response_json, gt, index))
+        return job_entities
+    return asyncio.run(harvested_jobs())
+
+
+SOURCE_TYPES = {
+    "sys_table": sys_table_stage,
+    "custom_sp": custom_sp_stage,
+    "jobfile": jobfile_stage,
+    "etl_api": etl_api_stage,
+}
+
+
+# The stored procedures and the system table are parsed in worker processes,
+# which (on Windows and macOS) import this script again, so everything below
+# only runs when it is the script being run.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run every ingestor as a stage of one pipeline")
+    parser.add_argument("config", nargs="?", default="./pipeline.json",
+                        help="The json config listing the sources")
+    parser.add_argument("--max-stages", type=int, default=None,
+                        help="How many stages may run at once (defaults to all of them)")
+    parser.add_argument("--state", default=DEFAULT_STATE_PATH,
+                        help="The local state store used for incremental ingestion")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="Upload every entity, even if it hasn't changed")
+    add_client_arguments(parser)
+    add_metrics_arguments(parser)
+    add_name_index_arguments(parser)
+    add_lineage_arguments(parser)
+    add_reconcile_arguments(parser)
+    args = parser.parse_args()
+
+    sources = load_pipeline_config(args.config, SOURCE_TYPES)
+
+    # The whole pipeline is one run: each stage is timed under its source's
+    # name and every request to Purview is measured (see `ingestor_metrics.py`).
+    metrics = IngestorMetrics("run_pipeline")
+
+    # One client for every stage, so the pipeline only authenticates once
+    # and every upload shares its pool of connections.
+    client = MeteredClient(client_from_args(args), metrics)
+
+    # One guidtracker for every stage too, so that no two entities get the
+    # same placeholder guid even though the stages run at the same time.
+    gt = SharedGuidTracker()
+
+    # And one index of the tables that were already ingested, by qualified
+    # name.
+    index = QualifiedNameIndex.from_state(args.name_index)
+
+    def stage_runner(source):
+        return lambda: SOURCE_TYPES[source["type"]](source, gt, index)
+
+    stages = [{"name": source["name"], "depends_on": source["depends_on"],
+               "run": stage_runner(source)} for source in sources]
+
+    def stage_done(name, result):
+        metrics.add_time("source " + name, result["seconds"])
+        if result["error"]:
+            print("Stage {} failed: {}".format(name, result["error"]))
+        else:
+            print("Stage {} found {} entities in {:.2f}s".format(
+                name, sum(len(g) for g in result["groups"]), result["seconds"]))
+
+    metrics.begin("stages")
+    results = run_stages(stages, args.max_stages, stage_done)
+
+    # Every stage's entities are merged: a table that several sources know
+    # about (say the system table and a stored procedure that reads it) is
+    # only sent once, and the processes refer to their inputs and outputs
+    # by qualified name.
+    metrics.begin("merge")
+    dataset_entities, process_entities = merge_stage_results(stages, results)
+    print("{} datasets and {} processes from {} sources".format(
+        len(dataset_entities), len(process_entities), len(stages)))
+    # With --lineage-index, the lineage of every source is also kept locally
+    # (see `ingestor_lineage.py`), whether or not it changed.
+    record_lineage(args.lineage_index, process_entities)
+
+    # Like the system table ingestor, only the new or changed entities are
+    # sent (see `ingestor_state.py`), across every source of the pipeline.
+    metrics.begin("state")
+    state = EntityStateStore(args.state, source="pipeline")
+    changed_datasets = state.filter_changed(dataset_entities)
+    changed_processes = state.filter_changed(process_entities)
+    # A table that a process only refers to (because it was already
+    # ingested) is still in use, so it isn't deleted.
+    state.keep(referenced_names(process_entities))
+    if not args.full_refresh:
+        dataset_entities, process_entities = changed_datasets, changed_processes
+    print("{} new or changed entities to upload".format(
+        len(dataset_entities) + len(process_entities)))
+
+    # The datasets go first so that the processes can refer to them.
+    metrics.begin("upload")
+    upload_results = upload_in_stages(client, dataset_entities, process_entities)
+
+    # A source whose stage failed wasn't seen at all this run, so its
+    # entities would all look deleted. They're only reported (and the state
+    # only committed) when every stage succeeded.
+    metrics.begin("state")
+    failed_stages = [name for name, result in results.items() if result["error"]]
+    if failed_stages:
+        print("Not committing the state because {} failed".format(", ".join(failed_stages)))
+    else:
+        deleted_entities = state.deleted()
+        print("{} entities deleted since the last run".format(len(deleted_entities)))
+        if deleted_entities and not args.reconcile:
+            print("They stay in Purview (and in the state) until a run with --reconcile")
+        if args.verbose:
+            print(json.dumps(deleted_entities, indent=2))
+        # With --reconcile they're deleted from Purview too (see
+        # `ingestor_reconcile.py`).
+        if args.reconcile and deleted_entities:
+            metrics.begin("reconcile")
+            report = reconcile_state(client, state, args.dry_run or bool(args.export),
+                                     args.delete_batch_size)
+            print(format_report(report))
+            forget_lineage(args.lineage_index, [d["qualifiedName"] for d in report["deleted"]])
+            metrics.begin("state")
+        # A dry run didn't upload anything, so it leaves the baseline alone.
+        if not args.dry_run:
+            state.commit(upload_results, forget_deleted=args.reconcile)
+
+    # Print out the results (all of them with -v)
+    if args.verbose:
+        print(json.dumps(upload_results, indent=2))
+    for failed in upload_results["failedBatches"]:
+        print("Batch {} failed: {}".format(failed["batch"], failed["error"]))
+    finish_metrics(metrics, args)
@@ -0,0 +1,200 @@
+import random
+
+import numpy as np
+
+from data_profiler import _rows_to_array, _type_of
+from sys_table_stream import JsonStream
+
+# This module works out the columns of a table from its data files, for
+# sources whose system table is incomplete (a table without any columns, or
+# with fewer columns than its rows have values) or missing altogether.
+# Like the profiler (see `data_profiler.py`), it reads the tables' part
+# files: json arrays of rows, where each row is an array of values.
+
+# The files are never loaded whole. The rows are streamed (see
+# `sys_table_stream.py`) into a fixed size reservoir sample, so every row
+# read has the same chance of being in the sample, and reading stops after
+# a bounded number of rows. The type checks then run over the whole sample
+# at once as numpy array operations:
+# * int: every value is a whole number (and not a bool).
+# * decimal: every value is a number. Like the system table, "precision" is
+#   the most digits after the decimal point and "length" the most digits.
+# * date / datetime: every value is a string like 2021-02-01 or
+#   2021-02-01T10:30:00 (or with a space instead of the T).
+# * boolean, and string for anything else (or a mix of types).
+
+DEFAULT_SAMPLE_SIZE = 1000
+# Rows read per table, at most. None reads every row.
+DEFAULT_MAX_ROWS = 100000
+
+_DATE_DIGITS = [0, 1, 2, 3, 5, 6, 8, 9]
+_TIME_DIGITS = [11, 12, 14, 15, 17, 18]
+
+
+def iter_rows(path, chunk_size=1 << 16):
+    """
+    Stream the rows of a part file one at a time.
+
+    :param str path: The part file, a json array of rows.
+    :rtype: Iterator(list)
+    """
+    with open(path) as fp:
+        yield from JsonStream(fp, chunk_size).iter_array()
+
+
+def sample_rows(paths, sample_size=DEFAULT_SAMPLE_SIZE, max_rows=DEFAULT_MAX_ROWS, seed=0,
+                errors=None):
+    """
+    Take a uniform random sample of the rows of a table's part files with
+    reservoir sampling.
+
+    :param list paths: The table's part files.
+    :param int sample_size: How many rows to keep.
+    :param int max_rows: Stop after reading this many rows (None for all).
+    :param int seed: The seed, so that runs on the same data agree.
+    :param list errors: If given, a part that is missing or isn't a json
+        array of rows is added to it and skipped (the rows read from it
+        before the error stay in the sample) rather than raised.
+    :return: The sample and the number of rows read.
+    :rtype: tuple(list(list), int)
+    """
+    rng = random.Random(seed)
+    sample = []
+    seen = 0
+    for path in paths:
+        try:
+            for row in iter_rows(path):
+                if max_rows is not None and seen >= max_rows:
+                    return sample, seen
+                if len(sample) < sample_size:
+                    sample.append(row)
+                else:
+                    slot = rng.randint(0, seen)
+                    if slot < sample_size:
+                        sample[slot] = row
+                seen += 1
+        except (OSError, ValueError) as e:
+            if errors is None:
+                raise
+            errors.append("{}: {}".format(path, e))
+    return sample, seen
+
+
+def _date_kind(strings):
+    # Compare the characters as numbers: a fixed width unicode array is
+    # a block of uint32 code points, one row per string.
+    lengths = np.char.str_len(strings)
+    if not np.all((lengths == 10) | (lengths == 19)):
+        return None
+    codes = strings.astype("U19").view(np.uint32).reshape(len(strings), 19)
+    digits = (codes >= ord("0")) & (codes <= ord("9"))
+    dates = (np.all(digits[:, _DATE_DIGITS], axis=1)
+             & (codes[:, 4] == ord("-")) & (codes[:, 7] == ord("-")))
+    month = (codes[:, 5] - ord("0")) * 10 + codes[:, 6] - ord("0")
+    day = (codes[:, 8] - ord("0")) * 10 + codes[:, 9] - ord("0")
+    dates &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    if not np.all(dates):
+        return None
+    if np.all(lengths == 10):
+        return "date"
+    times = (lengths == 19) & np.all(digits[:, _TIME_DIGITS], axis=1) \
+        & ((codes[:, 10] == ord("T")) | (codes[:, 10] == ord(" "))) \
+        & (codes[:, 13] == ord(":")) & (codes[:, 16] == ord(":"))
+    return "datetime" if np.all(times | (lengths == 10)) else None
+
+
+def _decimal_shape(numbers):
+    # The digits before and after the decimal point of each number, from
+    # its shortest string form (e.g. 12034.21 is 5 and 2).
+    strings = numbers.astype(str)
+    if np.any(np.char.find(strings, "e") >= 0) or np.any(np.char.find(strings, "n") >= 0):
+        return None
+    parts = np.char.partition(np.char.lstrip(strings, "-"), ".")
+    whole = np.char.str_len(parts[:, 0])
+    fraction = np.char.str_len(parts[:, 2])
+    return int(fraction.max()), int(whole.max() + fraction.max())
+
+
+def infer_column_type(values):
+    """
+    Infer the type of a column from a sample of its values.
+
+    :param values: An object array of the values (None is null).
+    :return: The type and any extra properties, like a column in the
+        system table (e.g. {"type": "decimal", "precision": 2, "length": 7}).
+    :rtype: dict
+    """
+    present = values[~np.equal(values, None)]
+    if not len(present):
+        return {"type": "string"}
+    kinds = _type_of(present)
+    if np.all(kinds == bool):
+        return {"type": "boolean"}
+    if np.all(kinds == int):
+        return {"type": "int"}
+    if np.all((kinds == int) | (kinds == float)):
+        shape = _decimal_shape(present)
+        if shape is None:
+            return {"type": "double"}
+        return {"type": "decimal", "precision": shape[0], "length": shape[1]}
+    if np.all(kinds == str):
+        date_kind = _date_kind(present.astype(str))
+        if date_kind:
+            return {"type": date_kind}
+    return {"type": "string"}
+
+
+def infer_columns(rows, sample_description=""):
+    """
+    Infer a table's columns from a sample of its rows. The columns are
+    named column1, column2 and so on in the order of the row's values.
+
+    :param list rows: The sampled rows.
+    :param str sample_description: Added to each column's description.
+    :rtype: list(dict)
+    """
+    array = _rows_to_array(rows)
+    columns = []
+    for position in range(array.shape[1]):
+        column = {"name": "column{}".format(position + 1)}
+        column.update(infer_column_type(array[:, position]))
+        column["description"] = "Inferred from the data" + sample_description
+        columns.append(column)
+    return columns
+
+
+def merge_columns(declared, inferred):
+    """
+    Merge the columns declared in the system table with the inferred ones.
+    The values of a row are in the order of the columns, so the declared
+    columns are kept as is and only the inferred columns past the end of
+    them are added.
+
+    :rtype: list(dict)
+    """
+    return list(declared) + list(inferred[len(declared):])
+
+
+def infer_table_columns(paths, declared=(), sample_size=DEFAULT_SAMPLE_SIZE,
+                        max_rows=DEFAULT_MAX_ROWS):
+    """
+    Sample a table's part files and merge the columns inferred from them
+    with the declared ones. Like the profiler, a part file that can't be
+    read is reported rather than raised: the columns are inferred from the
+    other parts, and if none could be read the declared columns are kept.
+
+    :param list paths: The table's part files.
+    :param list declared: The columns the system table declares.
+    :return: The merged columns, how many of them were inferred and the
+        errors of the part files that couldn't be read.
+    :rtype: tuple(list(dict), int, list(str))
+    """
+    if not paths:
+        return list(declared), 0, []
+    errors = []
+    sample, seen = sample_rows(paths, sample_size, max_rows, errors=errors)
+    if not sample:
+        return list(declared), 0, errors
+    description = " (a sample of {} of the first {} rows)".format(len(sample), seen)
+    merged = merge_columns(declared, infer_columns(sample, description))
+    return merged, len(merged) - len(declared), errors
@@ -0,0 +1,227 @@
+import json
+
+# Real system table exports can be several gigabytes. Calling `json.load` on
+# them means holding the whole document (and then every AtlasEntity built
+# from it) in memory at once. This module walks the export incrementally
+# instead: it reads the file in chunks and only ever decodes one table's
+# worth of columns at a time.
+
+# The export looks like:
+# {
+#     "containers": {...},
+#     "tables": {"tblName": {"description": "...", "container": "..."}, ...},
+#     "columns": {"tblName": [{"name": "...", "type": "..."}, ...], ...}
+# }
+# The "tables" section is small (a description per table) so I keep it in
+# memory. The "columns" section is the big one and is streamed.
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+class JsonStream():
+    """
+    A minimal incremental reader for a json document. It lets you iterate
+    over the keys of an object one at a time and then either decode, stream
+    or skip the value under each key.
+
+    :param fp: A file object opened in text mode.
+    :param int chunk_size: How many characters to read from the file at once.
+    """
+
+    def __init__(self, fp, chunk_size=1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        # How many characters were dropped from the front of the buffer
+        self.dropped = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        # Drop what has already been consumed so the buffer stays small
+        if self.pos > self.chunk_size:
+            self.buf = self.buf[self.pos:]
+            self.dropped += self.pos
+            self.pos = 0
+        chunk = self.fp.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buf += chunk
+        return bool(chunk)
+
+    def _mark(self):
+        # The absolute position in the document, used to tell if a value
+        # was consumed by the caller
+        return self.dropped + self.pos
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of json document")
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError("Expected '{}' but found '{}'".format(char, found))
+        self.pos += 1
+
+    def read_value(self):
+        """
+        Decode the complete json value at the current position.
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number at the end of the buffer (or cut at a "." or
+                # "e") may continue in the next chunk, so only trust it once
+                # the character after it is known.
+                if self.eof or (end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow geometrically so a large value isn't re-decoded too often
+            self._fill(max(self.chunk_size, len(self.buf) - self.pos))
+
+    def skip_value(self):
+        """
+        Move past the json value at the current position without building
+        it in memory.
+        """
+        if self._peek() not in "{[":
+            self.read_value()
+            return
+        depth, in_string, escaped = 0, False, False
+        while True:
+            if self.pos >= len(self.buf) and not self._fill():
+                raise ValueError("Unexpected end of json document")
+            char = self.buf[self.pos]
+            self.pos += 1
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in "{[":
+                depth += 1
+            elif char in "}]":
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def iter_keys(self):
+        """
+        Iterate over the keys of the object at the current position. After
+        each key the stream is positioned on its value, which the caller may
+        read with `read_value`, stream with `iter_keys` / `iter_items` or
+        leave alone (in which case it is skipped). A value that is only
+        partially consumed (e.g. a nested iteration that was abandoned
+        part way) leaves the stream in an undefined state.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self._expect(":")
+            marker = self._mark()
+            yield key
+            if self._mark() == marker:
+                self.skip_value()
+            separator = self._peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError("Expected ',' or '}}' but found '{}'".format(separator))
+
+    def iter_items(self):
+        """
+        Iterate over the (key, value) pairs of the object at the current
+        position, decoding one value at a time.
+        """
+        for key in self.iter_keys():
+            yield key, self.read_value()
+
+    def iter_array(self):
+        """
+        Iterate over the values of the array at the current position,
+        decoding one value at a time.
+        """
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value()
+            separator = self._peek()
+            self.pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError("Expected ',' or ']' but found '{}'".format(separator))
+
+
+def iter_system_tables(path, chunk_size=1 << 16):
+    """
+    Stream the tables of a system table export along with their columns.
+    Only one table's columns are decoded at a time.
+
+    Tables that have no entry under "columns" are yielded last with an empty
+    list of columns. Columns for a table that isn't listed under "tables"
+    are ignored. If "columns" comes before "tables" in the export, the file
+    is read a second time rather than holding the columns in memory.
+
+    :param str path: The path to the system table export (e.g. sys.json).
+    :param int chunk_size: How many characters to read from the file at once.
+    :return: A generator of (table name, table object, list of columns).
+    :rtype: Iterator(tuple(str, dict, list(dict)))
+    """
+    tables = None
+    columns_pending = False
+    seen = set()
+
+    with open(path) as fp:
+        stream = JsonStream(fp, chunk_size)
+        for key in stream.iter_keys():
+            if key == "tables":
+                tables = dict(stream.iter_items())
+            elif key == "columns" and tables is None:
+                # Skipped for now and streamed on a second pass below
+                columns_pending = True
+            elif key == "columns":
+                for table_name, columns in stream.iter_items():
+                    if table_name in tables:
+                        seen.add(table_name)
+                        yield table_name, tables[table_name], columns
+
+    if tables is None:
+        raise KeyError("The system table export has no 'tables' section")
+
+    if columns_pending:
+        with open(path) as fp:
+            stream = JsonStream(fp, chunk_size)
+            for key in stream.iter_keys():
+                if key != "columns":
+                    continue
+                for table_name, columns in stream.iter_items():
+                    if table_name in tables:
+                        seen.add(table_name)
+                        yield table_name, tables[table_name], columns
+
+    for table_name, table_object in tables.items():
+        if table_name not in seen:
+            yield table_name, table_object, []
@@ -0,0 +1,233 @@
+import difflib
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from ingestor_upload import error_status
+
+# This module keeps the custom types in Purview in sync with the ones defined
+# in `custom_types_for_ingestor.py` without forcing an update of every type on
+# every run. Each forced update invalidates the catalog's type cache, which is
+# expensive, and the types almost never change between deployments.
+
+# Each type def is reduced to a canonical form (its json with sorted keys and
+# attribute defs sorted by name) and fingerprinted. A sync then:
+# 1. Compares the fingerprints with a local cache of what was last synced to
+#    this account. If nothing changed, it's done without a single request.
+# 2. Otherwise, reads the changed types back from the server and compares
+#    only the fields we define (the server adds guids, versions, timestamps
+#    and computed relationship attributes of its own).
+# 3. Uploads the types that are new, and updates the ones that differ.
+
+DEFAULT_TYPEDEF_CACHE_PATH = "./.typedef_cache.json"
+
+TYPEDEF_NEW = "new"
+TYPEDEF_CHANGED = "changed"
+TYPEDEF_UNCHANGED = "unchanged"
+
+# The fields the server manages itself
+_SERVER_FIELDS = {"guid", "createdBy", "updatedBy", "createTime", "updateTime",
+                  "version", "typeVersion", "lastModifiedTS", "serviceType"}
+
+
+def _canonical(value):
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items()
+                if k not in _SERVER_FIELDS and v is not None}
+    if isinstance(value, list):
+        items = [_canonical(v) for v in value]
+        if all(isinstance(v, dict) and "name" in v for v in items):
+            return sorted(items, key=lambda v: v["name"])
+        if all(isinstance(v, str) for v in items):
+            return sorted(items)
+        return items
+    return value
+
+
+def canonical_typedef(typedef):
+    """
+    The canonical json form of a type def.
+
+    :param typedef: The type def to convert.
+    :type typedef: Union(dict, :class:`~pyapacheatlas.core.typedef.BaseTypeDef`)
+    :rtype: dict
+    """
+    if not isinstance(typedef, dict):
+        typedef = typedef.to_json()
+    return _canonical(typedef)
+
+
+def typedef_fingerprint(typedef):
+    """
+    A stable hash of a type def's canonical form.
+
+    :rtype: str
+    """
+    canonical = json.dumps(canonical_typedef(typedef), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _project(server_value, local_value):
+    """
+    Reduce the server's version of a type def to the fields we define, so
+    that what the server adds on its own doesn't count as a difference.
+    """
+    if isinstance(local_value, dict):
+        if not isinstance(server_value, dict):
+            return server_value
+        # A field the server doesn't return at all isn't something an update
+        # could change, so it counts as matching.
+        return {k: _project(server_value[k], v) if k in server_value else v
+                for k, v in local_value.items()}
+    if isinstance(local_value, list) and all(
+            isinstance(v, dict) and "name" in v for v in local_value):
+        if not isinstance(server_value, list):
+            return server_value
+        # Attributes the server has that we don't define can't be removed
+        # by an update anyway, so only ours are compared.
+        server_by_name = {v.get("name"): v for v in server_value if isinstance(v, dict)}
+        return [_project(server_by_name.get(v["name"]), v) for v in local_value
+                if v["name"] in server_by_name]
+    return server_value
+
+
+def _is_not_found(error):
+    return error_status(error) == 404
+
+
+def _read_cache(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(path, cache):
+    with open(path + ".tmp", "w") as fp:
+        json.dump(cache, fp, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _diff(name, server, local):
+    return "".join(difflib.unified_diff(
+        json.dumps(server, indent=2, sort_keys=True).splitlines(True),
+        json.dumps(local, indent=2, sort_keys=True).splitlines(True),
+        fromfile="purview/" + name, tofile="local/" + name))
+
+
+def compare_typedefs(client, typedefs, max_workers=4):
+    """
+    Compare type defs with their versions on the server.
+
+    :param client: The AtlasClient or PurviewClient to read from.
+    :param dict typedefs: The local type defs by category (e.g. entityDefs,
+        relationshipDefs), as you would pass them to `upload_typedefs`.
+    :return: For each type name, its category, status (TYPEDEF_NEW,
+        TYPEDEF_CHANGED or TYPEDEF_UNCHANGED) and a unified diff.
+    :rtype: dict(str, dict)
+    """
+    # Only a run that has to talk to the server pays for these imports
+    import requests
+    from pyapacheatlas.core.util import AtlasException
+
+    local = [(category, canonical_typedef(t)) for category, defs in typedefs.items()
+             for t in defs]
+
+    def server_version(name):
+        try:
+            return client.get_typedef(name=name)
+        except (AtlasException, requests.RequestException) as e:
+            if _is_not_found(e):
+                return None
+            raise
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        server = list(executor.map(server_version, [t["name"] for _, t in local]))
+
+    comparison = {}
+    for (category, typedef), server_typedef in zip(local, server):
+        name = typedef["name"]
+        if server_typedef is None:
+            comparison[name] = {"category": category, "status": TYPEDEF_NEW,
+                                "diff": _diff(name, {}, typedef)}
+            continue
+        projected = _canonical(_project(server_typedef, typedef))
+        if projected == typedef:
+            comparison[name] = {"category": category, "status": TYPEDEF_UNCHANGED, "diff": ""}
+        else:
+            comparison[name] = {"category": category, "status": TYPEDEF_CHANGED,
+                                "diff": _diff(name, projected, typedef)}
+    return comparison
+
+
+def sync_typedefs(client, typedefs, cache_path=DEFAULT_TYPEDEF_CACHE_PATH, dry_run=False,
+                  check_server=False):
+    """
+    Upload only the type defs that are new or changed.
+
+    :param client: The AtlasClient or PurviewClient to sync with.
+    :param dict typedefs: The type defs by category (e.g. entityDefs,
+        relationshipDefs), as you would pass them to `upload_typedefs`.
+    :param str cache_path: The local cache of the fingerprints last synced
+        to each account. None disables the cache.
+    :param bool dry_run: Compare with the server but don't upload anything.
+    :param bool check_server: Compare with the server even when the local
+        cache says nothing changed (e.g. someone edited the types by hand).
+    :return: The status of every type, the diffs of those that aren't in
+        sync and the results of the uploads.
+    :rtype: dict
+    """
+    def name_of(typedef):
+        return canonical_typedef(typedef)["name"]
+
+    fingerprints = {name_of(t): typedef_fingerprint(t)
+                    for defs in typedefs.values() for t in defs}
+    cache = _read_cache(cache_path) if cache_path else {}
+    account = client.endpoint_url
+    synced = cache.get(account, {})
+
+    if not check_server and all(synced.get(n) == f for n, f in fingerprints.items()):
+        return {"types": {n: TYPEDEF_UNCHANGED for n in fingerprints}, "diffs": {},
+                "uploaded": {}, "checkedServer": False}
+
+    # Only the types that aren't known to be in sync are read back
+    to_check = {
+        category: [t for t in defs
+                   if check_server or synced.get(name_of(t)) != fingerprints[name_of(t)]]
+        for category, defs in typedefs.items()
+    }
+    comparison = compare_typedefs(client, to_check)
+    results = {
+        "types": {n: TYPEDEF_UNCHANGED for n in fingerprints},
+        "diffs": {n: c["diff"] for n, c in comparison.items() if c["diff"]},
+        "uploaded": {},
+        "checkedServer": True
+    }
+    results["types"].update({n: c["status"] for n, c in comparison.items()})
+    if dry_run:
+        return results
+
+    def defs_with_status(status):
+        selected = {}
+        for category, defs in to_check.items():
+            chosen = [t for t in defs if comparison[name_of(t)]["status"] == status]
+            if chosen:
+                selected[category] = chosen
+        return selected
+
+    # New types can be created in one plain upload. Only the changed ones
+    # need the (more expensive) forced update.
+    new_defs = defs_with_status(TYPEDEF_NEW)
+    if new_defs:
+        results["uploaded"][TYPEDEF_NEW] = client.upload_typedefs(**new_defs)
+    changed_defs = defs_with_status(TYPEDEF_CHANGED)
+    if changed_defs:
+        results["uploaded"][TYPEDEF_CHANGED] = client.upload_typedefs(
+            force_update=True, **changed_defs)
+
+    if cache_path:
+        cache[account] = fingerprints
+        _write_cache(cache_path, cache)
+    return results
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+
+from pyapacheatlas.core.util import GuidTracker
+
+from custom_sp_parser import parse_file, resolve_datasets
+from etl_jobfile_parser import load_job_graph
+from ingestor_client import add_client_arguments, client_from_args
+from ingestor_lineage import add_lineage_arguments, record_lineage
+from ingestor_metrics import IngestorMetrics, MeteredClient, add_metrics_arguments
+from ingestor_names import QualifiedNameIndex, add_name_index_arguments
+from ingestor_state import DEFAULT_STATE_PATH, EntityStateStore
+from ingestor_upload import merge_entity_lists, upload_in_stages
+from ingestor_watch import (
+    DEFAULT_DEBOUNCE_SECONDS,
+    DEFAULT_MAX_DELAY_SECONDS,
+    DEFAULT_POLL_SECONDS,
+    debounced_changes,
+    make_watcher
+)
+from parse_custom_sp import build_sp_entities
+from parse_datasource_sys_table import build_table_entities
+from parse_etlserver_jobfile import build_jobfile_entities
+
+# This script keeps running and re-ingests source files as soon as they
+# change, rather than waiting for someone (or the nightly schedule) to run
+# the matching ingestor over everything again:
+#   python watch_sources.py ./ETLTool/jobs ./DataSource/myCustomDatabase
+# The directories are watched with inotify, or polled where that isn't
+# available (see `ingestor_watch.py`). Each batch of changed files is routed
+# to the ingestor that understands it:
+# * *.xml: a job file, see `parse_etlserver_jobfile.py`.
+# * *.custom: a stored procedure, see `parse_custom_sp.py`.
+# * sys.json: a system table export, see `parse_datasource_sys_table.py`.
+# Only the changed files are parsed and only their entities are uploaded:
+# the system table goes through the same state store as its own ingestor, so
+# only its new or changed tables and columns are sent, and the processes of
+# job files and stored procedures refer to tables that were already ingested
+# instead of sending them again (see `ingestor_names.py`).
+# Removing a job file or stored procedure doesn't remove anything from
+# Purview.
+
+SYSTEM_TABLE_NAME = "sys.json"
+
+
+def route(path):
+    """
+    :return: Which ingestor a file belongs to: "sys_table", "custom_sp",
+        "jobfile" or None for a file no ingestor reads.
+    :rtype: str
+    """
+    if os.path.basename(path) == SYSTEM_TABLE_NAME:
+        return "sys_table"
+    if path.endswith(".custom"):
+        return "custom_sp"
+    if path.endswith(".xml"):
+        return "jobfile"
+    return None
+
+
+def system_table_entities(path, gt, state, index):
+    # The whole export is one snapshot of the database, so all of it is
+    # rebuilt and the state store picks out what changed.
+    with open(path) as fp:
+        system_table = json.load(fp)
+    entities = []
+    for table_name, table_object in system_table["tables"].items():
+        group = build_table_entities(table_name, table_object,
+                                     system_table["columns"].get(table_name, []), gt)
+        index.add_entities(group)
+        entities.extend(group)
+    changed = state.filter_changed(entities)
+    print("{}: {} new or changed tables and columns, {} deleted".format(
+        path, len(changed), len(state.deleted())))
+    return changed
+
+
+def stored_procedure_entities(path, gt, index):
+    script = parse_file(path)
+    return build_sp_entities(script.name, resolve_datasets(script), gt, index)
+
+
+def job_file_entities(path, gt, index):
+    # Loading the job checks that it's a valid graph
+    job = load_job_graph(path)
+    return build_jobfile_entities(job, gt, index)
+
+
+def ingest_changes(paths, client, state, index, dry_run=False, lineage_index=None):
+    """
+    Parse the changed files and upload their entities.
+
+    :param paths: The paths of the changed files.
+    :param str lineage_index: Also record the lineage of the changed jobs
+        and stored procedures in this local index (see `ingestor_lineage.py`).
+    :return: The merged upload results.
+    :rtype: dict
+    """
+    gt = GuidTracker()
+    system_table_changed = False
+    system_tables = []
+    process_entities = []
+    for path in sorted(paths):
+        kind = route(path)
+        if kind is None:
+            continue
+        if not os.path.exists(path):
+            print("{} was removed".format(path))
+            continue
+        # A file that's broken (or was caught half written) is skipped until
+        # its next change, the watch carries on.
+        try:
+            if kind == "sys_table":
+                system_table_changed = True
+                system_tables.extend(system_table_entities(path, gt, state, index))
+            elif kind == "custom_sp":
+                process_entities.append(stored_procedure_entities(path, gt, index))
+            else:
+                process_entities.append(job_file_entities(path, gt, index))
+        except Exception as e:
+            print("Skipping {}: {}: {}".format(path, type(e).__name__, e))
+
+    # The tables of the system table go first, then any new datasets of the
+    # stored procedures and jobs and finally the processes, which refer to
+    # the datasets by qualified name.
+    datasets, processes = merge_entity_lists(process_entities)
+    record_lineage(lineage_index, processes)
+    results = upload_in_stages(client, system_tables, datasets, processes)
+    # Only the system table is tracked in the state store. A dry run didn't
+    # upload anything, so it leaves the baseline alone.
+    if system_table_changed:
+        if dry_run:
+            state.discard()
+        else:
+            state.commit(results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-ingest source files as soon as they change")
+    parser.add_argument("directories", nargs="*",
+                        default=["./ETLTool/jobs", "./DataSource/myCustomDatabase"],
+                        help="The directories to watch")
+    parser.add_argument("--poll", action="store_true",
+                        help="Poll the directories even where inotify is available")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_SECONDS,
+                        help="The seconds between scans when polling")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE_SECONDS,
+                        help="Wait until nothing has changed for this many seconds")
+    parser.add_argument("--max-delay", type=float, default=DEFAULT_MAX_DELAY_SECONDS,
+                        help="Ingest the changes after this many seconds even if they keep coming")
+    parser.add_argument("--initial-scan", action="store_true",
+                        help="Ingest every file once before watching for changes")
+    parser.add_argument("--state", default=DEFAULT_STATE_PATH,
+                        help="The local state store used for incremental ingestion")
+    add_client_arguments(parser)
+    add_metrics_arguments(parser)
+    add_name_index_arguments(parser)
+    add_lineage_arguments(parser)
+    args = parser.parse_args()
+
+    # The metrics add up over the whole watch and are written after every
+    # batch, so --prometheus-textfile always has the latest numbers.
+    metrics = IngestorMetrics("watch_sources")
+    # One client for the whole watch, so its token and connections are
+    # reused from one batch to the next (see `ingestor_client.py`).
+    client = MeteredClient(client_from_args(args), metrics)
+    state = EntityStateStore(args.state, source="myCustomDatabase")
+    index = QualifiedNameIndex.from_state(args.name_index)
+
+    def ingest(paths):
+        with metrics.stage("ingest"):
+            results = ingest_changes(paths, client, state, index, args.dry_run,
+                                     args.lineage_index)
+        if args.verbose:
+            print(json.dumps(results, indent=2))
+        for failed in results["failedBatches"]:
+            print("Batch {} failed: {}".format(failed["batch"], failed["error"]))
+        if args.verbose > 1:
+            print(metrics.format_summary())
+        metrics.write(args.metrics_report, args.prometheus_textfile)
+
+    watcher = make_watcher(args.directories, args.poll, args.poll_interval)
+    if args.initial_scan:
+        ingest([os.path.join(directory, name)
+                for root in args.directories
+                for directory, _, files in os.walk(root) for name in files])
+
+    print("Watching {} for changes ({})".format(
+        ", ".join(args.directories), type(watcher).__name__))
+    try:
+        for changed in debounced_changes(watcher, args.debounce, args.max_delay):
+            relevant = [path for path in changed if route(path)]
+            if relevant:
+                print("{} changed file(s)".format(len(relevant)))
+                ingest(relevant)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        metrics.finish()
+        print(metrics.format_summary())